@@ -1,141 +1,190 @@
 # -----------------------------------------------------------------------------
 # (C) 2023 Higor Grigorio (higorgrigorio@gmail.com)  (MIT License)
 # -----------------------------------------------------------------------------
+import multiprocessing
+import os
+import time
 from random import choice
 
 import numpy as np
 
+import book
+import engine
+import tablebase
+import transposition
+from evaluation import SQUARE_SCORE, get_score
+from transposition import EXACT, LOWER, UPPER, NO_MOVE
+
 # controls the depth of the search tree
 DEPTH = 4
 
+# smart_move deepens the search one ply at a time until the time budget (in
+# seconds) or MAX_DEPTH runs out, and plays the best move of the last finished depth
+TIME_LIMIT = 2.0
+MAX_DEPTH = 64
+
+# size of the transposition table shared by the searches, in megabytes, and a
+# switch to search without it (to compare node counts)
+TT_SIZE_MB = 16
+USE_TRANSPOSITION_TABLE = True
+
+# search the hash move, then captures by MVV-LVA, then killer moves and then the
+# rest by history score, instead of the order the moves were generated in
+USE_MOVE_ORDERING = True
+
+# at depth 0 keep searching captures and promotions until the position is quiet,
+# so a leaf is never evaluated in the middle of an exchange. Delta pruning skips
+# the captures that can't raise the score up to alpha even with DELTA_MARGIN
+# added to the value of the captured piece
+USE_QUIESCENCE = True
+DELTA_MARGIN = 2
+
+# selective search. Null move pruning: before its moves, a node lets the opponent
+# move twice (a pass) and searches that NULL_MOVE_REDUCTION plies shallower, if
+# the opponent still can't get under beta the node is cut off. Late move
+# reductions: the quiet moves after the first LMR_FULL_MOVES are searched
+# LMR_REDUCTION plies shallower with a null window at alpha, and again at full
+# depth only when they beat alpha. Neither is done in check, null moves are not
+# done without pieces besides pawns (zugzwang, where passing would be the best
+# move) or when the reduced search would only be the quiescence search, which
+# doesn't see quiet mate threats, and checking moves are never reduced
+USE_NULL_MOVE = True
+NULL_MOVE_REDUCTION = 2
+USE_LMR = True
+LMR_FULL_MOVES = 3
+LMR_MIN_DEPTH = 3
+LMR_REDUCTION = 1
+NULL_WINDOW = 1e-6  # width of a null window, below any difference between two scores
+
+# principal variation search: the first move of a node gets the full window, the
+# others a null window at alpha that only proves they are not better, and are
+# searched again with the full window when they are. Aspiration windows: from
+# the second iteration on the root searches ASPIRATION_WINDOW around the score
+# of the iteration before, and widens the side that fails (4 times each time)
+USE_PVS = True
+USE_ASPIRATION = True
+ASPIRATION_WINDOW = 1.0  # a pawn
+
+# root splitting: with more than one worker, find_best_move searches the first
+# root move itself and hands the other ones out to a pool of that many processes,
+# which share the best score found so far (alpha) through shared memory. With one
+# worker the search stays in the calling process and is deterministic
+SEARCH_WORKERS = 1
+
+# the search reads the score GameState keeps up to date on every move, with this
+# set it also recomputes the score of every leaf and fails if the two differ
+DEBUG_INCREMENTAL_EVAL = False
+
+# a Polyglot opening book (see book.py), smart_move plays its moves without
+# searching while the game is in the book. The file is memory mapped the first
+# time it is needed, the engine plays without a book when it doesn't exist
+USE_OPENING_BOOK = True
+BOOK_PATH = 'book.bin'
+
+# endgame tablebases (see tablebase.py): with few enough pieces left smart_move
+# plays the move of the tables, and the search takes the table value of those
+# positions instead of searching them. A won position scores TABLEBASE_WIN less
+# the plies to the mate, so the search still heads for the shortest one
+USE_TABLEBASES = True
+TABLEBASE_WIN = 1000
+
 CHECKMATE = float('inf')
 STALEMATE = 0
 
-KNIGHT_SCORE = np.array([
-    [1, 1, 1, 1, 1, 1, 1, 1],
-    [2, 2, 2, 2, 2, 2, 2, 1],
-    [1, 2, 3, 3, 3, 3, 2, 1],
-    [1, 2, 3, 4, 4, 3, 2, 1],
-    [1, 2, 3, 4, 4, 3, 2, 1],
-    [1, 2, 3, 3, 3, 3, 2, 1],
-    [1, 2, 2, 2, 2, 2, 2, 1],
-    [1, 1, 1, 1, 1, 1, 1, 1]
-])
-
-BISHOP_SCORE = np.array([
-    [4, 3, 2, 1, 1, 2, 3, 4],
-    [3, 4, 3, 2, 2, 3, 4, 3],
-    [2, 3, 4, 3, 3, 4, 3, 2],
-    [1, 2, 3, 4, 4, 3, 2, 1],
-    [1, 2, 3, 4, 4, 3, 2, 1],
-    [2, 3, 4, 3, 3, 4, 3, 2],
-    [3, 4, 3, 2, 2, 3, 4, 3],
-    [4, 3, 2, 1, 1, 2, 3, 4]
-])
-
-ROOK_SCORE = np.array([
-    [4, 3, 4, 4, 4, 4, 3, 4],
-    [4, 4, 4, 4, 4, 4, 4, 4],
-    [1, 1, 2, 3, 3, 2, 1, 1],
-    [1, 2, 3, 4, 4, 3, 2, 1],
-    [1, 2, 3, 4, 4, 3, 2, 1],
-    [1, 1, 2, 3, 3, 2, 1, 1],
-    [4, 4, 4, 4, 4, 4, 4, 4],
-    [4, 3, 4, 4, 4, 4, 3, 4]
-])
-
-QUEEN_SCORE = np.array([
-    [4, 3, 2, 1, 1, 2, 3, 4],
-    [3, 4, 3, 2, 2, 3, 4, 3],
-    [2, 3, 4, 3, 3, 4, 3, 2],
-    [1, 2, 3, 4, 4, 3, 2, 1],
-    [1, 2, 3, 4, 4, 3, 2, 1],
-    [2, 3, 4, 3, 3, 4, 3, 2],
-    [3, 4, 3, 2, 2, 3, 4, 3],
-    [4, 3, 2, 1, 1, 2, 3, 4]
-])
-
-KING_SCORE = np.array([
-    [4, 3, 2, 1, 1, 2, 3, 4],
-    [3, 4, 3, 2, 2, 3, 4, 3],
-    [2, 3, 4, 3, 3, 4, 3, 2],
-    [1, 2, 3, 4, 4, 3, 2, 1],
-    [1, 2, 3, 4, 4, 3, 2, 1],
-    [2, 3, 4, 3, 3, 4, 3, 2],
-    [3, 4, 3, 2, 2, 3, 4, 3],
-    [4, 3, 2, 1, 1, 2, 3, 4]
-])
-
-WHITE_PAWN_SCORE = np.array([
-    [8, 8, 8, 8, 8, 8, 8, 8],
-    [8, 8, 8, 8, 8, 8, 8, 8],
-    [5, 6, 6, 7, 7, 6, 6, 5],
-    [2, 3, 3, 5, 5, 3, 3, 2],
-    [1, 2, 3, 4, 4, 3, 2, 1],
-    [1, 1, 2, 3, 3, 2, 1, 1],
-    [.5, .5, 1, 2, 2, 1, .5, .5],
-    [0, 0, 0, 0, 0, 0, 0, 0]
-])
-
-BLACK_PAWN_SCORE = np.array([
-    [0, 0, 0, 0, 0, 0, 0, 0],
-    [.5, .5, 1, 2, 2, 1, .5, .5],
-    [1, 1, 2, 3, 3, 2, 1, 1],
-    [1, 2, 3, 4, 4, 3, 2, 1],
-    [2, 3, 3, 5, 5, 3, 3, 2],
-    [5, 6, 6, 7, 7, 6, 6, 5],
-    [8, 8, 8, 8, 8, 8, 8, 8],
-    [8, 8, 8, 8, 8, 8, 8, 8]
-])
-
-PIECE_SCORE = {
-    'bN': KNIGHT_SCORE,
-    'wN': KNIGHT_SCORE,
-    'wB': BISHOP_SCORE,
-    'bB': BISHOP_SCORE,
-    'wR': ROOK_SCORE,
-    'bR': ROOK_SCORE,
-    'wQ': QUEEN_SCORE,
-    'bQ': QUEEN_SCORE,
-    'wK': KING_SCORE,
-    'bK': KING_SCORE,
-    'wp': WHITE_PAWN_SCORE,
-    'bp': BLACK_PAWN_SCORE
-}
-
 
 def _random_move(moves):
     return choice(moves)
 
 
-MATERIAL = {
-    "p": 1,  # pawn
-    "N": 3,  # knight
-    "B": 3,  # bishop
-    "R": 5,  # rook
-    "Q": 10,  # queen
-    "K": 0  # king
-}
+opening_book = None
 
 
-def _get_score(square, x, y):
-    if square == '--':
-        return 0
+def book_move(gs, moves):
+    # a move of the opening book for the position, or None
+    global opening_book
+    if not USE_OPENING_BOOK:
+        return None
+    if opening_book is None:
+        if not os.path.exists(BOOK_PATH):
+            return None
+        opening_book = book.OpeningBook(BOOK_PATH)
+    return opening_book.choose_move(gs, moves)
 
-    color = square[0]
-    piece = square[1]
 
-    if color == 'w':
-        return MATERIAL[piece] + PIECE_SCORE[square][x, y]
-    else:
-        return -MATERIAL[piece] - PIECE_SCORE[square][x, y]
+def tablebase_move(gs, moves):
+    if not USE_TABLEBASES or len(gs.piece_locations['w']) + len(gs.piece_locations['b']) > tablebase.max_pieces():
+        return None
+    return tablebase.best_move(gs, moves)
+
+
+def known_move(gs, moves):
+    # the move of the opening book or of the tablebases, played without a search
+    move = book_move(gs, moves)
+    return move if move is not None else tablebase_move(gs, moves)
+
+
+def _tablebase_score(value, ply):
+    # the score of a tablebase value ply plies away from the root
+    if value > 0:
+        return TABLEBASE_WIN - (tablebase.MATE - value) - ply
+    elif value < 0:
+        return -TABLEBASE_WIN + (tablebase.MATE + value) + ply
+    return STALEMATE
+
+
+# a tablebase score counts the plies to the mate from the root, the transposition
+# table keeps it counted from the position instead, which can come up again at
+# another distance from the root (in this search or the next one). Scores past
+# TABLEBASE_BOUND are tablebase scores, checkmates are infinite at any distance
+TABLEBASE_BOUND = TABLEBASE_WIN / 2
+
+
+def _score_to_table(score, ply):
+    if score > TABLEBASE_BOUND:
+        return score + ply
+    elif score < -TABLEBASE_BOUND:
+        return score - ply
+    return score
+
+
+def _score_from_table(score, ply):
+    if score > TABLEBASE_BOUND:
+        return score - ply
+    elif score < -TABLEBASE_BOUND:
+        return score + ply
+    return score
+
+
+# score of every mailbox piece code on every mailbox square, positive for white
+# pieces and negative for black ones, so the mailbox backend evaluates a board
+# with one table lookup per square instead of going through np.vectorize
+MAILBOX_SCORE = [[0] * 120 for _ in range(engine.OFFBOARD + 1)]
+for _piece, _code in engine.PIECE_CODES.items():
+    if _piece != '--':
+        for _square in engine.BOARD_SQUARES:
+            _x, _y = engine.SQUARE_TO_RC[_square]
+            MAILBOX_SCORE[_code][_square] = SQUARE_SCORE[_piece][_x * 8 + _y]
+
+
+def _eval_mailbox(squares):
+    score = 0
+    for square in engine.BOARD_SQUARES:
+        piece = squares[square]
+        if piece:
+            score += MAILBOX_SCORE[piece][square]
+    return score
 
 
 def _eval_material(board):
+    if isinstance(board, engine.MailboxBoard):
+        return _eval_mailbox(board.squares)
+
     x_axis = np.where(board != '--')[0]
     y_axis = np.where(board != '--')[1]
 
-    return np.sum(np.vectorize(_get_score)(
+    # otypes keeps the half point pawn scores, otherwise np.vectorize takes the
+    # output type from the first piece and truncates them when it is an integer
+    return np.sum(np.vectorize(get_score, otypes=[float])(
         # fiter only the pieces that are not empty
         board[x_axis, y_axis],
         # get the x axis
@@ -145,6 +194,20 @@ def _eval_material(board):
     ))
 
 
+def _notation(move):
+    # the log of the game holds Move objects, the moves of the search are packed
+    return (engine.Move.from_packed(move) if type(move) is int else move).get_chess_notation()
+
+
+def _evaluate(gs):
+    if DEBUG_INCREMENTAL_EVAL:
+        full_score = _eval_material(gs.board)
+        if gs.score != full_score:
+            raise AssertionError(f'incremental score {gs.score} != full score {full_score} '
+                                 f'after {[_notation(move) for move in gs.move_log]}')
+    return gs.score
+
+
 def _eval_board(gs):
     if gs.checkmate:
         if gs.white_to_move:
@@ -214,34 +277,601 @@ def _negamax(gs, valid_moves, depth, white_to_move):
     return max_score
 
 
-def _ab_negamax(gs, valid_moves, depth, turn_mult, alpha, beta):
+transposition_table = transposition.TranspositionTable(TT_SIZE_MB)
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+# state of the running search: the depth of the current iteration, the nodes
+# searched so far and the budget, checked at every node of _ab_negamax
+root_depth = DEPTH
+root_ply = 0
+nodes = 0
+deadline = None
+node_limit = None
+tablebase_pieces = 0  # positions with up to this many pieces are probed, 0 for none
+
+# the principal variation of every ply of the running search, each node puts its
+# best move in front of the line of the child it came from, packed
+pv_table = [()] * (MAX_DEPTH + 2)
+
+# the stats.SearchStats of the running search, None when it collects none
+running_stats = None
+
+# the methods of the GameState timed by a search that collects stats, by phase
+TIMED_METHODS = {
+    'get_valid_moves': 'move_generation',
+    'make_move': 'make_undo',
+    'undo_move': 'make_undo',
+    'make_null_move': 'make_undo',
+    'undo_null_move': 'make_undo',
+}
+
+# set by a caller that can stop the search from outside (the engine worker), a
+# function polled every STOP_POLL_INTERVAL nodes, the search stops when it returns True
+stop_requested = None
+STOP_POLL_INTERVAL = 1024
+
+# the search runs on packed moves (see engine.Move), ints with the piece codes
+# in them. The mailbox and bitboard backends make them as they are, the array
+# backend builds a Move object for each move it makes
+ID_MASK = engine.Move.ID_MASK
+MOVED_SHIFT = engine.MOVED_SHIFT
+CAPTURED_SHIFT = engine.CAPTURED_SHIFT
+PROMOTION = engine.PROMOTION_MOVE
+
+# move ordering: the order values of the piece types for MVV-LVA (most valuable
+# victim, least valuable attacker), two killer move ids per ply (quiet moves
+# that caused a beta cutoff at that ply) and the history score by move id
+ORDER_VALUE = [0, 1, 3, 3, 5, 9, 10]  # by piece type, engine.PAWN to engine.KING
+HASH_MOVE_ORDER = 1 << 30
+CAPTURE_ORDER = 1 << 29
+KILLER_ORDER = 1 << 28
+
+killer_moves = [[NO_MOVE, NO_MOVE] for _ in range(MAX_DEPTH + 1)]
+history = [0] * (1 << 15)  # indexed by move_id
+
+
+def _mvv_lva(move):
+    captured = move >> CAPTURED_SHIFT
+    if not captured:
+        return 0
+    return ORDER_VALUE[captured & 7] * 16 - ORDER_VALUE[move >> MOVED_SHIFT & 7]
+
+
+def _order_moves(moves, hash_move_id, ply):
+    # sorts the move list in place, the best candidates first
+    killer_0, killer_1 = killer_moves[ply]
+
+    def _order(move):
+        move_id = move & ID_MASK
+        if move_id == hash_move_id:
+            return HASH_MOVE_ORDER
+        elif move >> CAPTURED_SHIFT:
+            return CAPTURE_ORDER + _mvv_lva(move)
+        elif move_id == killer_0:
+            return KILLER_ORDER + 1
+        elif move_id == killer_1:
+            return KILLER_ORDER
+        return history[move_id]
+
+    moves.sort(key=_order, reverse=True)
+    return moves
+
+
+def _update_killers_and_history(move, depth, ply):
+    # a quiet move that refuted the position is worth trying early at the same ply
+    # elsewhere in the tree, and in general, weighted by the depth it worked at
+    if move >> CAPTURED_SHIFT:
+        return
+    move_id = move & ID_MASK
+    killers = killer_moves[ply]
+    if killers[0] != move_id:
+        killers[1] = killers[0]
+        killers[0] = move_id
+    history[move_id] += depth * depth
+
+
+def _clear_move_ordering():
+    for killers in killer_moves:
+        killers[0] = killers[1] = NO_MOVE
+    history[:] = [0] * len(history)
+
+
+def _check_budget():
+    global nodes
+    nodes += 1
+    if node_limit is not None and nodes > node_limit:
+        raise SearchTimeout()
+    if deadline is not None and nodes & 63 == 0 and time.perf_counter() >= deadline:
+        raise SearchTimeout()
+    if stop_requested is not None and nodes % STOP_POLL_INTERVAL == 0 and stop_requested():
+        raise SearchTimeout()
+
+
+def _capture_gain(move):
+    # what the capture takes off the board: the material and square score of the victim
+    return abs(SQUARE_SCORE[engine.CODE_PIECES[move >> CAPTURED_SHIFT]][move >> 6 & 63])
+
+
+def _quiescence(gs, turn_mult, alpha, beta):
+    _check_budget()
+    if running_stats is not None:
+        running_stats.quiescence_nodes += 1
+
+    valid_moves = gs.get_valid_moves(captures_only=True, packed=True)
+    in_check = gs.in_check  # the children overwrite gs.in_check
+    if in_check:
+        # no standing pat when in check, every way out of it is searched
+        valid_moves = gs.get_valid_moves(packed=True)
+        if len(valid_moves) == 0:
+            return -CHECKMATE
+        stand_pat = max_score = -CHECKMATE
+    else:
+        # the side to move can always stop capturing and keep the static score
+        stand_pat = max_score = _evaluate(gs) * turn_mult
+        if stand_pat >= beta:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+
+    valid_moves.sort(key=_mvv_lva, reverse=True)
+    for move in valid_moves:
+        if not in_check and not move & PROMOTION and \
+                stand_pat + _capture_gain(move) + DELTA_MARGIN <= alpha:
+            continue
+        gs.make_move(move)
+        score = -_quiescence(gs, -turn_mult, -beta, -alpha)
+        gs.undo_move()
+
+        if score > max_score:
+            max_score = score
+        if max_score > alpha:
+            alpha = max_score
+        if alpha >= beta:
+            break
+
+    return max_score
+
+
+def _ab_negamax(gs, valid_moves, depth, ply, turn_mult, alpha, beta, allow_null=True):
+    # ply is the distance from the root, the null move counts as one though it
+    # isn't in the move log
     global next_move
 
+    pv_table[ply] = ()
+
+    # a repetition or the fifty-move rule ends the line in a draw, one earlier
+    # occurrence is enough, repeating it again can't get more out of the position.
+    # It takes 4 plies without a capture or pawn move to get back to a position.
+    # Tested before the horizon, a leaf can be a repetition too
+    if depth != root_depth and gs.halfmove_clock >= 4 and (gs.halfmove_clock >= 100 or gs.repetitions()):
+        return STALEMATE
+
+    if depth == 0:
+        if running_stats is not None:
+            running_stats.leaf_nodes += 1
+        if USE_QUIESCENCE:
+            return _quiescence(gs, turn_mult, alpha, beta)
+
+    _check_budget()
+
     if depth == 0:
-        return _eval_material(gs.board) * turn_mult
+        return _evaluate(gs) * turn_mult
+
+    if tablebase_pieces and depth != root_depth and \
+            len(gs.piece_locations['w']) + len(gs.piece_locations['b']) <= tablebase_pieces:
+        value = tablebase.probe(gs)
+        if value is not None:
+            return _tablebase_score(value, ply)
+
+    # a position already searched at least this deep is answered from the table,
+    # except at the root, which still has to pick next_move
+    alpha_orig = alpha
+    hash_move_id = NO_MOVE
+    entry = transposition_table.probe(gs.zobrist_key) if USE_TRANSPOSITION_TABLE else None
+    if entry is not None:
+        entry_depth, entry_score, entry_bound, hash_move_id = entry
+        entry_score = _score_from_table(entry_score, ply)
+        if entry_depth >= depth and depth != root_depth:
+            if entry_bound == EXACT:
+                if running_stats is not None:
+                    running_stats.table_cutoffs += 1
+                return entry_score
+            elif entry_bound == LOWER:
+                alpha = max(alpha, entry_score)
+            else:
+                beta = min(beta, entry_score)
+            if alpha >= beta:
+                if running_stats is not None:
+                    running_stats.table_cutoffs += 1
+                return entry_score
+
+    if (USE_NULL_MOVE and allow_null and depth > NULL_MOVE_REDUCTION + 1 and depth != root_depth and
+            beta < CHECKMATE and gs.has_non_pawn_material() and not gs.is_in_check()):
+        null_ply = len(gs.move_log)
+        gs.make_null_move()
+        try:
+            score = -_ab_negamax(gs, None, depth - 1 - NULL_MOVE_REDUCTION, ply + 1, -turn_mult,
+                                 -beta, -beta + NULL_WINDOW, allow_null=False)
+        except SearchTimeout:
+            # the pass isn't in the move log, take it back here, under the moves made after it
+            while len(gs.move_log) > null_ply:
+                gs.undo_move()
+            gs.undo_null_move()
+            raise
+        gs.undo_null_move()
+        if score >= beta:
+            if running_stats is not None:
+                running_stats.null_move_cutoffs += 1
+            return beta
+
+    # the moves are only generated here, after the table had its chance
+    if valid_moves is None:
+        valid_moves = gs.get_valid_moves(packed=True)
+    if not valid_moves:
+        return -CHECKMATE if gs.in_check else STALEMATE
+    in_check = gs.in_check
+    if USE_MOVE_ORDERING:
+        valid_moves = _order_moves(valid_moves, hash_move_id, ply)
+    reduce_late_moves = USE_LMR and depth >= LMR_MIN_DEPTH and not in_check
 
     max_score = -CHECKMATE
+    best_move = None
 
-    for move in valid_moves:
+    for i, move in enumerate(valid_moves):
         gs.make_move(move)
-        next_moves = gs.get_valid_moves()
-        score = -_ab_negamax(gs, next_moves, depth - 1, -turn_mult, -beta, -alpha)
+        if i == 0 or alpha == -CHECKMATE:
+            score = -_ab_negamax(gs, None, depth - 1, ply + 1, -turn_mult, -beta, -alpha)
+        else:
+            reduction = LMR_REDUCTION if (
+                reduce_late_moves and i >= LMR_FULL_MOVES and not move >> CAPTURED_SHIFT and
+                not move & PROMOTION and move & ID_MASK not in killer_moves[ply] and not gs.is_in_check()) else 0
+            if reduction or USE_PVS:
+                # a reduced move that beats alpha is searched again to the full depth,
+                # a scout that lands inside the window again with the full window
+                score = -_ab_negamax(gs, None, depth - 1 - reduction, ply + 1, -turn_mult, -alpha - NULL_WINDOW, -alpha)
+                if score > alpha and (reduction or score < beta):
+                    if running_stats is not None:
+                        if reduction:
+                            running_stats.lmr_researches += 1
+                        else:
+                            running_stats.pvs_researches += 1
+                    score = -_ab_negamax(gs, None, depth - 1, ply + 1, -turn_mult, -beta, -alpha)
+            else:
+                score = -_ab_negamax(gs, None, depth - 1, ply + 1, -turn_mult, -beta, -alpha)
+        if score > alpha:
+            pv_table[ply] = (move,) + pv_table[ply + 1]
         if score > max_score:
             max_score = score
-            if depth == DEPTH:
+            best_move = move
+            if depth == root_depth:
                 next_move = move
         gs.undo_move()
 
         if max_score > alpha:
             alpha = max_score
         if alpha >= beta:
+            if USE_MOVE_ORDERING:
+                _update_killers_and_history(move, depth, ply)
+            if running_stats is not None:
+                running_stats.beta_cutoffs += 1
+                running_stats.first_move_cutoffs += i == 0
             break
 
+    if USE_TRANSPOSITION_TABLE:
+        if max_score <= alpha_orig:
+            bound = UPPER
+        elif max_score >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        transposition_table.store(gs.zobrist_key, depth, _score_to_table(max_score, ply), bound,
+                                  best_move & ID_MASK if best_move is not None else NO_MOVE)
+
     return max_score
 
 
-def smart_move(gs, moves, return_queue):
-    global next_move
-    next_move = None
-    _ab_negamax(gs, moves, DEPTH, 1 if gs.white_to_move else -1, -CHECKMATE, CHECKMATE)
-    return_queue.put(next_move)
+def smart_move(gs, moves, return_queue, time_limit=None, max_nodes=None, max_depth=None, workers=None,
+               search_stats=None):
+    move = known_move(gs, moves)
+    if move is not None:
+        return_queue.put((move, 0, [move]))
+        return
+    return_queue.put(find_best_move(gs, moves, time_limit, max_nodes, max_depth, workers, search_stats))
+
+
+def find_best_move(gs, moves, time_limit=None, max_nodes=None, max_depth=None, workers=None, search_stats=None):
+    # iterative deepening: searches depth 1, 2, 3... and returns (move, depth, line),
+    # the best move, depth and principal variation (a list of Move objects from the
+    # root) of the last iteration that finished in time. Given a
+    # stats.SearchStats, the search fills it in (with several workers the counters
+    # only cover the moves searched in this process, nodes and iterations cover all)
+    if search_stats is not None:
+        return _find_best_move_with_stats(gs, moves, time_limit, max_nodes, max_depth, workers, search_stats)
+    global next_move, root_depth, root_ply, nodes, deadline, node_limit, tablebase_pieces
+    time_limit = TIME_LIMIT if time_limit is None else time_limit
+    tablebase_pieces = tablebase.max_pieces() if USE_TABLEBASES else 0
+    max_depth = MAX_DEPTH if max_depth is None else min(max_depth, MAX_DEPTH)
+    workers = SEARCH_WORKERS if workers is None else workers
+    if workers > 1:
+        return _find_best_move_parallel(gs, moves, time_limit, max_nodes, max_depth, workers)
+    start = time.perf_counter()
+    root_ply = len(gs.move_log)
+    root_moves = {move.packed: move for move in moves}  # the search runs on the packed moves
+    moves = list(root_moves)
+    best_move = None
+    depth_reached = 0
+    nodes = 0
+    principal_variation = []
+    score = None
+    deadline = node_limit = None  # the first iteration always finishes
+    _clear_move_ordering()
+
+    for depth in range(1, max_depth + 1):
+        root_depth = depth
+        next_move = None
+        delta = ASPIRATION_WINDOW
+        if USE_ASPIRATION and score is not None and abs(score) != CHECKMATE:
+            alpha, beta = score - delta, score + delta
+        else:
+            alpha, beta = -CHECKMATE, CHECKMATE
+        try:
+            while True:
+                score = _ab_negamax(gs, moves, depth, 0, 1 if gs.white_to_move else -1, alpha, beta)
+                # outside the window the score is only a bound, search again wider
+                if score <= alpha and alpha != -CHECKMATE:
+                    delta *= 4
+                    alpha = score - delta
+                elif score >= beta and beta != CHECKMATE:
+                    delta *= 4
+                    beta = score + delta
+                else:
+                    break
+                if running_stats is not None:
+                    running_stats.aspiration_researches += 1
+        except SearchTimeout:
+            # unwind the moves the interrupted iteration left on the board
+            while len(gs.move_log) > root_ply:
+                gs.undo_move()
+            break
+        finally:
+            deadline = start + time_limit
+            node_limit = max_nodes
+
+        if next_move is not None:
+            best_move = root_moves[next_move]
+            # the best move so far is searched first by the next iteration
+            moves.remove(next_move)
+            moves.insert(0, next_move)
+            line = pv_table[0] if pv_table[0] and pv_table[0][0] == next_move else (next_move,)
+            principal_variation = _extend_pv(gs, [engine.Move.from_packed(move) for move in line], depth)
+        depth_reached = depth
+        if running_stats is not None:
+            running_stats.iteration(depth, nodes, time.perf_counter() - start, score)
+
+        # an iteration takes several times the one before it, don't start one
+        # that is not going to finish
+        if time.perf_counter() - start > time_limit / 2 or len(moves) <= 1:
+            break
+        if abs(score) == CHECKMATE:  # a forced mate was found, deeper won't change it
+            break
+
+    deadline = node_limit = None
+    return best_move, depth_reached, principal_variation
+
+
+def _find_best_move_with_stats(gs, moves, time_limit, max_nodes, max_depth, workers, collected):
+    # find_best_move with the running_stats global set and the phases timed by
+    # wrappers swapped in for its duration, a search without stats keeps the
+    # plain functions
+    global running_stats, _evaluate
+    plain_evaluate = _evaluate
+    for name, phase in TIMED_METHODS.items():
+        setattr(gs, name, collected.timed(phase, getattr(gs, name)))
+    _evaluate = collected.timed('evaluation', _evaluate)
+    running_stats = collected
+    transposition_table.reset_stats()
+    start = time.perf_counter()
+    try:
+        move, depth, line = find_best_move(gs, moves, time_limit, max_nodes, max_depth, workers)
+    finally:
+        running_stats = None
+        _evaluate = plain_evaluate
+        for name in TIMED_METHODS:
+            delattr(gs, name)
+    collected.seconds = time.perf_counter() - start
+    collected.nodes = nodes
+    collected.depth = depth
+    collected.table = transposition_table.stats()
+    return move, depth, line
+
+
+def _extend_pv(gs, line, length):
+    # the line stops short where a node was answered by the transposition table,
+    # the table still has the best move of those positions to carry it on
+    for move in line:
+        gs.make_move(move)
+    while len(line) < length and USE_TRANSPOSITION_TABLE:
+        entry = transposition_table.probe(gs.zobrist_key)
+        move = None
+        if entry is not None and entry[3] != NO_MOVE:
+            move = next((move for move in gs.get_valid_moves() if move.move_id == entry[3]), None)
+        if move is None:
+            break
+        gs.make_move(move)
+        line.append(move)
+    for _ in line:
+        gs.undo_move()
+    return line
+
+
+# the root splitting pool, started by the first search with more than one worker
+# and kept for the next ones, until a search asks for another number of workers
+# or close_pool is called. Its processes keep their transposition tables from one
+# search to the next, like the process that owns the pool. A daemon process
+# can't start one (see main.py)
+_pool = None
+_pool_workers = 0
+_pool_alpha = None  # the alpha shared by all the processes
+_pool_stop = None  # set to stop the searches of the pool processes
+
+# state of a pool process: its copy of the root position, the (class, position,
+# keys) it was built from, and the shared alpha
+_pool_gs = None
+_pool_position = None
+_shared_alpha = None
+
+# how long the caller of a parallel search waits for a result of the pool before
+# it polls its own stop_requested again, in seconds
+POOL_POLL_INTERVAL = 0.05
+
+
+def _get_pool(workers):
+    global _pool, _pool_workers, _pool_alpha, _pool_stop
+    if _pool is None or _pool_workers != workers:
+        close_pool()
+        _pool_alpha = multiprocessing.Value('d', -CHECKMATE)
+        _pool_stop = multiprocessing.Event()
+        _pool = multiprocessing.Pool(workers, initializer=_init_pool, initargs=(_pool_alpha, _pool_stop))
+        _pool_workers = workers
+    return _pool, _pool_alpha, _pool_stop
+
+
+def close_pool():
+    # ends the pool processes, the next parallel search starts new ones
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool.join()
+        _pool = None
+
+
+def _init_pool(shared_alpha, stop):
+    global _shared_alpha, stop_requested, tablebase_pieces
+    tablebase_pieces = tablebase.max_pieces() if USE_TABLEBASES else 0
+    _shared_alpha = shared_alpha
+    # only the caller of find_best_move listens for a stop, it passes it on through the event
+    stop_requested = stop.is_set
+
+
+def _set_pool_position(state_class, position, keys):
+    # the position comes in its binary encoding (GameState.to_bytes), the
+    # processes don't need the move log or the board array pickled, only the keys
+    # of the positions it can still repeat. It is only decoded again when it
+    # changes, the move ordering of the old position is dropped with it
+    global _pool_gs, _pool_position
+    if _pool_position != (state_class, position, keys):
+        _pool_gs = state_class.from_bytes(position)
+        _pool_gs.zobrist_log = list(keys)
+        _pool_position = (state_class, position, keys)
+        _clear_move_ordering()
+
+
+def _search_root_move(gs, move, depth, alpha, search_deadline, max_nodes):
+    # searches one root move with the window (alpha, CHECKMATE), returns (score, nodes,
+    # principal variation) or (None, nodes, None) when the budget ran out first
+    global root_depth, root_ply, nodes, deadline, node_limit
+    root_depth = depth
+    root_ply = len(gs.move_log)
+    nodes = 0
+    deadline, node_limit = search_deadline, max_nodes
+    turn_mult = 1 if gs.white_to_move else -1
+    gs.make_move(move)
+    try:
+        score = -_ab_negamax(gs, None, depth - 1, 1, -turn_mult, -CHECKMATE, -alpha)
+        line = [move] + [engine.Move.from_packed(line_move) for line_move in pv_table[1]]
+    except SearchTimeout:
+        score = line = None
+    while len(gs.move_log) > root_ply:
+        gs.undo_move()
+    deadline = node_limit = None
+    return score, nodes, line
+
+
+def _search_root_move_task(task):
+    state_class, position, keys, move_id, depth, search_deadline, max_nodes = task
+    if stop_requested():  # the tasks still queued when the search was stopped
+        return move_id, None, 0, None
+    _set_pool_position(state_class, position, keys)
+    move = next(move for move in _pool_gs.get_valid_moves() if move.move_id == move_id)
+    score, searched, line = _search_root_move(_pool_gs, move, depth, _shared_alpha.value, search_deadline, max_nodes)
+    if score is None:
+        return move_id, None, searched, None
+    with _shared_alpha.get_lock():
+        if score > _shared_alpha.value:
+            _shared_alpha.value = score
+    # the moves go back packed, they don't need a board to be rebuilt
+    return move_id, score, searched, [line_move.packed for line_move in line]
+
+
+def _find_best_move_parallel(gs, moves, time_limit, max_nodes, max_depth, workers):
+    # find_best_move with the root moves split between processes, max_nodes is per
+    # process and the nodes global ends up with the total of all of them
+    global nodes
+    if not moves:
+        return None, 0, []
+    start = time.perf_counter()
+    moves = list(moves)
+    best_move = None
+    depth_reached = 0
+    total_nodes = 0
+    principal_variation = []
+    _clear_move_ordering()
+    repeatable_keys = tuple(gs.zobrist_log[-gs.halfmove_clock - 1:])  # the keys the search can repeat
+    position = (type(gs), gs.to_bytes(), repeatable_keys)
+    pool, shared_alpha, stop = _get_pool(workers)
+    stop.clear()
+    for depth in range(1, max_depth + 1):
+        search_deadline = None if depth == 1 else start + time_limit  # the first iteration always finishes
+
+        # the best move so far is searched alone, its score is the alpha the
+        # other moves start from
+        score, searched, line = _search_root_move(gs, moves[0], depth, -CHECKMATE, search_deadline, max_nodes)
+        total_nodes += searched
+        if score is None:
+            break
+        scores = {moves[0].move_id: score}
+        lines = {moves[0].move_id: line}
+        shared_alpha.value = score
+        tasks = [position + (move.move_id, depth, search_deadline, max_nodes) for move in moves[1:]]
+        results = pool.imap_unordered(_search_root_move_task, tasks)
+        while True:
+            try:
+                result = results.next(POOL_POLL_INTERVAL)
+            except multiprocessing.TimeoutError:
+                result = None
+            except StopIteration:
+                break
+            # the pool processes can't poll the caller, they are told through the event
+            if stop_requested is not None and not stop.is_set() and stop_requested():
+                stop.set()
+            if result is None:
+                continue
+            move_id, score, searched, packed_line = result
+            total_nodes += searched
+            scores[move_id] = score
+            if packed_line is not None:
+                lines[move_id] = [engine.Move.from_packed(packed) for packed in packed_line]
+        if None in scores.values():
+            break
+
+        # on equal scores the move earlier in the list wins, like in the single process search
+        best_index = max(range(len(moves)), key=lambda i: (scores[moves[i].move_id], -i))
+        best_move = moves.pop(best_index)
+        moves.insert(0, best_move)
+        # a move that failed low against the shared alpha has no line of its own
+        principal_variation = lines[best_move.move_id]
+        depth_reached = depth
+        if running_stats is not None:
+            running_stats.iteration(depth, total_nodes, time.perf_counter() - start, scores[best_move.move_id])
+
+        if time.perf_counter() - start > time_limit / 2 or len(moves) <= 1:
+            break
+        if abs(scores[best_move.move_id]) == CHECKMATE:
+            break
+
+    nodes = total_nodes
+    return best_move, depth_reached, principal_variation
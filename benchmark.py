@@ -0,0 +1,155 @@
+# -----------------------------------------------------------------------------
+# (C) 2023 Higor Grigorio (higorgrigorio@gmail.com)  (MIT License)
+# -----------------------------------------------------------------------------
+import argparse
+import queue
+import time
+
+import ai
+import engine
+import stats
+
+# fixed set of positions for comparing search changes, each one given by the
+# moves that lead to it from the initial position
+POSITIONS = {
+    'start': '',
+    'italian': 'e2e4 e7e5 g1f3 b8c6 f1c4 f8c5 c2c3 g8f6 d2d4 e5d4',
+    'ruy_lopez': 'e2e4 e7e5 g1f3 b8c6 f1b5 a7a6 b5a4 g8f6 e1g1 f8e7',
+    'sicilian': 'e2e4 c7c5 g1f3 d7d6 d2d4 c5d4 f3d4 g8f6 b1c3 a7a6',
+    'queens_gambit': 'd2d4 d7d5 c2c4 e7e6 b1c3 g8f6 c1g5 f8e7 e2e3 e8g8',
+    'kings_indian': 'd2d4 g8f6 c2c4 g7g6 b1c3 f8g7 e2e4 d7d6 g1f3 e8g8',
+    'scotch': 'e2e4 e7e5 g1f3 b8c6 d2d4 e5d4 f3d4 g8f6 d4c6 b7c6 e4e5 d8e7',
+}
+
+# tactical test positions (from the Win at Chess suite) and their best move,
+# the suite counts how many of them the search finds in the time it gets
+TACTICS = {
+    'wac001': ('2rr3k/pp3pp1/1nnqbN1p/3pN3/2pP4/2P3Q1/PPB4P/R4RK1 w - - 0 1', 'g3g6'),
+    'wac002': ('8/7p/5k2/5p2/p1p2P2/Pr1pPK2/1P1R3P/8 b - - 0 1', 'b3b2'),
+    'wac003': ('5rk1/1ppb3p/p1pb4/6q1/3P1p1r/2P1R2P/PP1BQ1P1/5RKN w - - 0 1', 'e3g3'),
+    'wac004': ('r1bq2rk/pp3pbp/2p1p1pQ/7P/3P4/2PB1N2/PP3PPR/2KR4 w - - 0 1', 'h6h7'),
+    'wac005': ('5k2/6pp/p1qN4/1p1p4/3P4/2PKP2Q/PP3r2/3R4 b - - 0 1', 'c6c4'),
+    'wac006': ('r3q1kr/ppp5/3p2pQ/8/3PP1b1/5R2/PPP3P1/5RK1 w - - 0 1', 'f3f8'),
+    'wac009': ('3r1k2/4npp1/1ppr3p/p6P/P2PPPP1/1NR5/5K2/2R5 w - - 0 1', 'd4d5'),
+}
+
+# search features that can be switched off from the command line
+FEATURES = {
+    'tt': 'USE_TRANSPOSITION_TABLE',
+    'ordering': 'USE_MOVE_ORDERING',
+    'quiescence': 'USE_QUIESCENCE',
+    'null_move': 'USE_NULL_MOVE',
+    'lmr': 'USE_LMR',
+    'pvs': 'USE_PVS',
+    'aspiration': 'USE_ASPIRATION',
+}
+
+
+def play(gs, moves):
+    for notation in moves.split():
+        for move in gs.get_valid_moves():
+            promotion = (move.pawn_promotion_piece or '').lower()
+            if move.get_chess_notation() + promotion == notation:
+                gs.make_move(move)
+                break
+        else:
+            raise ValueError(f'illegal move {notation}')
+    return gs
+
+
+def load_position(name, backend='bitboard'):
+    return play(engine.BACKENDS[backend](), POSITIONS[name])
+
+
+def search(gs, depth, workers=1, time_limit=None, search_stats=None):
+    # search from a cleared table to a fixed depth, or as deep as it gets in
+    # time_limit seconds, returns (move, depth, nodes, seconds)
+    ai.transposition_table.clear()
+    return_queue = queue.Queue()
+    start = time.perf_counter()
+    if time_limit is None:
+        ai.smart_move(gs, gs.get_valid_moves(), return_queue, time_limit=float('inf'), max_depth=depth,
+                      workers=workers, search_stats=search_stats)
+    else:
+        ai.smart_move(gs, gs.get_valid_moves(), return_queue, time_limit=time_limit, workers=workers,
+                      search_stats=search_stats)
+    elapsed = time.perf_counter() - start
+    move, depth_reached, _ = return_queue.get()
+    return move, depth_reached, ai.nodes, elapsed
+
+
+def run_suite(backend, depth, workers=1, time_limit=None, stats_path=None, label=None):
+    # with stats_path, the stats of every search are appended to it as JSON lines
+    total_nodes = total_time = total_depth = 0
+    print(f'{"position":<16}{"move":<8}{"depth":>6}{"nodes":>10}{"seconds":>10}{"nps":>10}')
+    for name in POSITIONS:
+        search_stats = stats.SearchStats() if stats_path else None
+        move, depth_reached, nodes, elapsed = search(load_position(name, backend), depth, workers, time_limit,
+                                                     search_stats)
+        if search_stats is not None:
+            search_stats.write(stats_path, label=label, position=name, backend=backend, workers=workers,
+                               move=move.get_chess_notation())
+        total_nodes += nodes
+        total_time += elapsed
+        total_depth += depth_reached
+        print(f'{name:<16}{move.get_chess_notation():<8}{depth_reached:>6}{nodes:>10}{elapsed:>10.2f}'
+              f'{nodes / elapsed:>10.0f}')
+    print(f'{"total":<24}{total_depth / len(POSITIONS):>6.1f}{total_nodes:>10}{total_time:>10.2f}'
+          f'{total_nodes / total_time:>10.0f}')
+    return total_nodes, total_time
+
+
+def run_tactics(backend, time_limit):
+    # how many of the TACTICS the search solves in time_limit seconds each
+    solved = 0
+    print(f'{"position":<16}{"best":<8}{"found":<8}{"depth":>6}')
+    for name, (fen, best) in TACTICS.items():
+        gs = engine.BACKENDS[backend]()
+        gs.load_fen(fen)
+        move, depth_reached, _, _ = search(gs, None, time_limit=time_limit)
+        found = move.get_chess_notation()
+        solved += found == best
+        print(f'{name:<16}{best:<8}{found:<8}{depth_reached:>6}')
+    print(f'solved {solved} of {len(TACTICS)}')
+    return solved
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Search node counts on a fixed set of positions.')
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--backend', choices=engine.BACKENDS, default='bitboard')
+    parser.add_argument('--without', choices=FEATURES, action='append', default=[],
+                        help='switch a search feature off (can be repeated)')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1],
+                        help='search processes, several counts (--workers 1 2 4 8) compare their speed')
+    parser.add_argument('--time', type=float,
+                        help='search every position for this many seconds instead of to --depth')
+    parser.add_argument('--tactics', action='store_true',
+                        help='run the tactical positions instead, --time seconds each (default 5)')
+    parser.add_argument('--stats', metavar='PATH',
+                        help='append the search stats of every position to PATH as JSON lines')
+    parser.add_argument('--label', help='written with the stats, to tell runs apart (a version, a commit)')
+    args = parser.parse_args()
+
+    for feature in args.without:
+        setattr(ai, FEATURES[feature], False)
+    ai.USE_OPENING_BOOK = False  # the positions are openings, the book would answer them
+
+    if args.tactics:
+        run_tactics(args.backend, args.time or 5.0)
+        return
+
+    results = []
+    for workers in args.workers:
+        print(f'-- {workers} worker(s)')
+        results.append((workers,) + run_suite(args.backend, args.depth, workers, args.time, args.stats, args.label))
+
+    if len(results) > 1:
+        base_time = results[0][2]
+        print(f'{"workers":<10}{"nodes":>10}{"seconds":>10}{"speedup":>10}')
+        for workers, total_nodes, total_time in results:
+            print(f'{workers:<10}{total_nodes:>10}{total_time:>10.2f}{base_time / total_time:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,362 @@
+# -----------------------------------------------------------------------------
+# (C) 2023 Higor Grigorio (higorgrigorio@gmail.com)  (MIT License)
+# -----------------------------------------------------------------------------
+from engine import (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, WHITE, BLACK, PIECE_CODES,
+                    MOVED_SHIFT, CAPTURED_SHIFT, EN_PASSANT_MOVE, CASTLE_MOVE, PROMOTION_MOVE, PACKED_PROMOTIONS,
+                    BACKENDS, MailboxGameState, Move)
+
+# squares of a bitboard are numbered row by row from the top left corner, the
+# same order as the (row, col) coordinates of the other backends, so bit
+# `row * 8 + col` is set when that square is occupied
+FULL = (1 << 64) - 1
+
+SQUARE_TO_RC = [(sq >> 3, sq & 7) for sq in range(64)]
+MAILBOX_SQUARE = [21 + (sq >> 3) * 10 + (sq & 7) for sq in range(64)]  # engine.to_square of every square
+
+ROOK_STEPS = ((-1, 0), (0, -1), (1, 0), (0, 1))
+BISHOP_STEPS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+KNIGHT_STEPS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+KING_STEPS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
+
+def _bit(r, c):
+    return 1 << (r * 8 + c)
+
+
+def _step_attacks(steps):
+    table = []
+    for sq in range(64):
+        r, c = SQUARE_TO_RC[sq]
+        attacks = 0
+        for dr, dc in steps:
+            if 0 <= r + dr < 8 and 0 <= c + dc < 8:
+                attacks |= _bit(r + dr, c + dc)
+        table.append(attacks)
+    return table
+
+
+def _ray_attacks(sq, occupied, steps):
+    # walks every ray until it leaves the board or hits an occupied square (included)
+    r, c = SQUARE_TO_RC[sq]
+    attacks = 0
+    for dr, dc in steps:
+        end_row, end_col = r + dr, c + dc
+        while 0 <= end_row < 8 and 0 <= end_col < 8:
+            attacks |= _bit(end_row, end_col)
+            if occupied & _bit(end_row, end_col):
+                break
+            end_row, end_col = end_row + dr, end_col + dc
+    return attacks
+
+
+def _relevant_mask(sq, steps):
+    # the squares whose occupancy can change the attacks from `sq`, the last
+    # square of each ray never blocks anything behind it so it is left out
+    r, c = SQUARE_TO_RC[sq]
+    mask = 0
+    for dr, dc in steps:
+        end_row, end_col = r + dr, c + dc
+        while 0 <= end_row + dr < 8 and 0 <= end_col + dc < 8:
+            mask |= _bit(end_row, end_col)
+            end_row, end_col = end_row + dr, end_col + dc
+    return mask
+
+
+def _slider_tables(steps):
+    # magic bitboard style lookup: the attacks for every subset of the relevant
+    # occupancy are precomputed per square, and the masked occupancy itself is
+    # the key, Python's dict hashing takes the place of the magic multiply
+    masks = []
+    tables = []
+    for sq in range(64):
+        mask = _relevant_mask(sq, steps)
+        table = {}
+        subset = 0
+        while True:  # carry-rippler enumeration of all the subsets of the mask
+            table[subset] = _ray_attacks(sq, subset, steps)
+            subset = (subset - mask) & mask
+            if subset == 0:
+                break
+        masks.append(mask)
+        tables.append(table)
+    return masks, tables
+
+
+KNIGHT_ATTACKS = _step_attacks(KNIGHT_STEPS)
+KING_ATTACKS = _step_attacks(KING_STEPS)
+# squares attacked by a pawn of the given color standing on each square
+PAWN_ATTACKS = {WHITE: _step_attacks(((-1, -1), (-1, 1))),
+                BLACK: _step_attacks(((1, -1), (1, 1)))}
+
+ROOK_MASKS, ROOK_TABLES = _slider_tables(ROOK_STEPS)
+BISHOP_MASKS, BISHOP_TABLES = _slider_tables(BISHOP_STEPS)
+
+# BETWEEN[a][b] holds the squares strictly between two aligned squares and
+# LINE[a][b] the whole line through them, both are empty when not aligned
+BETWEEN = [[0] * 64 for _ in range(64)]
+LINE = [[0] * 64 for _ in range(64)]
+for _a in range(64):
+    for _steps in (ROOK_STEPS, BISHOP_STEPS):
+        for _b in range(64):
+            if _ray_attacks(_a, 0, _steps) & (1 << _b):
+                BETWEEN[_a][_b] = _ray_attacks(_a, 1 << _b, _steps) & _ray_attacks(_b, 1 << _a, _steps)
+                LINE[_a][_b] = (_ray_attacks(_a, 0, _steps) & _ray_attacks(_b, 0, _steps)) | (1 << _a) | (1 << _b)
+
+RANK_1 = 0xFF << 56
+RANK_8 = 0xFF
+
+
+def rook_attacks(sq, occupied):
+    return ROOK_TABLES[sq][occupied & ROOK_MASKS[sq]]
+
+
+def bishop_attacks(sq, occupied):
+    return BISHOP_TABLES[sq][occupied & BISHOP_MASKS[sq]]
+
+
+class BitboardGameState(MailboxGameState):
+    # GameState that generates its moves from bitboards. It keeps a 64-bit
+    # occupancy per piece type and color on top of the mailbox squares (still
+    # used for the string view of the board and to look up the piece on a
+    # square), and generates legal moves directly: pinned pieces, checks and
+    # king safety come from attack lookups, so no pseudo-legal move is ever
+    # built and thrown away.
+
+    def __init__(self, backend='bitboard'):
+        super().__init__()
+        self.compute_bitboards()
+
+    def set_position(self, *args, **kwargs):
+        super().set_position(*args, **kwargs)
+        self.compute_bitboards()
+
+    def compute_bitboards(self):
+        # builds the bitboards from the board (make_move and undo_move only update
+        # them), indexed by the engine piece codes and by WHITE/BLACK
+        self.pieces = [0] * ((BLACK | KING) + 1)
+        self.occupancy = [0] * (BLACK + 1)
+        for r in range(8):
+            for c in range(8):
+                piece = PIECE_CODES[self.board[r][c]]
+                if piece:
+                    self.pieces[piece] |= _bit(r, c)
+                    self.occupancy[piece & (WHITE | BLACK)] |= _bit(r, c)
+
+    def _xor_move(self, move):
+        # applies the packed move to the bitboards, every change is an xor so
+        # calling this again with the same move takes it back
+        pieces = self.pieces
+        occupancy = self.occupancy
+        piece = move >> MOVED_SHIFT & 31
+        us = piece & (WHITE | BLACK)
+        start = 1 << (move & 63)
+        end = 1 << (move >> 6 & 63)
+
+        pieces[piece] ^= start | end
+        occupancy[us] ^= start | end
+
+        captured = move >> CAPTURED_SHIFT & 31
+        if captured:
+            # en passant takes the pawn on the row of the start, the column of the end
+            captured_square = 1 << (move & 56 | move >> 6 & 7) if move & EN_PASSANT_MOVE else end
+            pieces[captured] ^= captured_square
+            occupancy[captured & (WHITE | BLACK)] ^= captured_square
+
+        if move & PROMOTION_MOVE:
+            pieces[piece] ^= end
+            pieces[us | PACKED_PROMOTIONS[move >> 12 & 7]] ^= end
+
+        if move & CASTLE_MOVE:
+            if end > start:
+                rook = end << 1 | end >> 1
+            else:  # queen side castle
+                rook = end >> 2 | end << 1
+            pieces[us | ROOK] ^= rook
+            occupancy[us] ^= rook
+
+    def _make_packed(self, move):
+        super()._make_packed(move)
+        self._xor_move(move)
+
+    def _undo_packed(self, move):
+        self._xor_move(move)
+        super()._undo_packed(move)
+
+    def _attackers(self, sq, color, occupied):
+        pieces = self.pieces
+        return (KNIGHT_ATTACKS[sq] & pieces[color | KNIGHT]) | \
+            (KING_ATTACKS[sq] & pieces[color | KING]) | \
+            (PAWN_ATTACKS[color ^ (WHITE | BLACK)][sq] & pieces[color | PAWN]) | \
+            (rook_attacks(sq, occupied) & (pieces[color | ROOK] | pieces[color | QUEEN])) | \
+            (bishop_attacks(sq, occupied) & (pieces[color | BISHOP] | pieces[color | QUEEN]))
+
+    def _is_under_attack(self, r, c):
+        them = BLACK if self.white_to_move else WHITE
+        return self._attackers(r * 8 + c, them, self.occupancy[WHITE] | self.occupancy[BLACK]) != 0
+
+    def get_valid_moves(self, captures_only=False, packed=False):
+        pieces = self.pieces
+        squares = self.squares
+        if self.white_to_move:
+            us, them, forward, start_rank, back_rank = WHITE, BLACK, -8, 0xFF << 48, RANK_8
+        else:
+            us, them, forward, start_rank, back_rank = BLACK, WHITE, 8, 0xFF << 8, RANK_1
+        own = self.occupancy[us]
+        enemy = self.occupancy[them]
+        occupied = own | enemy
+        # captures only (for the quiescence search): every target has to hold an
+        # enemy piece, except pawn promotions and en passant
+        capture_mask = enemy if captures_only else FULL
+        king_bb = pieces[us | KING]
+        king = king_bb.bit_length() - 1
+        moves = []
+
+        checkers = self._attackers(king, them, occupied)
+        self.in_check = checkers != 0
+
+        # king moves, the king is taken off the board so it can't hide behind itself
+        targets = KING_ATTACKS[king] & ~own & capture_mask
+        while targets:
+            bb = targets & -targets
+            targets ^= bb
+            end = bb.bit_length() - 1
+            if not self._attackers(end, them, occupied ^ king_bb):
+                moves.append(king | end << 6 | (us | KING) << MOVED_SHIFT |
+                             squares[MAILBOX_SQUARE[end]] << CAPTURED_SHIFT)
+
+        if checkers & (checkers - 1) == 0:  # at most one check, other pieces can move
+            if checkers:
+                # capture the checking piece or block the line between it and the king
+                checker = checkers.bit_length() - 1
+                target_mask = checkers | BETWEEN[king][checker]
+            else:
+                target_mask = FULL
+
+            # pieces pinned to the king can only move along the pin line
+            pins = {}
+            snipers = (rook_attacks(king, enemy) & (pieces[them | ROOK] | pieces[them | QUEEN])) | \
+                (bishop_attacks(king, enemy) & (pieces[them | BISHOP] | pieces[them | QUEEN]))
+            while snipers:
+                bb = snipers & -snipers
+                snipers ^= bb
+                sniper = bb.bit_length() - 1
+                blockers = BETWEEN[king][sniper] & occupied
+                if blockers & own and blockers & (blockers - 1) == 0:
+                    pins[blockers.bit_length() - 1] = LINE[king][sniper]
+
+            # pawn pushes are quiet moves, captures only keeps the ones that promote
+            push_mask = target_mask & (back_rank if captures_only else FULL)
+            self._generate_pawn_moves(us, them, forward, start_rank, back_rank, target_mask, push_mask, pins, moves)
+            target_mask &= capture_mask
+            for kind, attacks in ((KNIGHT, None), (BISHOP, bishop_attacks), (ROOK, rook_attacks),
+                                  (QUEEN, None)):
+                bb_pieces = pieces[us | kind]
+                while bb_pieces:
+                    bb = bb_pieces & -bb_pieces
+                    bb_pieces ^= bb
+                    start = bb.bit_length() - 1
+                    moved = start | (us | kind) << MOVED_SHIFT
+                    if kind == KNIGHT:
+                        if start in pins:  # a pinned knight can never move
+                            continue
+                        targets = KNIGHT_ATTACKS[start]
+                    elif kind == QUEEN:
+                        targets = rook_attacks(start, occupied) | bishop_attacks(start, occupied)
+                    else:
+                        targets = attacks(start, occupied)
+                    targets &= ~own & target_mask & pins.get(start, FULL)
+                    while targets:
+                        bb = targets & -targets
+                        targets ^= bb
+                        end = bb.bit_length() - 1
+                        moves.append(moved | end << 6 | squares[MAILBOX_SQUARE[end]] << CAPTURED_SHIFT)
+
+            if not checkers and not captures_only:
+                self._generate_castle_moves(us, them, king, occupied, moves)
+
+        if len(moves) == 0 and not captures_only:
+            if self.in_check:
+                self.checkmate = True
+            else:
+                self.stalemate = True
+
+        return moves if packed else [Move.from_packed(move) for move in moves]
+
+    def _generate_pawn_moves(self, us, them, forward, start_rank, back_rank, target_mask, push_mask, pins, moves):
+        pieces = self.pieces
+        squares = self.squares
+        occupied = self.occupancy[us] | self.occupancy[them]
+        enemy = self.occupancy[them]
+        pawn = (us | PAWN) << MOVED_SHIFT
+
+        def _append_move(start, end):
+            move = start | end << 6 | pawn | squares[MAILBOX_SQUARE[end]] << CAPTURED_SHIFT
+            if (1 << end) & back_rank:  # promotion, one move per piece type
+                for promotion in self.get_possible_pawn_promotions():
+                    moves.append(move | Move.promotion_to_int[promotion] << 12 | PROMOTION_MOVE)
+            else:
+                moves.append(move)
+
+        pawns = pieces[us | PAWN]
+        while pawns:
+            bb = pawns & -pawns
+            pawns ^= bb
+            start = bb.bit_length() - 1
+            pin_mask = pins.get(start, FULL)
+            allowed = target_mask & pin_mask
+            allowed_push = push_mask & pin_mask
+
+            end = start + forward
+            if not (1 << end) & occupied:  # 1 square pawn advance
+                if (1 << end) & allowed_push:
+                    _append_move(start, end)
+                if bb & start_rank and not (1 << (end + forward)) & occupied and \
+                        (1 << (end + forward)) & allowed_push:
+                    _append_move(start, end + forward)
+
+            targets = PAWN_ATTACKS[us][start] & enemy & allowed
+            while targets:
+                target = targets & -targets
+                targets ^= target
+                _append_move(start, target.bit_length() - 1)
+
+        if self.en_passant_possible != ():
+            self._generate_en_passant_moves(us, them, forward, moves)
+
+    def _generate_en_passant_moves(self, us, them, forward, moves):
+        pieces = self.pieces
+        occupied = self.occupancy[us] | self.occupancy[them]
+        king = pieces[us | KING].bit_length() - 1
+        end_row, end_col = self.en_passant_possible
+        end = end_row * 8 + end_col
+        captured = 1 << (end - forward)
+
+        attackers = PAWN_ATTACKS[them][end] & pieces[us | PAWN]
+        while attackers:
+            bb = attackers & -attackers
+            attackers ^= bb
+            # both pawns leave their squares at once, so instead of pin lines
+            # look at the king's attackers on the board after the capture
+            after = (occupied ^ bb ^ captured) | (1 << end)
+            if rook_attacks(king, after) & (pieces[them | ROOK] | pieces[them | QUEEN]) or \
+                    bishop_attacks(king, after) & (pieces[them | BISHOP] | pieces[them | QUEEN]) or \
+                    KNIGHT_ATTACKS[king] & pieces[them | KNIGHT] or \
+                    PAWN_ATTACKS[us][king] & pieces[them | PAWN] & ~captured:
+                continue
+            moves.append(bb.bit_length() - 1 | end << 6 | (us | PAWN) << MOVED_SHIFT |
+                         (them | PAWN) << CAPTURED_SHIFT | EN_PASSANT_MOVE)
+
+    def _generate_castle_moves(self, us, them, king, occupied, moves):
+        rights = self.current_castling_rights
+        castle = king | (us | KING) << MOVED_SHIFT | CASTLE_MOVE
+        if (rights.wks if us == WHITE else rights.bks) and \
+                not occupied & ((1 << (king + 1)) | (1 << (king + 2))) and \
+                not self._attackers(king + 1, them, occupied) and not self._attackers(king + 2, them, occupied):
+            moves.append(castle | (king + 2) << 6)
+        if (rights.wqs if us == WHITE else rights.bqs) and \
+                not occupied & ((1 << (king - 1)) | (1 << (king - 2)) | (1 << (king - 3))) and \
+                not self._attackers(king - 1, them, occupied) and not self._attackers(king - 2, them, occupied):
+            moves.append(castle | (king - 2) << 6)
+
+
+BACKENDS['bitboard'] = BitboardGameState
@@ -0,0 +1,192 @@
+# -----------------------------------------------------------------------------
+# (C) 2023 Higor Grigorio (higorgrigorio@gmail.com)  (MIT License)
+# -----------------------------------------------------------------------------
+import argparse
+import mmap
+import os
+import random
+import re
+import struct
+from collections import defaultdict
+
+import bitboard
+
+# Polyglot opening books: a file of 16 byte big-endian entries (position key,
+# move, weight, learn) sorted by key. The position keys are the Zobrist keys
+# GameState keeps (see zobrist.py), so a book is probed with gs.zobrist_key.
+#
+# A move is packed as to file | to row << 3 | from file << 6 | from row << 9 |
+# promotion << 12, the rows counted from white's side, the promotion 1 to 4 for
+# knight, bishop, rook and queen. Castling is written as the king taking its
+# own rook (e1h1, e1a1, e8h8, e8a8).
+ENTRY = struct.Struct('>QHHI')
+PROMOTION_PIECES = {'N': 1, 'B': 2, 'R': 3, 'Q': 4}
+
+
+def polyglot_move(move):
+    to_col = move.end_col
+    if move.is_castle_move:
+        to_col = 7 if move.end_col > move.start_col else 0
+    promotion = PROMOTION_PIECES[move.pawn_promotion_piece] if move.pawn_promotion_piece else 0
+    return to_col | (7 - move.end_row) << 3 | move.start_col << 6 | (7 - move.start_row) << 9 | promotion << 12
+
+
+class OpeningBook:
+    # A Polyglot book read through a read-only memory map: finding a position is
+    # a binary search over the entries in place, so opening a book costs the same
+    # whatever its size and only the pages the searches touch are read from disk.
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.entries = size // ENTRY.size
+        # an empty file can't be mapped
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.entries else b''
+
+    def _key(self, i):
+        return ENTRY.unpack_from(self.data, i * ENTRY.size)[0]
+
+    def probe(self, key):
+        # returns the (polyglot move, weight) pairs stored for the position
+        low, high = 0, self.entries
+        while low < high:  # first entry with a key >= key
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        moves = []
+        for i in range(low, self.entries):
+            entry_key, move, weight, _ = ENTRY.unpack_from(self.data, i * ENTRY.size)
+            if entry_key != key:
+                break
+            moves.append((move, weight))
+        return moves
+
+    def choose_move(self, gs, moves):
+        # one of the legal moves the book has for the position, picked at random
+        # by weight, or None when the position is not in the book
+        by_polyglot = {polyglot_move(move): move for move in moves}
+        candidates = [(by_polyglot[move], weight) for move, weight in self.probe(gs.zobrist_key)
+                      if move in by_polyglot]
+        if not candidates:
+            return None
+        if not any(weight for _, weight in candidates):  # only zero weights, all are as good
+            return random.choice(candidates)[0]
+        return random.choices([move for move, _ in candidates], [weight for _, weight in candidates])[0]
+
+    def close(self):
+        if self.entries:
+            self.data.close()
+        self.file.close()
+
+
+# -----------------------------------------------------------------------------
+# building a book from PGN games
+# -----------------------------------------------------------------------------
+PGN_TOKEN = re.compile(r'\[[^\]]*\]|\{[^}]*\}|;[^\n]*|\(|\)|\$\d+|\d+\.+|1-0|0-1|1/2-1/2|\*|[^\s()]+')
+RESULTS = {'1-0': 'w', '0-1': 'b', '1/2-1/2': None, '*': None}
+SAN = re.compile(r'([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?')
+
+
+def read_pgn_games(text):
+    # yields (moves, winner) per game, the moves in SAN and the winner 'w', 'b'
+    # or None for draws and unfinished games. Comments and variations are skipped
+    moves = []
+    winner = None
+    variation_depth = 0
+    for token in PGN_TOKEN.findall(text):
+        if token[0] == '[':
+            if token.startswith('[Result '):
+                winner = RESULTS.get(token.split('"')[1])
+            elif moves:  # the tags of the next game, the last one had no result token
+                yield moves, winner
+                moves, winner = [], None
+        elif token == '(':
+            variation_depth += 1
+        elif token == ')':
+            variation_depth -= 1
+        elif variation_depth or token[0] in '{;$' or token[0].isdigit() and token.rstrip('.').isdigit():
+            continue
+        elif token in RESULTS:
+            yield moves, winner
+            moves, winner = [], None
+        else:
+            moves.append(token)
+    if moves:
+        yield moves, winner
+
+
+def parse_san(gs, san, moves):
+    # the legal move written as san, or None
+    san = san.rstrip('+#!?')
+    if san in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        to_col = 6 if len(san) == 3 else 2
+        return next((move for move in moves if move.is_castle_move and move.end_col == to_col), None)
+    match = SAN.fullmatch(san)
+    if match is None:
+        return None
+    piece, from_file, from_rank, square, promotion = match.groups()
+    piece = piece or 'p'
+    to_row, to_col = 8 - int(square[1]), ord(square[0]) - ord('a')
+    for move in moves:
+        if (move.end_row == to_row and move.end_col == to_col and not move.is_castle_move and
+                move.piece_moved[1] == piece and
+                (from_file is None or move.start_col == ord(from_file) - ord('a')) and
+                (from_rank is None or move.start_row == 8 - int(from_rank)) and
+                move.pawn_promotion_piece == promotion):
+            return move
+    return None
+
+
+def build_book(pgn_paths, max_ply=24, min_games=1):
+    # the book entries of the first max_ply moves of the games, as sorted
+    # (key, move, weight) tuples. A move scores 2 per win and 1 per draw of the
+    # side that played it, moves played in fewer than min_games games are left out
+    games = defaultdict(int)
+    points = defaultdict(int)
+    for path in pgn_paths:
+        with open(path, encoding='utf-8', errors='replace') as pgn:
+            text = pgn.read()
+        for sans, winner in read_pgn_games(text):
+            gs = bitboard.BitboardGameState()
+            for san in sans[:max_ply]:
+                move = parse_san(gs, san, gs.get_valid_moves())
+                if move is None:  # an illegal or unreadable move ends the game for the book
+                    break
+                entry = (gs.zobrist_key, polyglot_move(move))
+                games[entry] += 1
+                side = 'w' if gs.white_to_move else 'b'
+                points[entry] += 2 if winner == side else 1 if winner is None else 0
+                gs.make_move(move)
+
+    entries = [(key, move, points[key, move]) for (key, move), count in games.items() if count >= min_games]
+    top = max((weight for _, _, weight in entries), default=0)
+    if top > 0xFFFF:  # the weights are 16 bit, scale them down keeping the ratios
+        entries = [(key, move, weight * 0xFFFF // top) for key, move, weight in entries]
+    # sorted by key, the best move of each position first
+    entries.sort(key=lambda entry: (entry[0], -entry[2]))
+    return entries
+
+
+def write_book(path, entries):
+    with open(path, 'wb') as book:
+        for key, move, weight in entries:
+            book.write(ENTRY.pack(key, move, weight, 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a Polyglot opening book from PGN files.')
+    parser.add_argument('pgn', nargs='+')
+    parser.add_argument('-o', '--output', default='book.bin')
+    parser.add_argument('--max-ply', type=int, default=24, help='book moves of each game')
+    parser.add_argument('--min-games', type=int, default=1, help='leave out moves played in fewer games')
+    args = parser.parse_args()
+
+    entries = build_book(args.pgn, args.max_ply, args.min_games)
+    write_book(args.output, entries)
+    print(f'{len(entries)} entries written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
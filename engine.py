@@ -1,13 +1,33 @@
 # -----------------------------------------------------------------------------
 # (C) 2023 Higor Grigorio (higorgrigorio@gmail.com)  (MIT License)
 # -----------------------------------------------------------------------------
+import struct
+
 import numpy as np
 
+import evaluation
+import zobrist
+
 
 class GameState:
     board: np.ndarray
 
-    def __init__(self):
+    # a king with this many squares to go to has them checked against one set of
+    # every square the enemy attacks (see _get_enemy_attacks), with fewer each
+    # square is looked at on its own (see _is_under_attack)
+    ATTACK_SET_TARGETS = 2
+
+    def __new__(cls, backend='array'):
+        # GameState(backend='mailbox') builds the integer mailbox variant of the
+        # game state (see MailboxGameState) and backend='bitboard' the bitboard
+        # one (see bitboard.py), the default keeps the NumPy board
+        if cls is GameState:
+            if backend not in BACKENDS:
+                raise ValueError(f'unknown board backend: {backend!r}')
+            cls = BACKENDS[backend]
+        return super().__new__(cls)
+
+    def __init__(self, backend='array'):
         # the default chessboard is a 8x8 board with the initial
         # chessboard configuration (see domain/chessboard.py). The
         # first character of each string represents the color of the
@@ -49,8 +69,180 @@ class GameState:
         self.current_castling_rights = CastleRights(True, True, True, True)
         self.castle_rights_log = [CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
                                                self.current_castling_rights.wqs, self.current_castling_rights.bqs)]
+        self.en_passant_log = [self.en_passant_possible]
+
+        # set while get_valid_moves(captures_only=True) runs on the mailbox backend,
+        # its generators then skip the quiet moves (used by the quiescence search)
+        self.captures_only = False
+
+        # 64-bit Zobrist key of the position (Polyglot compatible), make_move
+        # xors each move into it and the zobrist_log keeps one key per position
+        self.zobrist_key = self.compute_zobrist_key()
+        self.zobrist_log = [self.zobrist_key]
+
+        # material + piece-square score of the board (positive favours white), kept
+        # up to date by make_move and undo_move so the search evaluates in O(1)
+        self.score = self.compute_score()
+
+        # the squares of the white and of the black pieces, kept up to date by
+        # make_move and undo_move so move generation only visits occupied squares
+        self.piece_locations = self.compute_piece_locations()
+
+        # moves since the last capture or pawn move (for the fifty-move rule), one
+        # entry per position in the halfmove_log like the other logs
+        self.halfmove_clock = 0
+        self.halfmove_log = [self.halfmove_clock]
+
+        # the fullmove number of the position the move log starts from (see load_fen)
+        self.start_fullmove_number = 1
+
+    @classmethod
+    def from_fen(cls, fen, backend=None):
+        gs = cls() if backend is None else cls(backend)
+        gs.load_fen(fen)
+        return gs
+
+    @classmethod
+    def from_bytes(cls, data, backend=None):
+        gs = cls() if backend is None else cls(backend)
+        gs.load_bytes(data)
+        return gs
+
+    def load_fen(self, fen):
+        # sets up the position of a FEN string, the move counters are optional
+        fields = fen.split()
+        placement, side, castling, en_passant = fields[:4]
+        board = [['--'] * 8 for _ in range(8)]
+        for r, row in enumerate(placement.split('/')):
+            c = 0
+            for char in row:
+                if char.isdigit():
+                    c += int(char)
+                else:
+                    board[r][c] = FEN_PIECES[char]
+                    c += 1
+        if en_passant == '-':
+            en_passant_possible = ()
+        else:
+            en_passant_possible = (Move.rank_to_row[en_passant[1]], Move.file_to_col[en_passant[0]])
+        self.set_position(board, side == 'w',
+                          CastleRights('K' in castling, 'k' in castling, 'Q' in castling, 'q' in castling),
+                          en_passant_possible,
+                          int(fields[4]) if len(fields) > 4 else 0,
+                          int(fields[5]) if len(fields) > 5 else 1)
+
+    def to_fen(self):
+        rows = []
+        for row in self.board:
+            fen_row = ''
+            empty = 0
+            for piece in row:
+                if piece == '--':
+                    empty += 1
+                    continue
+                if empty:
+                    fen_row += str(empty)
+                    empty = 0
+                fen_row += PIECE_FEN[piece]
+            rows.append(fen_row + (str(empty) if empty else ''))
+        rights = self.current_castling_rights
+        castling = ''.join(char for char, right in (('K', rights.wks), ('Q', rights.wqs),
+                                                    ('k', rights.bks), ('q', rights.bqs)) if right)
+        if self.en_passant_possible:
+            r, c = self.en_passant_possible
+            en_passant = Move.col_to_file[c] + Move.row_to_rank[r]
+        else:
+            en_passant = '-'
+        return (f"{'/'.join(rows)} {'w' if self.white_to_move else 'b'} {castling or '-'} {en_passant} "
+                f"{self.halfmove_clock} {self.fullmove_number()}")
+
+    def load_bytes(self, data):
+        # sets up a position encoded by to_bytes
+        board = [[NIBBLE_PIECES[byte >> 4] if c % 2 == 0 else NIBBLE_PIECES[byte & 15]
+                  for c, byte in ((c, data[r * 4 + c // 2]) for c in range(8))]
+                 for r in range(8)]
+        flags, en_passant_file, halfmove_clock, fullmove_number = POSITION_TAIL.unpack_from(data, 32)
+        white_to_move = bool(flags & 1)
+        if en_passant_file:
+            en_passant_possible = (2 if white_to_move else 5, en_passant_file - 1)
+        else:
+            en_passant_possible = ()
+        self.set_position(board, white_to_move,
+                          CastleRights(bool(flags & 2), bool(flags & 8), bool(flags & 4), bool(flags & 16)),
+                          en_passant_possible, halfmove_clock, fullmove_number)
+
+    def to_bytes(self):
+        # fixed size encoding of the position, POSITION_BYTES long: a nibble per
+        # square (the piece type, plus 8 for black), then the side to move and
+        # castling rights flags, the en passant file + 1 (0 for none), the
+        # halfmove clock (capped at 255) and the fullmove number
+        nibbles = [PIECE_NIBBLES[piece] for row in self.board for piece in row]
+        rights = self.current_castling_rights
+        flags = self.white_to_move | rights.wks << 1 | rights.wqs << 2 | rights.bks << 3 | rights.bqs << 4
+        en_passant_file = self.en_passant_possible[1] + 1 if self.en_passant_possible else 0
+        return (bytes([nibbles[i] << 4 | nibbles[i + 1] for i in range(0, 64, 2)]) +
+                POSITION_TAIL.pack(flags, en_passant_file, min(self.halfmove_clock, 255), self.fullmove_number()))
+
+    def set_position(self, board, white_to_move, castling_rights, en_passant_possible,
+                     halfmove_clock=0, fullmove_number=1):
+        # puts the pieces of an 8x8 grid of 'wp'/'--' strings on the board and
+        # starts a new move log from there, the incremental state is rebuilt
+        for r in range(8):
+            for c in range(8):
+                piece = board[r][c]
+                self.board[r][c] = piece
+                if piece == 'wK':
+                    self.white_king_location = (r, c)
+                elif piece == 'bK':
+                    self.black_king_location = (r, c)
+        self.white_to_move = white_to_move
+        self.move_log = []
+        self.in_check = self.stalemate = self.checkmate = False
+        self.pins = []
+        self.checks = []
+        self.en_passant_possible = en_passant_possible
+        self.en_passant_log = [en_passant_possible]
+        self.current_castling_rights = castling_rights
+        self.castle_rights_log = [CastleRights(castling_rights.wks, castling_rights.bks,
+                                               castling_rights.wqs, castling_rights.bqs)]
+        self.halfmove_clock = halfmove_clock
+        self.halfmove_log = [halfmove_clock]
+        self.start_fullmove_number = fullmove_number
+        self.zobrist_key = self.compute_zobrist_key()
+        self.zobrist_log = [self.zobrist_key]
+        self.score = self.compute_score()
+        self.piece_locations = self.compute_piece_locations()
+
+    def repetitions(self):
+        # how many times the position was on the board before, only the positions
+        # since the last capture or pawn move can be the same, with the same side to move
+        key = self.zobrist_key
+        log = self.zobrist_log
+        last = len(log) - 1
+        return sum(1 for i in range(last - 2, max(last - self.halfmove_clock, 0) - 1, -2) if log[i] == key)
+
+    def get_draw_reason(self):
+        # 'threefold repetition' or 'fifty-move rule' when the game is drawn by one
+        # of them, else None. Not kept up to date by the move generation, the search
+        # tests the same rules on its own, the GUI asks after each move of the game
+        if self.halfmove_clock >= 100:
+            return 'fifty-move rule'
+        if self.repetitions() >= 2:
+            return 'threefold repetition'
+        return None
+
+    def fullmove_number(self):
+        # starts at 1 and goes up after each black move
+        black_started = self.white_to_move == (len(self.move_log) % 2 == 1)
+        return self.start_fullmove_number + (len(self.move_log) + black_started) // 2
 
     def make_move(self, move):
+        if type(move) is int:  # a packed move of the search
+            move = Move.from_packed(move)
+
+        # the en passant part of the key depends on the board before the move
+        key = self.zobrist_key ^ self._en_passant_hash()
+
         self.board[move.start_row][move.start_col] = '--'
         self.board[move.end_row][move.end_col] = move.piece_moved
         self.move_log.append(move)
@@ -75,6 +267,8 @@ class GameState:
         else:
             self.en_passant_possible = ()
 
+        self.en_passant_log.append(self.en_passant_possible)
+
         # castle move
         if move.is_castle_move:
             if move.end_col - move.start_col == 2:
@@ -90,6 +284,16 @@ class GameState:
         self.castle_rights_log.append(CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
                                                    self.current_castling_rights.wqs, self.current_castling_rights.bqs))
 
+        self.zobrist_key = self._hash_move(move, key)
+        self.zobrist_log.append(self.zobrist_key)
+        if move.piece_moved[1] == 'p' or move.piece_captured != '--':
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        self.halfmove_log.append(self.halfmove_clock)
+        self.score += self._score_move(move)
+        self._move_piece_locations(move, True)
+
     def update_castle_rights(self, move):
         if move.piece_moved == 'wK':
             self.current_castling_rights.wks = False
@@ -110,6 +314,160 @@ class GameState:
                 elif move.start_col == 7:
                     self.current_castling_rights.bks = False
 
+        # a rook captured on its original square also takes the castling right with it
+        if move.piece_captured == 'wR':
+            if move.end_row == 7:
+                if move.end_col == 0:
+                    self.current_castling_rights.wqs = False
+                elif move.end_col == 7:
+                    self.current_castling_rights.wks = False
+        elif move.piece_captured == 'bR':
+            if move.end_row == 0:
+                if move.end_col == 0:
+                    self.current_castling_rights.bqs = False
+                elif move.end_col == 7:
+                    self.current_castling_rights.bks = False
+
+    def compute_zobrist_key(self):
+        # full hash of the position, make_move only updates the key by xor but this
+        # is what it must always be equal to
+        key = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != '--':
+                    key ^= zobrist.PIECE_KEYS[piece][r * 8 + c]
+        key ^= zobrist.CASTLE_KEYS[zobrist.castle_mask(self.current_castling_rights)]
+        key ^= self._en_passant_hash()
+        if self.white_to_move:
+            key ^= zobrist.WHITE_TO_MOVE_KEY
+        return key
+
+    def _en_passant_hash(self):
+        # like Polyglot, the en passant square is only part of the key when a pawn of
+        # the side to move stands next to the pawn that just advanced two squares
+        if self.en_passant_possible == ():
+            return 0
+        r, c = self.en_passant_possible
+        if self.white_to_move:
+            pawn_row, pawn = r + 1, 'wp'
+        else:
+            pawn_row, pawn = r - 1, 'bp'
+        if (c > 0 and self.board[pawn_row][c - 1] == pawn) or (c < 7 and self.board[pawn_row][c + 1] == pawn):
+            return zobrist.EN_PASSANT_KEYS[c]
+        return 0
+
+    def _hash_move(self, move, key):
+        # xors the move into the key of the position before it, only from the Move
+        # and the logs so every backend can share it, called at the end of make_move
+        piece_keys = zobrist.PIECE_KEYS
+        start = move.start_row * 8 + move.start_col
+        end = move.end_row * 8 + move.end_col
+
+        key ^= piece_keys[move.piece_moved][start]
+        if move.is_pawn_promotion:
+            key ^= piece_keys[move.piece_moved[0] + move.pawn_promotion_piece][end]
+        else:
+            key ^= piece_keys[move.piece_moved][end]
+
+        if move.is_enpassant_move:
+            key ^= piece_keys[move.piece_captured][move.start_row * 8 + move.end_col]
+        elif move.piece_captured != '--':
+            key ^= piece_keys[move.piece_captured][end]
+
+        if move.is_castle_move:
+            rook_keys = piece_keys[move.piece_moved[0] + 'R']
+            if move.end_col - move.start_col == 2:
+                key ^= rook_keys[end + 1] ^ rook_keys[end - 1]
+            else:  # queen side castle
+                key ^= rook_keys[end - 2] ^ rook_keys[end + 1]
+
+        if move.piece_moved[1] in 'KR' or move.piece_captured[1] == 'R':  # only these change castling rights
+            key ^= zobrist.CASTLE_KEYS[zobrist.castle_mask(self.castle_rights_log[-2])] ^ \
+                zobrist.CASTLE_KEYS[zobrist.castle_mask(self.castle_rights_log[-1])]
+        key ^= zobrist.WHITE_TO_MOVE_KEY
+        return key ^ self._en_passant_hash()
+
+    def compute_score(self):
+        # full score of the board, what make_move and undo_move keep self.score equal to
+        score = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != '--':
+                    score += evaluation.SQUARE_SCORE[piece][r * 8 + c]
+        return score
+
+    def compute_piece_locations(self):
+        piece_locations = {'w': set(), 'b': set()}
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != '--':
+                    piece_locations[piece[0]].add(self._piece_location(r, c))
+        return piece_locations
+
+    def _piece_location(self, r, c):
+        # how a square is stored in the piece locations, (r, c) on the array board
+        return r, c
+
+    def _move_piece_locations(self, move, forward):
+        # moves the pieces of the move in piece_locations, forward from make_move and
+        # back from undo_move, only from the Move so every backend can share it
+        location = self._piece_location
+        start = location(move.start_row, move.start_col)
+        end = location(move.end_row, move.end_col)
+        own = self.piece_locations[move.piece_moved[0]]
+        if move.is_castle_move:
+            if move.end_col - move.start_col == 2:
+                rook_start, rook_end = location(move.end_row, move.end_col + 1), location(move.end_row, move.end_col - 1)
+            else:  # queen side castle
+                rook_start, rook_end = location(move.end_row, move.end_col - 2), location(move.end_row, move.end_col + 1)
+            if not forward:
+                rook_start, rook_end = rook_end, rook_start
+            own.remove(rook_start)
+            own.add(rook_end)
+
+        if move.piece_captured != '--':
+            captured = location(move.start_row, move.end_col) if move.is_enpassant_move else end
+            if forward:
+                self.piece_locations[move.piece_captured[0]].remove(captured)
+            else:
+                self.piece_locations[move.piece_captured[0]].add(captured)
+
+        if forward:
+            own.remove(start)
+            own.add(end)
+        else:
+            own.remove(end)
+            own.add(start)
+
+    def _score_move(self, move):
+        # how much the move changes the score, only from the Move so every backend
+        # can share it, make_move adds it and undo_move takes it back
+        square_score = evaluation.SQUARE_SCORE
+        start = move.start_row * 8 + move.start_col
+        end = move.end_row * 8 + move.end_col
+
+        delta = -square_score[move.piece_moved][start]
+        if move.is_pawn_promotion:
+            delta += square_score[move.piece_moved[0] + move.pawn_promotion_piece][end]
+        else:
+            delta += square_score[move.piece_moved][end]
+
+        if move.is_enpassant_move:
+            delta -= square_score[move.piece_captured][move.start_row * 8 + move.end_col]
+        elif move.piece_captured != '--':
+            delta -= square_score[move.piece_captured][end]
+
+        if move.is_castle_move:
+            rook_score = square_score[move.piece_moved[0] + 'R']
+            if move.end_col - move.start_col == 2:
+                delta += rook_score[end - 1] - rook_score[end + 1]
+            else:  # queen side castle
+                delta += rook_score[end + 1] - rook_score[end - 2]
+        return delta
+
     def undo_move(self):
         if len(self.move_log) != 0:
             move = self.move_log.pop()
@@ -127,11 +485,9 @@ class GameState:
             if move.is_enpassant_move:
                 self.board[move.end_row][move.end_col] = '--'
                 self.board[move.start_row][move.end_col] = move.piece_captured
-                self.en_passant_possible = (move.end_row, move.end_col)
 
-            # undo 2 square pawn advance
-            if move.piece_moved[1] == 'p' and abs(move.start_row - move.end_row) == 2:
-                self.en_passant_possible = ()
+            self.en_passant_log.pop()
+            self.en_passant_possible = self.en_passant_log[-1]
 
             # undo castle move
             if move.is_castle_move:
@@ -144,12 +500,54 @@ class GameState:
 
             # undo castling rights
             self.castle_rights_log.pop()  # get rid of the new castle rights from the move we are undoing
-            # set the current castle rights to the last one in the list
-            self.current_castling_rights = self.castle_rights_log[-1]
+            # set the current castle rights to a copy of the last one in the list, so
+            # the next move can't change the logged rights in place
+            last_rights = self.castle_rights_log[-1]
+            self.current_castling_rights = CastleRights(last_rights.wks, last_rights.bks,
+                                                        last_rights.wqs, last_rights.bqs)
+
+            self.zobrist_log.pop()
+            self.zobrist_key = self.zobrist_log[-1]
+            self.halfmove_log.pop()
+            self.halfmove_clock = self.halfmove_log[-1]
+            self.score -= self._score_move(move)
+            self._move_piece_locations(move, False)
 
             self.checkmate = self.stalemate = False
 
-    def get_valid_moves(self):
+    def make_null_move(self):
+        # passes the turn (for null move pruning): no piece moves and the en passant
+        # square goes away, undo_null_move puts the position back
+        self.zobrist_key ^= self._en_passant_hash() ^ zobrist.WHITE_TO_MOVE_KEY
+        self.white_to_move = not self.white_to_move
+        self.en_passant_possible = ()
+        self.en_passant_log.append(self.en_passant_possible)
+        self.zobrist_log.append(self.zobrist_key)
+        self.halfmove_clock = 0  # a repetition doesn't go through a pass
+        self.halfmove_log.append(self.halfmove_clock)
+
+    def undo_null_move(self):
+        self.white_to_move = not self.white_to_move
+        self.en_passant_log.pop()
+        self.en_passant_possible = self.en_passant_log[-1]
+        self.zobrist_log.pop()
+        self.zobrist_key = self.zobrist_log[-1]
+        self.halfmove_log.pop()
+        self.halfmove_clock = self.halfmove_log[-1]
+        self.checkmate = self.stalemate = False
+
+    def is_in_check(self):
+        # if the king of the side to move is attacked, without generating the moves
+        r, c = self.white_king_location if self.white_to_move else self.black_king_location
+        return self._is_under_attack(r, c)
+
+    def has_non_pawn_material(self):
+        # if the side to move has a piece besides the king and pawns, without one
+        # zugzwang positions are common
+        board = self.board
+        return any(board[r][c][1] not in 'pK' for r, c in self.piece_locations['w' if self.white_to_move else 'b'])
+
+    def get_valid_moves(self, captures_only=False, packed=False):
         temp_en_passant_possible = self.en_passant_possible
         temp_castle_rights = CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
                                           self.current_castling_rights.wqs, self.current_castling_rights.bqs)
@@ -180,6 +578,9 @@ class GameState:
                 # get rid of any moves that don't block check or move king
                 for i in range(len(moves) - 1, -1, -1):  # go through backwards when removing elements from a list
                     if moves[i].piece_moved[1] != 'K':  # move doesn't move king so it must block or capture
+                        if moves[i].is_enpassant_move and (moves[i].start_row, moves[i].end_col) == (check_row,
+                                                                                                    check_col):
+                            continue  # en passant captures the checking pawn away from its end square
                         if not (moves[i].end_row,
                                 moves[i].end_col) in valid_squares:  # move doesn't block check or capture piece
                             moves.remove(moves[i])
@@ -188,9 +589,13 @@ class GameState:
         else:  # not in check so all moves are fine
             moves = self._get_all_possible_moves()
 
-        self._get_castle_moves(king_row, king_col, moves)
+        if captures_only:
+            # the array backend generates every move and keeps the captures and promotions
+            moves = [move for move in moves if move.piece_captured != '--' or move.is_pawn_promotion]
+        else:
+            self._get_castle_moves(king_row, king_col, moves)
 
-        if len(moves) == 0:
+        if len(moves) == 0 and not captures_only:
             if self.in_check:
                 self.checkmate = True
             else:
@@ -199,6 +604,9 @@ class GameState:
         self.en_passant_possible = temp_en_passant_possible
         self.current_castling_rights = temp_castle_rights
 
+        if packed:
+            # this backend builds the Move objects anyway, the ints come from them
+            return [move.packed for move in moves]
         return moves
 
     def _check_for_pins_and_checks(self):
@@ -278,24 +686,53 @@ class GameState:
             return self._is_under_attack(self.black_king_location[0], self.black_king_location[1])
 
     def _is_under_attack(self, r, c):
-        self.white_to_move = not self.white_to_move  # switch to opponent's turn
-        opponent_moves = self._get_all_possible_moves()  # get their moves
-        self.white_to_move = not self.white_to_move  # switch turns back
+        # looks outward from the square for an enemy piece attacking it, instead of
+        # generating the opponent's moves: pawns and knights and the king on the
+        # squares they attack from, rooks, bishops and queens along the rays up to
+        # the first piece in the way
+        board = self.board
+        if self.white_to_move:
+            enemy_color = 'b'
+            pawn_row = r - 1  # black pawns attack downwards
+        else:
+            enemy_color = 'w'
+            pawn_row = r + 1
+        enemy_pawn = enemy_color + 'p'
+        if 0 <= pawn_row < 8:
+            if (c > 0 and board[pawn_row][c - 1] == enemy_pawn) or (c < 7 and board[pawn_row][c + 1] == enemy_pawn):
+                return True
 
-        for move in opponent_moves:
-            if move.end_row == r and move.end_col == c:
+        enemy_knight = enemy_color + 'N'
+        for m in ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)):
+            end_row = r + m[0]
+            end_col = c + m[1]
+            if 0 <= end_row < 8 and 0 <= end_col < 8 and board[end_row][end_col] == enemy_knight:
                 return True
 
-        return False
+        directions = ((-1, 0), (0, -1), (1, 0), (0, 1),
+                      (-1, -1), (-1, 1), (1, -1), (1, 1))
+        for j in range(len(directions)):
+            d = directions[j]
+            sliders = 'RQ' if j <= 3 else 'BQ'
+            for i in range(1, 8):
+                end_row = r + d[0] * i
+                end_col = c + d[1] * i
+                if not (0 <= end_row < 8 and 0 <= end_col < 8):
+                    break
+                end_piece = board[end_row][end_col]
+                if end_piece != '--':
+                    if end_piece[0] == enemy_color and (end_piece[1] in sliders or (i == 1 and end_piece[1] == 'K')):
+                        return True
+                    break
 
-    def _get_piece_moves(self, r, c):
-        self.move_functions[self.board[r][c][1]](r, c, self._all_moves)
+        return False
 
     def _get_all_possible_moves(self):
-        turn = 'w' if self.white_to_move else 'b'
-        self._all_moves = []
-        np.vectorize(self._get_piece_moves)(*np.where(np.vectorize(lambda x: x[0] == turn)(self.board)))
-        return self._all_moves
+        moves = []
+        # sorted, so the pieces are visited row by row like a scan of the board
+        for r, c in sorted(self.piece_locations['w' if self.white_to_move else 'b']):
+            self.move_functions[self.board[r][c][1]](r, c, moves)
+        return moves
 
     def get_possible_pawn_promotions(self):
         return ['Q', 'R', 'B', 'N']
@@ -317,9 +754,8 @@ class GameState:
             # if pawn promotion, append 4 moves promoting to each piece type
             if pawn_promotion:
                 for promotion in self.get_possible_pawn_promotions():
-                    new_move = Move((r, c), (move.end_row, move.end_col), self.board, is_pawn_promotion=True)
-                    new_move.pawn_promotion_piece = promotion
-                    moves.append(new_move)
+                    moves.append(Move((r, c), (move.end_row, move.end_col), self.board, is_pawn_promotion=True,
+                                      pawn_promotion_piece=promotion))
             else:
                 moves.append(move)
 
@@ -335,7 +771,8 @@ class GameState:
             back_row = 7
 
         if self.board[r + move_amount][c] == '--':  # 1 square pawn advance
-            if not piece_pinned or pin_direction == (move_amount, 0):
+            # a pawn pinned along its file can still advance, whichever side the king is on
+            if not piece_pinned or pin_direction == (move_amount, 0) or pin_direction == (-move_amount, 0):
                 if r + move_amount == back_row:  # if piece gets to back row, it's a promotion
                     pawn_promotion = True
                 _append_move(Move((r, c), (r + move_amount, c), self.board))
@@ -348,14 +785,7 @@ class GameState:
                         pawn_promotion = True
                     _append_move(Move((r, c), (r + move_amount, c - 1), self.board))
                 elif (r + move_amount, c - 1) == self.en_passant_possible:
-                    attacking_piece = blocking_piece = False
-                    if r == 3:
-                        attacking_piece = self.board[r][c - 1] == 'wp'
-                        blocking_piece = self.board[r - 1][c - 1] == 'wp'
-                    elif r == 4:
-                        attacking_piece = self.board[r][c - 1] == 'bp'
-                        blocking_piece = self.board[r + 1][c - 1] == 'bp'
-                    if attacking_piece and blocking_piece:
+                    if self._is_en_passant_safe(r, c, c - 1):
                         moves.append(Move((r, c), (r + move_amount, c - 1), self.board, is_en_passant_move=True))
         if c + 1 <= 7:
             if not piece_pinned or pin_direction == (move_amount, 1):
@@ -364,16 +794,32 @@ class GameState:
                         pawn_promotion = True
                     _append_move(Move((r, c), (r + move_amount, c + 1), self.board))
                 elif (r + move_amount, c + 1) == self.en_passant_possible:
-                    attacking_piece = blocking_piece = False
-                    if r == 3:
-                        attacking_piece = self.board[r][c + 1] == 'wp'
-                        blocking_piece = self.board[r - 1][c + 1] == 'wp'
-                    elif r == 4:
-                        attacking_piece = self.board[r][c + 1] == 'bp'
-                        blocking_piece = self.board[r + 1][c + 1] == 'bp'
-                    if attacking_piece and blocking_piece:
+                    if self._is_en_passant_safe(r, c, c + 1):
                         moves.append(Move((r, c), (r + move_amount, c + 1), self.board, is_en_passant_move=True))
 
+    def _is_en_passant_safe(self, r, c, capture_col):
+        # an en passant capture takes two pawns off the same row at once, which can
+        # expose the king to a rook or queen on that row without it being a pin
+        king_row, king_col = self.white_king_location if self.white_to_move else self.black_king_location
+        enemy_color = 'b' if self.white_to_move else 'w'
+        attacking_piece = blocking_piece = False
+        if king_row == r:
+            if king_col < c:  # king is left of the pawns
+                inside_range = range(king_col + 1, min(c, capture_col))
+                outside_range = range(max(c, capture_col) + 1, 8)
+            else:  # king is right of the pawns
+                inside_range = range(king_col - 1, max(c, capture_col), -1)
+                outside_range = range(min(c, capture_col) - 1, -1, -1)
+            for i in inside_range:
+                if self.board[r][i] != '--':  # another piece blocks the row
+                    blocking_piece = True
+            for i in outside_range:
+                square = self.board[r][i]
+                if square != '--':
+                    attacking_piece = square[0] == enemy_color and (square[1] == 'R' or square[1] == 'Q')
+                    break
+        return not attacking_piece or blocking_piece
+
     def _get_rook_moves(self, r, c, moves):
         piece_pinned = False
         pin_direction = ()
@@ -461,26 +907,62 @@ class GameState:
     def _get_king_moves(self, r, c, moves):
         row_moves = (-1, -1, -1, 0, 0, 1, 1, 1)
         col_moves = (-1, 0, 1, -1, 1, -1, 0, 1)
+        board = self.board
         ally_color = 'w' if self.white_to_move else 'b'
+        targets = []
         for i in range(8):
             end_row = r + row_moves[i]
             end_col = c + col_moves[i]
-            if 0 <= end_row < 8 and 0 <= end_col < 8:
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] != ally_color:
-                    # place king on end square and check for checks
-                    if ally_color == 'w':
-                        self.white_king_location = (end_row, end_col)
-                    else:
-                        self.black_king_location = (end_row, end_col)
-                    in_check, pins, checks = self._check_for_pins_and_checks()
-                    if not in_check:
-                        moves.append(Move((r, c), (end_row, end_col), self.board))
-                    # place king back on original location
-                    if ally_color == 'w':
-                        self.white_king_location = (r, c)
-                    else:
-                        self.black_king_location = (r, c)
+            if 0 <= end_row < 8 and 0 <= end_col < 8 and board[end_row][end_col][0] != ally_color:
+                targets.append((end_row, end_col))
+        if len(targets) >= self.ATTACK_SET_TARGETS:
+            attacked = self._get_enemy_attacks(r, c)
+            for end_rc in targets:
+                if end_rc not in attacked:
+                    moves.append(Move((r, c), end_rc, board))
+            return
+        # few squares to go to (the usual middlegame king), each one is tested on
+        # its own with the king taken off the board, like _get_enemy_attacks does
+        king = board[r][c]
+        board[r][c] = '--'
+        safe = [end_rc for end_rc in targets if not self._is_under_attack(*end_rc)]
+        board[r][c] = king
+        for end_rc in safe:
+            moves.append(Move((r, c), end_rc, board))
+
+    def _get_enemy_attacks(self, r, c):
+        # every square the enemy attacks, found with the king at (r, c) taken off the
+        # board, so the squares behind it on a slider's ray count too (the king can't
+        # step back along the line it's checked on)
+        enemy_color = 'b' if self.white_to_move else 'w'
+        pawn_direction = 1 if enemy_color == 'b' else -1
+        directions = {'R': ((-1, 0), (0, -1), (1, 0), (0, 1)),
+                      'B': ((-1, -1), (-1, 1), (1, -1), (1, 1)),
+                      'Q': ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))}
+        jumps = {'N': ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)),
+                 'K': ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))}
+        board = self.board.tolist()  # plain lists are much faster to walk than the array
+        board[r][c] = '--'
+        attacked = set()
+        for start_row, start_col in self.piece_locations[enemy_color]:
+            kind = board[start_row][start_col][1]
+            if kind == 'p':
+                attacked.add((start_row + pawn_direction, start_col - 1))
+                attacked.add((start_row + pawn_direction, start_col + 1))
+            elif kind in jumps:
+                for m in jumps[kind]:
+                    attacked.add((start_row + m[0], start_col + m[1]))
+            else:
+                for d in directions[kind]:
+                    for i in range(1, 8):
+                        end_row = start_row + d[0] * i
+                        end_col = start_col + d[1] * i
+                        if not (0 <= end_row < 8 and 0 <= end_col < 8):
+                            break
+                        attacked.add((end_row, end_col))
+                        if board[end_row][end_col] != '--':
+                            break
+        return attacked
 
     def _get_castle_moves(self, r, c, moves):
         if self._is_under_attack(r, c):
@@ -527,8 +1009,23 @@ class Move:
 
     int_to_promotion = {v: k for k, v in promotion_to_int.items()}
 
+    # a move packs into one int: start and end square (r * 8 + c, 6 bits each) and
+    # promotion piece (3 bits), which is also the move_id, then the flags and the
+    # codes of the moved and captured pieces (see packed and from_packed). The
+    # search runs on these ints, get_valid_moves(packed=True) returns them
+    ID_MASK = (1 << 15) - 1
+    FLAGS_SHIFT = 15
+    MOVED_SHIFT = 18
+    CAPTURED_SHIFT = 23
+    EN_PASSANT_FLAG = 1
+    CASTLE_FLAG = 2
+    PROMOTION_FLAG = 4
+
+    __slots__ = ('start_row', 'start_col', 'end_row', 'end_col', 'piece_moved', 'piece_captured',
+                 'is_pawn_promotion', 'is_enpassant_move', 'is_castle_move', '_pawn_promotion_piece', 'move_id')
+
     def __init__(self, start_sq, end_sq, board, is_en_passant_move=False, is_pawn_promotion=False,
-                 is_castle_move=False):
+                 is_castle_move=False, pawn_promotion_piece=None):
         self.start_row = start_sq[0]
         self.start_col = start_sq[1]
         self.end_row = end_sq[0]
@@ -536,7 +1033,7 @@ class Move:
         self.piece_moved = board[self.start_row][self.start_col]
         self.piece_captured = board[self.end_row][self.end_col]
 
-        self.pawn_promotion_piece = None  # used for pawn promotion
+        self.pawn_promotion_piece = pawn_promotion_piece  # used for pawn promotion
         self.is_pawn_promotion = is_pawn_promotion
 
         self.is_enpassant_move = is_en_passant_move
@@ -547,12 +1044,47 @@ class Move:
         self.is_castle_move = is_castle_move
 
     @property
-    def move_id(self):
-        return self.promotion_to_int[self.pawn_promotion_piece] * 10000 + \
-            self.start_row * 1000 + \
-            self.start_col * 100 + \
-            self.end_row * 10 + \
-            self.end_col
+    def pawn_promotion_piece(self):
+        return self._pawn_promotion_piece
+
+    @pawn_promotion_piece.setter
+    def pawn_promotion_piece(self, piece):
+        # the move_id is kept with the move instead of being worked out on every
+        # comparison, it only changes with the promotion piece
+        self._pawn_promotion_piece = piece
+        self.move_id = self.make_id((self.start_row, self.start_col), (self.end_row, self.end_col), piece)
+
+    @classmethod
+    def make_id(cls, start_sq, end_sq, promotion=None):
+        # the move_id of the move from start_sq to end_sq, to look a move up by it
+        return start_sq[0] * 8 + start_sq[1] | (end_sq[0] * 8 + end_sq[1]) << 6 | cls.promotion_to_int[promotion] << 12
+
+    @property
+    def packed(self):
+        flags = self.EN_PASSANT_FLAG if self.is_enpassant_move else 0
+        if self.is_castle_move:
+            flags |= self.CASTLE_FLAG
+        if self.is_pawn_promotion:
+            flags |= self.PROMOTION_FLAG
+        return self.move_id | flags << self.FLAGS_SHIFT | PIECE_CODES[self.piece_moved] << self.MOVED_SHIFT | \
+            PIECE_CODES[self.piece_captured] << self.CAPTURED_SHIFT
+
+    @classmethod
+    def from_packed(cls, packed):
+        # builds the Move back from its packed int, without a board
+        move = cls.__new__(cls)
+        start, end = packed & 63, packed >> 6 & 63
+        move.start_row, move.start_col = start >> 3, start & 7
+        move.end_row, move.end_col = end >> 3, end & 7
+        move.piece_moved = CODE_PIECES[packed >> cls.MOVED_SHIFT & 31]
+        move.piece_captured = CODE_PIECES[packed >> cls.CAPTURED_SHIFT & 31]
+        flags = packed >> cls.FLAGS_SHIFT
+        move.is_enpassant_move = bool(flags & cls.EN_PASSANT_FLAG)
+        move.is_castle_move = bool(flags & cls.CASTLE_FLAG)
+        move.is_pawn_promotion = bool(flags & cls.PROMOTION_FLAG)
+        move._pawn_promotion_piece = cls.int_to_promotion[packed >> 12 & 7]
+        move.move_id = packed & cls.ID_MASK
+        return move
 
     def get_chess_notation(self):
         return self.get_rank_file(self.start_row, self.start_col) + self.get_rank_file(self.end_row, self.end_col)
@@ -564,3 +1096,678 @@ class Move:
         if isinstance(other, Move):
             return self.move_id == other.move_id
         return False
+
+    def __hash__(self):
+        return self.move_id
+
+
+# -----------------------------------------------------------------------------
+# integer mailbox backend
+# -----------------------------------------------------------------------------
+# pieces are small integers, the low three bits hold the piece type and the
+# next two bits the color, so `piece & enemy_color` tells if a square holds an
+# enemy piece and `piece & 7` gives its type without touching any string
+EMPTY = 0
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = 1, 2, 3, 4, 5, 6
+WHITE = 8
+BLACK = 16
+OFFBOARD = 32
+
+PIECE_CODES = {'--': EMPTY}
+for _color, _color_code in (('w', WHITE), ('b', BLACK)):
+    for _piece, _piece_code in (('p', PAWN), ('N', KNIGHT), ('B', BISHOP), ('R', ROOK), ('Q', QUEEN), ('K', KING)):
+        PIECE_CODES[_color + _piece] = _color_code | _piece_code
+
+CODE_PIECES = ['--'] * (OFFBOARD + 1)
+for _piece, _code in PIECE_CODES.items():
+    CODE_PIECES[_code] = _piece
+
+PROMOTION_CODES = {'Q': QUEEN, 'R': ROOK, 'B': BISHOP, 'N': KNIGHT}
+
+# FEN letters of the pieces, and the nibble of each piece in the binary position
+# encoding (the piece type, plus 8 for black, see GameState.to_bytes)
+PIECE_FEN = {}
+for _piece in PIECE_CODES:
+    if _piece != '--':
+        _letter = _piece[1].upper()
+        PIECE_FEN[_piece] = _letter if _piece[0] == 'w' else _letter.lower()
+FEN_PIECES = {_letter: _piece for _piece, _letter in PIECE_FEN.items()}
+
+PIECE_NIBBLES = {_piece: _code & 7 | (8 if _code & BLACK else 0) for _piece, _code in PIECE_CODES.items()}
+NIBBLE_PIECES = ['--'] * 16
+for _piece, _nibble in PIECE_NIBBLES.items():
+    NIBBLE_PIECES[_nibble] = _piece
+
+# 32 bytes of squares, then flags, en passant file, halfmove clock, fullmove number
+POSITION_TAIL = struct.Struct('>BBBH')
+POSITION_BYTES = 32 + POSITION_TAIL.size
+
+# the 8x8 board sits in the middle of a 10x12 array, the two extra rows and
+# the extra column around it hold OFFBOARD so rays stop without bound checks
+BOARD_SQUARES = tuple(21 + r * 10 + c for r in range(8) for c in range(8))
+
+SQUARE_TO_RC = [None] * 120
+SQUARE_TO_INDEX = [None] * 120  # r * 8 + c, the squares of a packed move
+for _square in BOARD_SQUARES:
+    SQUARE_TO_RC[_square] = (_square // 10 - 2, _square % 10 - 1)
+    SQUARE_TO_INDEX[_square] = (_square // 10 - 2) * 8 + _square % 10 - 1
+
+# same order as the directions of the array backend: up, left, down, right
+# and then the four diagonals, so both backends generate moves in the same order
+MAILBOX_DIRECTIONS = (-10, -1, 10, 1, -11, -9, 9, 11)
+ROOK_DIRECTIONS = MAILBOX_DIRECTIONS[:4]
+BISHOP_DIRECTIONS = MAILBOX_DIRECTIONS[4:]
+SLIDER_DIRECTIONS = {ROOK: ROOK_DIRECTIONS, BISHOP: BISHOP_DIRECTIONS, QUEEN: MAILBOX_DIRECTIONS}
+KNIGHT_OFFSETS = (-21, -19, -12, -8, 8, 12, 19, 21)
+KING_OFFSETS = (-11, -10, -9, -1, 1, 9, 10, 11)
+
+
+def to_square(r, c):
+    return 21 + r * 10 + c
+
+
+# the mailbox and bitboard backends generate their moves packed (see Move)
+MOVED_SHIFT = Move.MOVED_SHIFT
+CAPTURED_SHIFT = Move.CAPTURED_SHIFT
+EN_PASSANT_MOVE = Move.EN_PASSANT_FLAG << Move.FLAGS_SHIFT
+CASTLE_MOVE = Move.CASTLE_FLAG << Move.FLAGS_SHIFT
+PROMOTION_MOVE = Move.PROMOTION_FLAG << Move.FLAGS_SHIFT
+
+
+def pack_move(squares, start, end):
+    # the packed move of the piece on mailbox square start to end
+    return SQUARE_TO_INDEX[start] | SQUARE_TO_INDEX[end] << 6 | squares[start] << MOVED_SHIFT | \
+        squares[end] << CAPTURED_SHIFT
+
+
+# what the mailbox backend makes a packed move with: the zobrist keys and square
+# scores of every piece code by square (r * 8 + c), the piece code of each
+# promotion of a packed move (see Move.promotion_to_int) and the piece_locations
+# key of each color
+CODE_KEYS = [zobrist.PIECE_KEYS.get(piece) for piece in CODE_PIECES]
+CODE_SCORES = [evaluation.SQUARE_SCORE.get(piece) for piece in CODE_PIECES]
+PACKED_PROMOTIONS = [EMPTY, QUEEN, ROOK, BISHOP, KNIGHT]
+COLOR_NAMES = {WHITE: 'w', BLACK: 'b'}
+
+
+class MailboxRow:
+    __slots__ = ('squares', 'offset')
+
+    def __init__(self, squares, offset):
+        self.squares = squares
+        self.offset = offset
+
+    def __getitem__(self, c):
+        return CODE_PIECES[self.squares[self.offset + c]]
+
+    def __setitem__(self, c, piece):
+        self.squares[self.offset + c] = PIECE_CODES[piece]
+
+    def __len__(self):
+        return 8
+
+    def __iter__(self):
+        return (CODE_PIECES[self.squares[self.offset + c]] for c in range(8))
+
+
+class MailboxBoard(list):
+    # string view of the mailbox, indexed like the array backend as board[row][col]
+    # so the drawing code and Move keep working on 'wp'/'--' strings, while the
+    # engine reads and writes the integer codes in `squares` directly
+
+    def __init__(self, board):
+        self.squares = [OFFBOARD] * 120
+        super().__init__(MailboxRow(self.squares, to_square(r, 0)) for r in range(8))
+        for r in range(8):
+            for c in range(8):
+                self.squares[to_square(r, c)] = PIECE_CODES[str(board[r][c])]
+
+
+class MailboxGameState(GameState):
+    ATTACK_SET_TARGETS = 3  # a square costs less to look at here than on the array
+
+    def __init__(self, backend='mailbox'):
+        super().__init__(backend)
+        self.board = MailboxBoard(self.board)
+        self.squares = self.board.squares
+
+        self.move_functions = {PAWN: self._get_pawn_moves,
+                               ROOK: self._get_rook_moves,
+                               KNIGHT: self._get_knight_moves,
+                               BISHOP: self._get_bishop_moves,
+                               QUEEN: self._get_queen_moves,
+                               KING: self._get_king_moves}
+
+    def _en_passant_hash(self):
+        if self.en_passant_possible == ():
+            return 0
+        r, c = self.en_passant_possible
+        if self.white_to_move:
+            square, pawn = to_square(r + 1, c), WHITE | PAWN
+        else:
+            square, pawn = to_square(r - 1, c), BLACK | PAWN
+        if self.squares[square - 1] == pawn or self.squares[square + 1] == pawn:
+            return zobrist.EN_PASSANT_KEYS[c]
+        return 0
+
+    def _is_under_attack(self, r, c):
+        # see GameState._is_under_attack
+        squares = self.squares
+        square = to_square(r, c)
+        if self.white_to_move:
+            enemy_color = BLACK
+            pawn_square = square - 10  # black pawns attack downwards
+        else:
+            enemy_color = WHITE
+            pawn_square = square + 10
+        if squares[pawn_square - 1] == enemy_color | PAWN or squares[pawn_square + 1] == enemy_color | PAWN:
+            return True
+
+        for m in KNIGHT_OFFSETS:
+            if squares[square + m] == enemy_color | KNIGHT:
+                return True
+
+        for j, d in enumerate(MAILBOX_DIRECTIONS):
+            slider = ROOK if j <= 3 else BISHOP
+            end = square + d
+            end_piece = squares[end]
+            if end_piece == enemy_color | KING:
+                return True
+            while end_piece == EMPTY:
+                end += d
+                end_piece = squares[end]
+            if end_piece == enemy_color | slider or end_piece == enemy_color | QUEEN:
+                return True
+
+        return False
+
+    def _get_king_square(self):
+        if self.white_to_move:
+            return to_square(*self.white_king_location)
+        return to_square(*self.black_king_location)
+
+    def make_move(self, move):
+        # the search makes packed moves, the game Move objects, both are made from
+        # the packed int (no Move is built) and go to the move log as they came
+        self._make_packed(move if type(move) is int else move.packed)
+        self.move_log.append(move)
+
+    def undo_move(self):
+        if len(self.move_log) != 0:
+            move = self.move_log.pop()
+            self._undo_packed(move if type(move) is int else move.packed)
+
+    def _make_packed(self, move):
+        squares = self.squares
+        start_index = move & 63
+        end_index = move >> 6 & 63
+        start = BOARD_SQUARES[start_index]
+        end = BOARD_SQUARES[end_index]
+        piece = move >> MOVED_SHIFT & 31
+        captured = move >> CAPTURED_SHIFT & 31
+        kind = piece & 7
+        us = piece & (WHITE | BLACK)
+        own = self.piece_locations[COLOR_NAMES[us]]
+
+        # the en passant part of the key depends on the board before the move
+        key = self.zobrist_key ^ self._en_passant_hash() ^ zobrist.WHITE_TO_MOVE_KEY ^ CODE_KEYS[piece][start_index]
+        squares[start] = EMPTY
+        own.remove(start)
+        own.add(end)
+        if move & PROMOTION_MOVE:
+            promoted = us | PACKED_PROMOTIONS[move >> 12 & 7]
+            squares[end] = promoted
+            key ^= CODE_KEYS[promoted][end_index]
+        else:
+            squares[end] = piece
+            key ^= CODE_KEYS[piece][end_index]
+
+        if captured:
+            if move & EN_PASSANT_MOVE:
+                captured_index = start_index & 56 | end_index & 7  # the row of the start, the column of the end
+                captured_square = BOARD_SQUARES[captured_index]
+                squares[captured_square] = EMPTY
+            else:
+                captured_index, captured_square = end_index, end
+            key ^= CODE_KEYS[captured][captured_index]
+            self.piece_locations[COLOR_NAMES[captured & (WHITE | BLACK)]].remove(captured_square)
+
+        if move & CASTLE_MOVE:
+            if end > start:
+                rook_start, rook_end = end_index + 1, end_index - 1
+            else:  # queen side castle
+                rook_start, rook_end = end_index - 2, end_index + 1
+            squares[BOARD_SQUARES[rook_end]] = squares[BOARD_SQUARES[rook_start]]
+            squares[BOARD_SQUARES[rook_start]] = EMPTY
+            own.remove(BOARD_SQUARES[rook_start])
+            own.add(BOARD_SQUARES[rook_end])
+            rook_keys = CODE_KEYS[us | ROOK]
+            key ^= rook_keys[rook_start] ^ rook_keys[rook_end]
+
+        if kind == KING:
+            if us == WHITE:
+                self.white_king_location = SQUARE_TO_RC[end]
+            else:
+                self.black_king_location = SQUARE_TO_RC[end]
+
+        # only on 2 square pawn advances, the square in between
+        self.en_passant_possible = SQUARE_TO_RC[(start + end) >> 1] if kind == PAWN and abs(start - end) == 20 else ()
+        self.en_passant_log.append(self.en_passant_possible)
+
+        # a king or rook move, or a rook captured on its square, can take castling
+        # rights away. The rights are never changed in place, a move that keeps
+        # them logs the same object again
+        rights = self.current_castling_rights
+        if kind == KING or kind == ROOK or captured & 7 == ROOK:
+            old_rights = rights
+            rights = CastleRights(rights.wks, rights.bks, rights.wqs, rights.bqs)
+            if piece == WHITE | KING:
+                rights.wks = rights.wqs = False
+            elif piece == BLACK | KING:
+                rights.bks = rights.bqs = False
+            for code, index in ((piece, start_index), (captured, end_index)):
+                if code == WHITE | ROOK:
+                    if index == 56:
+                        rights.wqs = False
+                    elif index == 63:
+                        rights.wks = False
+                elif code == BLACK | ROOK:
+                    if index == 0:
+                        rights.bqs = False
+                    elif index == 7:
+                        rights.bks = False
+            key ^= zobrist.CASTLE_KEYS[zobrist.castle_mask(old_rights)] ^ \
+                zobrist.CASTLE_KEYS[zobrist.castle_mask(rights)]
+            self.current_castling_rights = rights
+        self.castle_rights_log.append(rights)
+
+        self.white_to_move = not self.white_to_move
+        self.zobrist_key = key ^ self._en_passant_hash()
+        self.zobrist_log.append(self.zobrist_key)
+        if kind == PAWN or captured:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        self.halfmove_log.append(self.halfmove_clock)
+        self.score += self._score_packed(move)
+
+    def _undo_packed(self, move):
+        squares = self.squares
+        start_index = move & 63
+        end_index = move >> 6 & 63
+        start = BOARD_SQUARES[start_index]
+        end = BOARD_SQUARES[end_index]
+        piece = move >> MOVED_SHIFT & 31
+        captured = move >> CAPTURED_SHIFT & 31
+        us = piece & (WHITE | BLACK)
+        own = self.piece_locations[COLOR_NAMES[us]]
+
+        squares[start] = piece
+        own.remove(end)
+        own.add(start)
+        if move & EN_PASSANT_MOVE:
+            squares[end] = EMPTY
+            captured_square = BOARD_SQUARES[start_index & 56 | end_index & 7]
+            squares[captured_square] = captured
+        else:
+            squares[end] = captured
+            captured_square = end
+        if captured:
+            self.piece_locations[COLOR_NAMES[captured & (WHITE | BLACK)]].add(captured_square)
+
+        if move & CASTLE_MOVE:
+            if end > start:
+                rook_start, rook_end = BOARD_SQUARES[end_index + 1], BOARD_SQUARES[end_index - 1]
+            else:  # queen side castle
+                rook_start, rook_end = BOARD_SQUARES[end_index - 2], BOARD_SQUARES[end_index + 1]
+            squares[rook_start] = squares[rook_end]
+            squares[rook_end] = EMPTY
+            own.remove(rook_end)
+            own.add(rook_start)
+
+        if piece == WHITE | KING:
+            self.white_king_location = SQUARE_TO_RC[start]
+        elif piece == BLACK | KING:
+            self.black_king_location = SQUARE_TO_RC[start]
+
+        self.white_to_move = not self.white_to_move
+        self.en_passant_log.pop()
+        self.en_passant_possible = self.en_passant_log[-1]
+        self.castle_rights_log.pop()
+        self.current_castling_rights = self.castle_rights_log[-1]
+        self.zobrist_log.pop()
+        self.zobrist_key = self.zobrist_log[-1]
+        self.halfmove_log.pop()
+        self.halfmove_clock = self.halfmove_log[-1]
+        self.score -= self._score_packed(move)
+        self.checkmate = self.stalemate = False
+
+    def _score_packed(self, move):
+        # _score_move of a packed move
+        start_index = move & 63
+        end_index = move >> 6 & 63
+        piece = move >> MOVED_SHIFT & 31
+        captured = move >> CAPTURED_SHIFT & 31
+        delta = -CODE_SCORES[piece][start_index]
+        if move & PROMOTION_MOVE:
+            delta += CODE_SCORES[piece & (WHITE | BLACK) | PACKED_PROMOTIONS[move >> 12 & 7]][end_index]
+        else:
+            delta += CODE_SCORES[piece][end_index]
+        if move & EN_PASSANT_MOVE:
+            delta -= CODE_SCORES[captured][start_index & 56 | end_index & 7]
+        elif captured:
+            delta -= CODE_SCORES[captured][end_index]
+        if move & CASTLE_MOVE:
+            rook_score = CODE_SCORES[piece & (WHITE | BLACK) | ROOK]
+            if end_index > start_index:
+                delta += rook_score[end_index - 1] - rook_score[end_index + 1]
+            else:  # queen side castle
+                delta += rook_score[end_index + 1] - rook_score[end_index - 2]
+        return delta
+
+    def has_non_pawn_material(self):
+        squares = self.squares
+        return any(squares[square] & 7 not in (PAWN, KING)
+                   for square in self.piece_locations['w' if self.white_to_move else 'b'])
+
+    def get_valid_moves(self, captures_only=False, packed=False):
+        temp_en_passant_possible = self.en_passant_possible
+        moves = []
+        self.in_check, self.pins, self.checks = self._check_for_pins_and_checks()
+        self.captures_only = captures_only
+        king = self._get_king_square()
+
+        if self.in_checkmate():
+            if len(self.checks) == 1:  # only 1 check, block check or move king
+                moves = self._get_all_possible_moves()
+                # to block a check you must move a piece into one of the squares between the enemy piece and king
+                check_square, check_direction = self.checks[0]
+                if self.squares[check_square] & 7 == KNIGHT:
+                    valid_squares = {SQUARE_TO_INDEX[check_square]}
+                else:
+                    valid_squares = set()
+                    square = king
+                    while square != check_square:
+                        square += check_direction
+                        valid_squares.add(SQUARE_TO_INDEX[square])
+                check_index = SQUARE_TO_INDEX[check_square]
+                # get rid of any moves that don't block check or move king, en passant can still
+                # capture the checking pawn away from its end square (the start row, the end column)
+                moves = [move for move in moves if move >> MOVED_SHIFT & 7 == KING or
+                         move >> 6 & 63 in valid_squares or
+                         (move & EN_PASSANT_MOVE and move & 56 | move >> 6 & 7 == check_index)]
+            else:  # double check, king has to move
+                self._get_king_moves(king, moves)
+        else:  # not in check so all moves are fine
+            moves = self._get_all_possible_moves()
+
+        self.captures_only = False
+        if not captures_only:
+            self._get_castle_moves(king, moves)
+
+        if len(moves) == 0 and not captures_only:
+            if self.in_check:
+                self.checkmate = True
+            else:
+                self.stalemate = True
+
+        self.en_passant_possible = temp_en_passant_possible
+
+        return moves if packed else [Move.from_packed(move) for move in moves]
+
+    def _check_for_pins_and_checks(self):
+        pins = []
+        checks = []
+        in_check = False
+        squares = self.squares
+
+        if self.white_to_move:
+            enemy_color = BLACK
+            ally_color = WHITE
+        else:
+            enemy_color = WHITE
+            ally_color = BLACK
+        start = self._get_king_square()
+
+        # check outward from king for pins and checks, keep track of pins
+        for j, d in enumerate(MAILBOX_DIRECTIONS):
+            possible_pin = ()
+            end = start
+            for i in range(1, 8):
+                end += d
+                end_piece = squares[end]
+                if end_piece == OFFBOARD:
+                    break
+                if end_piece & ally_color and end_piece & 7 != KING:
+                    if possible_pin == ():
+                        possible_pin = (end, d)
+                    else:  # 2nd allied piece, so no pin or check possible in this direction
+                        break
+                elif end_piece & enemy_color:
+                    kind = end_piece & 7
+                    # same 5 possibilities as the array backend, see GameState._check_for_pins_and_checks
+                    if (j <= 3 and kind == ROOK) or \
+                            (4 <= j and kind == BISHOP) or \
+                            (i == 1 and kind == PAWN and ((enemy_color == WHITE and 6 <= j) or (
+                                    enemy_color == BLACK and 4 <= j <= 5))) or \
+                            (kind == QUEEN) or (i == 1 and kind == KING):
+                        if possible_pin == ():
+                            # no piece blocking, so check
+                            in_check = True
+                            checks.append((end, d))
+                        else:  # piece blocking so pin
+                            pins.append(possible_pin)
+                    break  # enemy piece stops the ray either way
+
+        # check for knight checks
+        for m in KNIGHT_OFFSETS:
+            if squares[start + m] == enemy_color | KNIGHT:
+                in_check = True
+                checks.append((start + m, m))
+
+        return in_check, pins, checks
+
+    def _piece_location(self, r, c):
+        return to_square(r, c)
+
+    def _get_all_possible_moves(self):
+        squares = self.squares
+        moves = []
+        for square in sorted(self.piece_locations['w' if self.white_to_move else 'b']):
+            self.move_functions[squares[square] & 7](square, moves)
+        return moves
+
+    def _get_pin(self, square, remove=True):
+        for i in range(len(self.pins) - 1, -1, -1):
+            if self.pins[i][0] == square:
+                pin_direction = self.pins[i][1]
+                if remove:
+                    self.pins.remove(self.pins[i])
+                return True, pin_direction
+        return False, 0
+
+    def _get_pawn_moves(self, square, moves):
+        piece_pinned, pin_direction = self._get_pin(square)
+        squares = self.squares
+        start_rc = SQUARE_TO_RC[square]
+
+        if self.white_to_move:  # white pawn moves
+            move_amount = -10
+            start_row = 6
+            enemy_color = BLACK
+            back_row = 0
+        else:  # black pawn moves
+            move_amount = 10
+            start_row = 1
+            enemy_color = WHITE
+            back_row = 7
+
+        pawn_promotion = SQUARE_TO_RC[square + move_amount][0] == back_row
+
+        def _append_move(end):
+            # if pawn promotion, append 4 moves promoting to each piece type
+            move = pack_move(squares, square, end)
+            if pawn_promotion:
+                for promotion in self.get_possible_pawn_promotions():
+                    moves.append(move | Move.promotion_to_int[promotion] << 12 | PROMOTION_MOVE)
+            else:
+                moves.append(move)
+
+        end = square + move_amount
+        if squares[end] == EMPTY and (pawn_promotion or not self.captures_only):  # 1 square pawn advance
+            if not piece_pinned or pin_direction == move_amount or pin_direction == -move_amount:
+                _append_move(end)
+                if start_rc[0] == start_row and squares[end + move_amount] == EMPTY:
+                    _append_move(end + move_amount)
+        for side in (-1, 1):
+            end = square + move_amount + side
+            if not piece_pinned or pin_direction == move_amount + side:
+                if squares[end] & enemy_color:
+                    _append_move(end)
+                elif SQUARE_TO_RC[end] == self.en_passant_possible:
+                    if self._is_en_passant_safe(square, square + side):
+                        moves.append(pack_move(squares, square, end) | (enemy_color | PAWN) << CAPTURED_SHIFT |
+                                     EN_PASSANT_MOVE)
+
+    def _is_en_passant_safe(self, square, capture_square):
+        # see GameState._is_en_passant_safe, walks the row from the king past both pawns
+        squares = self.squares
+        king = self._get_king_square()
+        enemy_color = BLACK if self.white_to_move else WHITE
+        if king // 10 != square // 10:
+            return True
+        step = 1 if king < square else -1
+        end = king + step
+        while end != square and end != capture_square:
+            if squares[end] != EMPTY:  # another piece blocks the row
+                return True
+            end += step
+        end += 2 * step
+        while squares[end] == EMPTY:
+            end += step
+        return squares[end] != enemy_color | ROOK and squares[end] != enemy_color | QUEEN
+
+    def _get_slider_moves(self, square, directions, piece_pinned, pin_direction, moves):
+        enemy_color = BLACK if self.white_to_move else WHITE
+        squares = self.squares
+        moved = SQUARE_TO_INDEX[square] | squares[square] << MOVED_SHIFT
+        quiet = not self.captures_only
+        for d in directions:
+            if piece_pinned and pin_direction != d and pin_direction != -d:
+                continue
+            end = square + d
+            while True:
+                end_piece = squares[end]
+                if end_piece == EMPTY:
+                    if quiet:
+                        moves.append(moved | SQUARE_TO_INDEX[end] << 6)
+                elif end_piece & enemy_color:
+                    moves.append(moved | SQUARE_TO_INDEX[end] << 6 | end_piece << CAPTURED_SHIFT)
+                    break
+                else:  # friendly piece or off board
+                    break
+                end += d
+
+    def _get_rook_moves(self, square, moves):
+        # can't remove queen from pin on rook moves, only remove it on bishop moves
+        piece_pinned, pin_direction = self._get_pin(square, remove=self.squares[square] & 7 != QUEEN)
+        self._get_slider_moves(square, ROOK_DIRECTIONS, piece_pinned, pin_direction, moves)
+
+    def _get_bishop_moves(self, square, moves):
+        piece_pinned, pin_direction = self._get_pin(square)
+        self._get_slider_moves(square, BISHOP_DIRECTIONS, piece_pinned, pin_direction, moves)
+
+    def _get_queen_moves(self, square, moves):
+        self._get_rook_moves(square, moves)
+        self._get_bishop_moves(square, moves)
+
+    def _get_knight_moves(self, square, moves):
+        piece_pinned, _ = self._get_pin(square)
+        if piece_pinned:
+            return
+
+        enemy_color = BLACK if self.white_to_move else WHITE
+        squares = self.squares
+        for m in KNIGHT_OFFSETS:
+            end_piece = squares[square + m]
+            if end_piece & enemy_color or (end_piece == EMPTY and not self.captures_only):
+                moves.append(pack_move(squares, square, square + m))
+
+    def _get_king_moves(self, square, moves):
+        # see GameState._get_king_moves
+        enemy_color = BLACK if self.white_to_move else WHITE
+        squares = self.squares
+        targets = []
+        for m in KING_OFFSETS:
+            end_piece = squares[square + m]
+            if end_piece & enemy_color or (end_piece == EMPTY and not self.captures_only):
+                targets.append(square + m)
+        if len(targets) >= self.ATTACK_SET_TARGETS:
+            attacked = self._get_enemy_attacks(square)
+            for end in targets:
+                if end not in attacked:
+                    moves.append(pack_move(squares, square, end))
+            return
+        king = squares[square]
+        squares[square] = EMPTY
+        safe = [end for end in targets if not self._is_under_attack(*SQUARE_TO_RC[end])]
+        squares[square] = king
+        for end in safe:
+            moves.append(pack_move(squares, square, end))
+
+    def _get_enemy_attacks(self, king):
+        # see GameState._get_enemy_attacks, the squares are mailbox indexes
+        squares = self.squares
+        if self.white_to_move:
+            enemy_color = 'b'
+            pawn_direction = 10
+        else:
+            enemy_color = 'w'
+            pawn_direction = -10
+        king_piece = squares[king]
+        squares[king] = EMPTY
+        attacked = set()
+        for start in self.piece_locations[enemy_color]:
+            kind = squares[start] & 7
+            if kind == PAWN:
+                attacked.add(start + pawn_direction - 1)
+                attacked.add(start + pawn_direction + 1)
+            elif kind == KNIGHT:
+                attacked.update(start + m for m in KNIGHT_OFFSETS)
+            elif kind == KING:
+                attacked.update(start + m for m in KING_OFFSETS)
+            else:
+                for d in SLIDER_DIRECTIONS[kind]:
+                    end = start + d
+                    while squares[end] != OFFBOARD:
+                        attacked.add(end)
+                        if squares[end] != EMPTY:
+                            break
+                        end += d
+        squares[king] = king_piece
+        return attacked
+
+    def _get_castle_moves(self, square, moves):
+        r, c = SQUARE_TO_RC[square]
+        if self._is_under_attack(r, c):
+            return
+
+        squares = self.squares
+        if (self.white_to_move and self.current_castling_rights.wks) or (
+                not self.white_to_move and self.current_castling_rights.bks):
+            if squares[square + 1] == EMPTY and squares[square + 2] == EMPTY:
+                if not self._is_under_attack(r, c + 1) and not self._is_under_attack(r, c + 2):
+                    moves.append(pack_move(squares, square, square + 2) | CASTLE_MOVE)
+        if (self.white_to_move and self.current_castling_rights.wqs) or (
+                not self.white_to_move and self.current_castling_rights.bqs):
+            if squares[square - 1] == EMPTY and squares[square - 2] == EMPTY and squares[square - 3] == EMPTY:
+                if not self._is_under_attack(r, c - 1) and not self._is_under_attack(r, c - 2):
+                    moves.append(pack_move(squares, square, square - 2) | CASTLE_MOVE)
+
+
+# the backends GameState(backend=...) builds, bitboard.py adds 'bitboard' to it.
+# It builds on MailboxGameState so it is imported last, whichever of the two
+# modules is imported first the dict has the three backends once both are loaded
+BACKENDS = {'array': GameState, 'mailbox': MailboxGameState}
+
+import bitboard  # noqa: E402
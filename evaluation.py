@@ -0,0 +1,149 @@
+# -----------------------------------------------------------------------------
+# (C) 2023 Higor Grigorio (higorgrigorio@gmail.com)  (MIT License)
+# -----------------------------------------------------------------------------
+import numpy as np
+
+# material value of each piece type and a square score table per piece, added
+# together they give the score of a piece on a square (see get_score)
+KNIGHT_SCORE = np.array([
+    [1, 1, 1, 1, 1, 1, 1, 1],
+    [2, 2, 2, 2, 2, 2, 2, 1],
+    [1, 2, 3, 3, 3, 3, 2, 1],
+    [1, 2, 3, 4, 4, 3, 2, 1],
+    [1, 2, 3, 4, 4, 3, 2, 1],
+    [1, 2, 3, 3, 3, 3, 2, 1],
+    [1, 2, 2, 2, 2, 2, 2, 1],
+    [1, 1, 1, 1, 1, 1, 1, 1]
+])
+
+BISHOP_SCORE = np.array([
+    [4, 3, 2, 1, 1, 2, 3, 4],
+    [3, 4, 3, 2, 2, 3, 4, 3],
+    [2, 3, 4, 3, 3, 4, 3, 2],
+    [1, 2, 3, 4, 4, 3, 2, 1],
+    [1, 2, 3, 4, 4, 3, 2, 1],
+    [2, 3, 4, 3, 3, 4, 3, 2],
+    [3, 4, 3, 2, 2, 3, 4, 3],
+    [4, 3, 2, 1, 1, 2, 3, 4]
+])
+
+ROOK_SCORE = np.array([
+    [4, 3, 4, 4, 4, 4, 3, 4],
+    [4, 4, 4, 4, 4, 4, 4, 4],
+    [1, 1, 2, 3, 3, 2, 1, 1],
+    [1, 2, 3, 4, 4, 3, 2, 1],
+    [1, 2, 3, 4, 4, 3, 2, 1],
+    [1, 1, 2, 3, 3, 2, 1, 1],
+    [4, 4, 4, 4, 4, 4, 4, 4],
+    [4, 3, 4, 4, 4, 4, 3, 4]
+])
+
+QUEEN_SCORE = np.array([
+    [4, 3, 2, 1, 1, 2, 3, 4],
+    [3, 4, 3, 2, 2, 3, 4, 3],
+    [2, 3, 4, 3, 3, 4, 3, 2],
+    [1, 2, 3, 4, 4, 3, 2, 1],
+    [1, 2, 3, 4, 4, 3, 2, 1],
+    [2, 3, 4, 3, 3, 4, 3, 2],
+    [3, 4, 3, 2, 2, 3, 4, 3],
+    [4, 3, 2, 1, 1, 2, 3, 4]
+])
+
+KING_SCORE = np.array([
+    [4, 3, 2, 1, 1, 2, 3, 4],
+    [3, 4, 3, 2, 2, 3, 4, 3],
+    [2, 3, 4, 3, 3, 4, 3, 2],
+    [1, 2, 3, 4, 4, 3, 2, 1],
+    [1, 2, 3, 4, 4, 3, 2, 1],
+    [2, 3, 4, 3, 3, 4, 3, 2],
+    [3, 4, 3, 2, 2, 3, 4, 3],
+    [4, 3, 2, 1, 1, 2, 3, 4]
+])
+
+WHITE_PAWN_SCORE = np.array([
+    [8, 8, 8, 8, 8, 8, 8, 8],
+    [8, 8, 8, 8, 8, 8, 8, 8],
+    [5, 6, 6, 7, 7, 6, 6, 5],
+    [2, 3, 3, 5, 5, 3, 3, 2],
+    [1, 2, 3, 4, 4, 3, 2, 1],
+    [1, 1, 2, 3, 3, 2, 1, 1],
+    [.5, .5, 1, 2, 2, 1, .5, .5],
+    [0, 0, 0, 0, 0, 0, 0, 0]
+])
+
+BLACK_PAWN_SCORE = np.array([
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [.5, .5, 1, 2, 2, 1, .5, .5],
+    [1, 1, 2, 3, 3, 2, 1, 1],
+    [1, 2, 3, 4, 4, 3, 2, 1],
+    [2, 3, 3, 5, 5, 3, 3, 2],
+    [5, 6, 6, 7, 7, 6, 6, 5],
+    [8, 8, 8, 8, 8, 8, 8, 8],
+    [8, 8, 8, 8, 8, 8, 8, 8]
+])
+
+PIECE_SCORE = {
+    'bN': KNIGHT_SCORE,
+    'wN': KNIGHT_SCORE,
+    'wB': BISHOP_SCORE,
+    'bB': BISHOP_SCORE,
+    'wR': ROOK_SCORE,
+    'bR': ROOK_SCORE,
+    'wQ': QUEEN_SCORE,
+    'bQ': QUEEN_SCORE,
+    'wK': KING_SCORE,
+    'bK': KING_SCORE,
+    'wp': WHITE_PAWN_SCORE,
+    'bp': BLACK_PAWN_SCORE
+}
+
+
+MATERIAL = {
+    "p": 1,  # pawn
+    "N": 3,  # knight
+    "B": 3,  # bishop
+    "R": 5,  # rook
+    "Q": 10,  # queen
+    "K": 0  # king
+}
+
+
+def get_score(square, x, y):
+    if square == '--':
+        return 0
+
+    color = square[0]
+    piece = square[1]
+
+    if color == 'w':
+        return MATERIAL[piece] + PIECE_SCORE[square][x, y]
+    else:
+        return -MATERIAL[piece] - PIECE_SCORE[square][x, y]
+
+
+# get_score of every piece on every square, indexed by r * 8 + c, so a board can be
+# scored (or a move can change the score) with plain list lookups
+SQUARE_SCORE = {piece: [float(get_score(piece, r, c)) for r in range(8) for c in range(8)]
+                for piece in PIECE_SCORE}
+
+
+# the square score tables stacked along a first axis, STACKED_SCORE[i] holds the
+# get_score of STACKED_PIECES[i] on every square (0 is the empty square), so a
+# stack of boards given as indices into it is scored with one gather
+STACKED_PIECES = ('--',) + tuple(PIECE_SCORE)
+PIECE_INDEX = {piece: i for i, piece in enumerate(STACKED_PIECES)}
+STACKED_SCORE = np.array([np.reshape(SQUARE_SCORE.get(piece, [0.0] * 64), (8, 8)) for piece in STACKED_PIECES])
+_ROWS, _COLS = np.indices((8, 8))
+
+
+def board_to_codes(board):
+    # the board (array or mailbox, any board indexed as board[row][col] with piece
+    # strings) as an (8, 8) array of indices into STACKED_SCORE
+    return np.array([[PIECE_INDEX[piece] for piece in row] for row in board], dtype=np.int8)
+
+
+def evaluate_batch(boards):
+    # scores an (N, 8, 8) stack of board_to_codes boards in one pass, the same values
+    # the scalar evaluation gives for each board (every score is a multiple of 0.5,
+    # so the sums are exact in any order)
+    return STACKED_SCORE[np.asarray(boards), _ROWS, _COLS].sum(axis=(1, 2))
@@ -1,13 +1,14 @@
 # -----------------------------------------------------------------------------
 # (C) 2023 Higor Grigorio (higorgrigorio@gmail.com)  (MIT License)
 # -----------------------------------------------------------------------------
-
-from multiprocessing import Process, Queue
+import atexit
+from multiprocessing import Pipe, Process
 
 import pygame as pg
 
 import ai
 import engine
+import worker
 
 HEIGHT = 512
 WIDTH = 512
@@ -15,6 +16,9 @@ DIMENSION = 8
 SQ_SIZE = HEIGHT // DIMENSION
 SQ_PROMOTION_SIZE = 86
 MAX_FPS = 15
+# in single player mode the engine keeps thinking on the user's time, on the
+# reply it expects, so its answer is ready when the user plays it
+PONDER = True
 IMAGES = {}
 COLORS = {
     'dark': pg.Color(118, 150, 86),
@@ -42,7 +46,9 @@ def main():
     screen.fill(COLORS['light'])
     gs = engine.GameState()
     valid_moves = gs.get_valid_moves()
+    moves_by_id = {move.move_id: move for move in valid_moves}  # finds the user's move in O(1)
     move_made = False  # flag variable for when a move is made
+    draw_reason = None  # 'threefold repetition' or 'fifty-move rule' once the game is drawn by one of them
     load_images()
     running = True
     sq_selected = ()  # no square is selected, keep track of the last click of the user (tuple: (row, col))
@@ -53,8 +59,13 @@ def main():
     multi_player = False  # if True, the user plays against another user; if False, the user plays against the computer
     ai_thinking = False
     ai_move = None
-    process = None
-    return_queue = None
+    # the engine runs in one process for the whole game, it is sent every move made
+    # on the board and answers 'go' with its move (see worker.py)
+    connection, worker_connection = Pipe()
+    process = Process(target=worker.run, args=(worker_connection,))
+    process.start()
+    atexit.register(stop_worker, connection, process)
+    search_id = 0  # id of the search the answer is waited for
     while running:
         human_turn = (gs.white_to_move and single_player) or (multi_player and gs.white_to_move)
 
@@ -94,34 +105,43 @@ def main():
 
                         print(move.get_chess_notation())
 
-                        for i in range(len(valid_moves)):
-                            if move == valid_moves[i]:
-                                gs.make_move(valid_moves[i])
-                                move_made = True
-                                animate = True
-                                sq_selected = ()
-                                player_clicks = []
+                        if move.move_id in moves_by_id:
+                            gs.make_move(moves_by_id[move.move_id])
+                            connection.send(('move', move.move_id))
+                            move_made = True
+                            animate = True
+                            sq_selected = ()
+                            player_clicks = []
 
                         if not move_made:
                             player_clicks = [sq_selected]
 
             if event.type == pg.KEYDOWN:
                 if event.key == pg.K_z:
+                    if ai_thinking:  # the answer of the running search is not wanted anymore
+                        connection.send(('stop',))
+                        ai_thinking = False
+
                     gs.undo_move()
+                    connection.send(('undo',))
 
                     if not multi_player and single_player:
                         gs.undo_move()
+                        connection.send(('undo',))
 
                     move_made = True
                     animate = False
                     game_over = False
-                    if ai_thinking:
-                        process.terminate()
-                        ai_thinking = False
 
                 if event.key == pg.K_r:
+                    if ai_thinking:
+                        connection.send(('stop',))
+                        ai_thinking = False
+                    connection.send(('reset',))
                     gs = engine.GameState()
                     valid_moves = gs.get_valid_moves()
+                    moves_by_id = {move.move_id: move for move in valid_moves}
+                    draw_reason = None
                     sq_selected = ()
                     player_clicks = []
                     move_made = False
@@ -131,23 +151,34 @@ def main():
         if not game_over and not human_turn:
             if not ai_thinking:
                 ai_thinking = True
-                return_queue = Queue()
-                process = Process(target=ai.smart_move, args=(gs, valid_moves, return_queue))
-                process.start()
-
-            if not process.is_alive():
-                ai_move = return_queue.get()
+                search_id += 1
+                connection.send(('go', search_id))
+
+            while connection.poll():
+                answer = connection.recv()
+                if answer[0] != 'best_move':  # the end of a ponder, nothing to do
+                    continue
+                _, answer_id, move_id, ai_depth, line = answer
+                if answer_id != search_id:  # a search that was stopped, its move is stale
+                    continue
+                print(f'depth {ai_depth}:', ' '.join(engine.Move.from_packed(packed).get_chess_notation()
+                                                     for packed in line))
                 ai_thinking = False
-                if ai_move is None:
-                    ai_move = ai._random_move(valid_moves)
+                ai_move = moves_by_id[move_id] if move_id is not None else ai._random_move(valid_moves)
                 gs.make_move(ai_move)
+                connection.send(('move', ai_move.move_id))
+                if PONDER and single_player and not multi_player:
+                    connection.send(('ponder',))
                 move_made = True
                 animate = True
+                break
 
         if move_made:
             if animate:
                 animate_move(gs.move_log[-1], screen, gs.board, clock)
             valid_moves = gs.get_valid_moves()
+            moves_by_id = {move.move_id: move for move in valid_moves}
+            draw_reason = gs.get_draw_reason()
             move_made = False
             animate = False
 
@@ -159,10 +190,25 @@ def main():
         elif gs.stalemate:
             game_over = True
             draw_text(screen, 'Stalemate')
+        elif draw_reason is not None:
+            game_over = True
+            draw_text(screen, f'Draw by {draw_reason}')
 
         clock.tick(MAX_FPS)
         pg.display.flip()
 
+    stop_worker(connection, process)
+
+
+def stop_worker(connection, process):
+    # the worker is not a daemon process, those can't start the processes of the
+    # parallel search (ai.SEARCH_WORKERS), so the program would wait for it on
+    # exit until it is told to quit. Registered with atexit too, for when the
+    # game loop ends in an exception
+    if process.is_alive():
+        connection.send(('quit',))
+        process.join()
+
 
 def draw_text(screen, text):
     font = pg.font.SysFont('Arial', 32, True, False)
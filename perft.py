@@ -0,0 +1,135 @@
+# -----------------------------------------------------------------------------
+# (C) 2023 Higor Grigorio (higorgrigorio@gmail.com)  (MIT License)
+# -----------------------------------------------------------------------------
+import argparse
+import time
+
+import engine
+
+# perft positions and their known leaf counts for depth 1, 2, 3..., the start
+# position, the standard test positions 2 to 6 and smaller ones that each stress
+# one rule (castling, en passant, promotion, pins, double check)
+POSITIONS = {
+    'start': ('rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+              [20, 400, 8902, 197281, 4865609]),
+    'kiwipete': ('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+                 [48, 2039, 97862, 4085603]),
+    'position3': ('8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+                  [14, 191, 2812, 43238, 674624]),
+    'position4': ('r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+                  [6, 264, 9467, 422333]),
+    'position5': ('rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+                  [44, 1486, 62379, 2103487]),
+    'position6': ('r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+                  [46, 2079, 89890, 3894594]),
+    'castling': ('r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1',
+                 [26, 568, 13744, 314346]),
+    'castle_through_check': ('r3k2r/8/8/8/8/8/6b1/R3K2R w KQkq - 0 1',
+                             [24, 697, 16544, 489635]),
+    'en_passant_exposes_king': ('8/8/8/8/k2Pp2Q/8/8/3K4 b - d3 0 1',
+                                [6, 136, 863, 20471]),
+    'en_passant_pin': ('3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1',
+                       [18, 92, 1670, 10138]),
+    'promotion': ('n1n5/PPPk4/8/8/8/8/4Kppp/5N1N b - - 0 1',
+                  [24, 496, 9483, 182838]),
+    'pins': ('4k3/8/8/8/1b5q/8/3PN3/4K3 w - - 0 1',
+             [3, 94, 775, 24833]),
+    'double_check': ('4r2k/8/8/8/8/3n4/8/4K3 w - - 0 1',
+                     [3, 72, 222, 4966]),
+}
+
+# the positions are parsed from their FEN once, the later loads decode the
+# binary encoding instead (see GameState.to_bytes)
+_encoded = {}
+
+
+def load_position(name, backend='bitboard'):
+    gs = engine.BACKENDS[backend]()
+    if name in _encoded:
+        gs.load_bytes(_encoded[name])
+    else:
+        gs.load_fen(POSITIONS[name][0])
+        _encoded[name] = gs.to_bytes()
+    return gs
+
+
+def perft(gs, depth):
+    # number of leaf nodes of the legal move tree, the last ply is only counted
+    if depth == 0:
+        return 1
+    moves = gs.get_valid_moves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.make_move(move)
+        nodes += perft(gs, depth - 1)
+        gs.undo_move()
+    return nodes
+
+
+def _move_notation(move):
+    return move.get_chess_notation() + (move.pawn_promotion_piece or '').lower()
+
+
+def divide(gs, depth):
+    # perft split by the first move, to find the move a generator gets wrong
+    result = {}
+    for move in gs.get_valid_moves():
+        gs.make_move(move)
+        result[_move_notation(move)] = perft(gs, depth - 1)
+        gs.undo_move()
+    return result
+
+
+def run_suite(backend, max_nodes):
+    # checks every position to the deepest known depth under max_nodes leaves
+    failures = 0
+    for name, (fen, counts) in POSITIONS.items():
+        for depth, expected in enumerate(counts, 1):
+            if expected > max_nodes:
+                break
+            gs = load_position(name, backend)
+            start = time.perf_counter()
+            nodes = perft(gs, depth)
+            elapsed = time.perf_counter() - start
+            status = 'ok' if nodes == expected else f'FAIL (expected {expected})'
+            failures += nodes != expected
+            print(f'{name:<24}{depth:>3}{nodes:>10}{elapsed:>9.2f}s{nodes / elapsed:>10.0f} nps  {status}')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Perft move generation counts and speed.')
+    parser.add_argument('--backend', choices=engine.BACKENDS, default='bitboard')
+    parser.add_argument('--position', choices=POSITIONS, help='one of the known positions')
+    parser.add_argument('--fen', help='any position, instead of --position')
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--divide', action='store_true', help='count the nodes under each first move')
+    parser.add_argument('--max-nodes', type=int, default=100000,
+                        help='without a position, check the whole suite up to this many leaves per run')
+    args = parser.parse_args()
+
+    if args.position is None and args.fen is None:
+        raise SystemExit(1 if run_suite(args.backend, args.max_nodes) else 0)
+
+    fen = args.fen if args.fen is not None else POSITIONS[args.position][0]
+    gs = engine.BACKENDS[args.backend]()
+    gs.load_fen(fen)
+    start = time.perf_counter()
+    if args.divide:
+        result = divide(gs, args.depth)
+        for notation, nodes in sorted(result.items()):
+            print(f'{notation}: {nodes}')
+        nodes = sum(result.values())
+    else:
+        nodes = perft(gs, args.depth)
+    elapsed = time.perf_counter() - start
+    print(f'nodes {nodes}  time {elapsed:.2f}s  nps {nodes / elapsed:.0f}')
+    if args.position is not None and args.depth <= len(POSITIONS[args.position][1]):
+        expected = POSITIONS[args.position][1][args.depth - 1]
+        print('ok' if nodes == expected else f'FAIL (expected {expected})')
+
+
+if __name__ == '__main__':
+    main()
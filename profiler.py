@@ -0,0 +1,174 @@
+# -----------------------------------------------------------------------------
+# (C) 2023 Higor Grigorio (higorgrigorio@gmail.com)  (MIT License)
+# -----------------------------------------------------------------------------
+import argparse
+import cProfile
+import os
+import platform
+import pstats
+import queue
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+import ai
+import benchmark
+import engine
+import perft
+
+# Profiles the engine without the GUI: searches (ai.smart_move on the benchmark
+# positions) or perft (on the perft positions), under cProfile or a sampling
+# profiler. cProfile writes a pstats file, the sampler a collapsed stack file
+# (one 'frame;frame;frame count' line per stack, the input of flamegraph.pl and
+# speedscope), and both print the functions with the most self time.
+#
+# Two runs profile the same work: the searches go to a fixed depth or node
+# count from a cleared table, in one process, without the opening book (its
+# moves are picked at random) or the tablebases (what is on disk differs from
+# one machine to the next) and with the random module seeded. The nodes of
+# every position are printed, equal counts before and after a change mean the
+# profiles compare the same tree.
+SEED = 0
+SAMPLE_INTERVAL = 0.001  # seconds between two samples
+DEFAULT_DEPTHS = {'search': 4, 'perft': 3}
+
+
+def run_search(names, backend, depth, max_nodes=None):
+    ai.USE_TABLEBASES = False
+    total_nodes = 0
+    for name in names:
+        gs = benchmark.load_position(name, backend)
+        ai.transposition_table.clear()
+        return_queue = queue.Queue()
+        ai.smart_move(gs, gs.get_valid_moves(), return_queue, time_limit=float('inf'), max_nodes=max_nodes,
+                      max_depth=depth, workers=1)
+        move, depth_reached, _ = return_queue.get()
+        print(f'{name:<24}{move.get_chess_notation():<8}{depth_reached:>6}{ai.nodes:>10}')
+        total_nodes += ai.nodes
+    return total_nodes
+
+
+def run_perft(names, backend, depth, max_nodes=None):
+    total_nodes = 0
+    for name in names:
+        nodes = perft.perft(perft.load_position(name, backend), depth)
+        print(f'{name:<24}{depth:>6}{nodes:>10}')
+        total_nodes += nodes
+    return total_nodes
+
+
+WORKLOADS = {
+    'search': (run_search, benchmark.POSITIONS),
+    'perft': (run_perft, perft.POSITIONS),
+}
+
+
+class Sampler:
+    # Samples the stack of the thread that enabled it (enable and disable work
+    # like cProfile.Profile) from a background thread every interval seconds,
+    # counting how often each stack was seen. The thread switch interval is
+    # lowered to the sample interval while it runs, otherwise the sampling
+    # thread would only get the GIL every 5 ms.
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+        self._switch_interval = None
+
+    def _frame_name(self, code):
+        return f'{os.path.splitext(os.path.basename(code.co_filename))[0]}:{code.co_name}'
+
+    def _run(self, thread_id):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            names = []
+            while frame is not None:
+                names.append(self._frame_name(frame.f_code))
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(names))] += 1
+
+    def enable(self):
+        self._switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(self.interval)
+        self._thread = threading.Thread(target=self._run, args=(threading.get_ident(),), daemon=True)
+        self._thread.start()
+
+    def disable(self):
+        self._stop.set()
+        self._thread.join()
+        sys.setswitchinterval(self._switch_interval)
+
+    def write_collapsed(self, path):
+        with open(path, 'w') as collapsed:
+            for stack, count in sorted(self.stacks.items()):
+                collapsed.write(f'{stack} {count}\n')
+
+    def print_top(self, top):
+        # self: the samples the function was running in, total: the samples it was on the stack in
+        total = sum(self.stacks.values())
+        self_counts = Counter()
+        total_counts = Counter()
+        for stack, count in self.stacks.items():
+            names = stack.split(';')
+            self_counts[names[-1]] += count
+            for name in set(names):
+                total_counts[name] += count
+        print(f'{total} samples')
+        print(f'{"self":>8}{"self %":>8}{"total %":>9}  function')
+        for name, count in self_counts.most_common(top):
+            print(f'{count:>8}{100 * count / total:>8.1f}{100 * total_counts[name] / total:>9.1f}  {name}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Profile searches or perft without the GUI.')
+    parser.add_argument('workload', choices=WORKLOADS)
+    parser.add_argument('--positions', nargs='+', metavar='NAME',
+                        help='positions of the workload to run, all of them by default')
+    parser.add_argument('--backend', choices=engine.BACKENDS, default='bitboard')
+    parser.add_argument('--depth', type=int, help='search depth (default 4) or perft depth (default 3)')
+    parser.add_argument('--max-nodes', type=int, help='stop every search after this many nodes')
+    parser.add_argument('--sample', action='store_true',
+                        help='sample the stack instead of running cProfile, writes collapsed stacks')
+    parser.add_argument('--interval', type=float, default=SAMPLE_INTERVAL, help='seconds between samples')
+    parser.add_argument('--top', type=int, default=25, help='functions to print')
+    parser.add_argument('-o', '--output', help='output file (default profile-<workload>.pstats or .collapsed)')
+    args = parser.parse_args()
+
+    run, positions = WORKLOADS[args.workload]
+    names = args.positions or list(positions)
+    for name in names:
+        if name not in positions:
+            parser.error(f'unknown {args.workload} position {name}, choose from {", ".join(positions)}')
+    depth = args.depth or DEFAULT_DEPTHS[args.workload]
+    output = args.output or f'profile-{args.workload}.{"collapsed" if args.sample else "pstats"}'
+
+    random.seed(SEED)
+    ai.USE_OPENING_BOOK = False
+    print(f'{args.workload} depth {depth} backend {args.backend}, python {platform.python_version()}')
+
+    profiler = Sampler(args.interval) if args.sample else cProfile.Profile()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        nodes = run(names, args.backend, depth, args.max_nodes)
+    finally:
+        profiler.disable()
+    elapsed = time.perf_counter() - start
+    print(f'nodes {nodes}  time {elapsed:.2f}s (profiled)')
+
+    if args.sample:
+        profiler.write_collapsed(output)
+        profiler.print_top(args.top)
+    else:
+        stats = pstats.Stats(profiler)
+        stats.dump_stats(output)
+        stats.strip_dirs().sort_stats('tottime').print_stats(args.top)
+    print(f'written to {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# -----------------------------------------------------------------------------
+# (C) 2023 Higor Grigorio (higorgrigorio@gmail.com)  (MIT License)
+# -----------------------------------------------------------------------------
+import json
+import time
+
+# the phases the search time is split into, the rest of the time is the search itself
+PHASES = ('move_generation', 'make_undo', 'evaluation')
+
+
+class SearchStats:
+    # Counters of one search, filled by ai.find_best_move when it is given one.
+    # The search only touches them through the ai.running_stats global, which is
+    # None when no stats are collected, so a search without them pays a test of
+    # that global at its cutoffs and leaves and nothing else.
+    #
+    # The phase timings come from wrappers (see timed) swapped in for the
+    # functions of each phase while the search runs. A phase called from inside
+    # another one (the legality test of the move generation makes and undoes the
+    # move) is taken out of the outer phase, so each time is the phase's own.
+
+    def __init__(self):
+        self.nodes = 0
+        self.leaf_nodes = 0  # nodes at the search horizon, before quiescence
+        self.quiescence_nodes = 0
+        self.beta_cutoffs = 0  # cutoffs of the move loop
+        self.first_move_cutoffs = 0  # of those, the ones by the first move searched
+        self.table_cutoffs = 0
+        self.null_move_cutoffs = 0
+        self.lmr_researches = 0
+        self.pvs_researches = 0
+        self.aspiration_researches = 0
+        self.depth = 0
+        self.seconds = 0.0
+        self.iterations = []  # (depth, nodes, seconds, score) of every finished iteration
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self.calls = dict.fromkeys(PHASES, 0)
+        self.table = {}  # the transposition table stats of the search
+        self._inner_times = []  # time spent in the phases called by each running phase
+
+    def timed(self, phase, function):
+        # function wrapped to add its calls and own time to phase
+        inner_times = self._inner_times
+
+        def wrapper(*args, **kwargs):
+            inner_times.append(0.0)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self.times[phase] += elapsed - inner_times.pop()
+                self.calls[phase] += 1
+                if inner_times:
+                    inner_times[-1] += elapsed
+
+        return wrapper
+
+    def iteration(self, depth, nodes, seconds, score):
+        self.iterations.append((depth, nodes, seconds, score))
+
+    def branching_factor(self):
+        # effective branching factor: the nodes of the last iteration over the
+        # nodes of the one before (the nodes of an iteration, not the running total)
+        if len(self.iterations) < 2:
+            return None
+        before = self.iterations[-2][1] - (self.iterations[-3][1] if len(self.iterations) > 2 else 0)
+        last = self.iterations[-1][1] - self.iterations[-2][1]
+        return last / before if before else None
+
+    def as_dict(self):
+        phase_time = sum(self.times.values())
+        return {'depth': self.depth,
+                'nodes': self.nodes,
+                'leaf_nodes': self.leaf_nodes,
+                'quiescence_nodes': self.quiescence_nodes,
+                'seconds': self.seconds,
+                'nps': self.nodes / self.seconds if self.seconds else 0.0,
+                'beta_cutoffs': self.beta_cutoffs,
+                'first_move_cutoff_rate': self.first_move_cutoffs / self.beta_cutoffs if self.beta_cutoffs else 0.0,
+                'table_cutoffs': self.table_cutoffs,
+                'null_move_cutoffs': self.null_move_cutoffs,
+                'lmr_researches': self.lmr_researches,
+                'pvs_researches': self.pvs_researches,
+                'aspiration_researches': self.aspiration_researches,
+                'evaluations': self.calls['evaluation'],
+                'branching_factor': self.branching_factor(),
+                'times': dict(self.times, search=max(0.0, self.seconds - phase_time)),
+                'calls': dict(self.calls),
+                'iterations': [{'depth': depth, 'nodes': nodes, 'seconds': seconds, 'score': score}
+                               for depth, nodes, seconds, score in self.iterations],
+                'table': self.table}
+
+    def to_json(self, **fields):
+        # one JSON line, the stats after the given fields (position name, version...).
+        # Mate scores are written as the strings 'inf' and '-inf', JSON has no infinity
+        record = dict(fields, **self.as_dict())
+        for iteration in record['iterations']:
+            if abs(iteration['score']) == float('inf'):
+                iteration['score'] = str(iteration['score'])
+        return json.dumps(record)
+
+    def write(self, path, **fields):
+        # appends the stats to a JSON lines file
+        with open(path, 'a') as log:
+            log.write(self.to_json(**fields) + '\n')
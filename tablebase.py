@@ -0,0 +1,426 @@
+# -----------------------------------------------------------------------------
+# (C) 2023 Higor Grigorio (higorgrigorio@gmail.com)  (MIT License)
+# -----------------------------------------------------------------------------
+import argparse
+import functools
+import itertools
+import os
+import time
+from array import array
+
+import numpy as np
+
+import engine
+
+# Endgame tablebases: the exact result of every position of a small material
+# configuration, generated by retrograde analysis and kept on disk as one int8
+# per position. A table is named by its material, the white pieces and then the
+# black ones (KQK, KRK, KPK, KQKR...), the other colouring of the same material
+# is probed through the table with the board mirrored.
+#
+# The board can also be turned: without pawns the 8 rotations and reflections of
+# a position have the same value, with pawns the file mirror. Only the copy with
+# the smallest index is generated and looked up, the other entries stay 0, so
+# a table is generated 8 (2 with pawns) times faster, at the same size on disk.
+# A 3 piece table takes seconds, KQKR about 10 minutes and 500 MB (its longest
+# mate, 69 plies, is the known one).
+#
+# The value of a position is from the side to move: MATE - plies when it mates
+# in that many plies, -(MATE - plies) when it gets mated in that many plies (so
+# -MATE when it is checkmated) and 0 for draws (and illegal positions). En
+# passant and castling are left out, positions where they are possible aren't probed.
+TABLEBASE_DIR = 'tablebases'
+MATE = 127
+
+PIECE_ORDER = 'KQRBNP'
+WHITE, BLACK = 0, 1
+
+# the tables in TABLEBASE_DIR by name, memory mapped on the first probe
+tables = None
+
+
+# -----------------------------------------------------------------------------
+# attack tables of the squares, square = row * 8 + col with row 0 the 8th rank
+# -----------------------------------------------------------------------------
+def _targets(offsets):
+    result = []
+    for r in range(8):
+        for c in range(8):
+            result.append([(r + dr) * 8 + c + dc for dr, dc in offsets if 0 <= r + dr < 8 and 0 <= c + dc < 8])
+    return result
+
+
+KING_TARGETS = _targets([(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)])
+KNIGHT_TARGETS = _targets([(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)])
+PAWN_ATTACKS = (_targets([(-1, -1), (-1, 1)]), _targets([(1, -1), (1, 1)]))
+ROOK_STEPS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+BISHOP_STEPS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+SLIDER_STEPS = {'R': ROOK_STEPS, 'B': BISHOP_STEPS, 'Q': ROOK_STEPS + BISHOP_STEPS}
+
+# the squares each symmetry of the board takes every square to, the first two
+# (the identity and the file mirror) are the ones that keep pawns moving the same way
+SYMMETRIES = []
+for _flip_rows, _flip_cols, _transpose in ((0, 0, 0), (0, 1, 0), (1, 0, 0), (1, 1, 0),
+                                           (0, 0, 1), (0, 1, 1), (1, 0, 1), (1, 1, 1)):
+    _symmetry = []
+    for _square in range(64):
+        _r, _c = divmod(_square, 8)
+        _r, _c = (7 - _r if _flip_rows else _r), (7 - _c if _flip_cols else _c)
+        _symmetry.append(_c * 8 + _r if _transpose else _r * 8 + _c)
+    SYMMETRIES.append(_symmetry)
+PAWN_SYMMETRIES = SYMMETRIES[:2]
+
+# RAYS[square][step] is the squares from square in that direction, LINE[a][b] the
+# slider kind ('R' or 'B') that moves from a to b on an empty board and
+# BETWEEN[a][b] the mask of the squares in between
+RAYS = [{} for _ in range(64)]
+LINE = [[None] * 64 for _ in range(64)]
+BETWEEN = [[0] * 64 for _ in range(64)]
+for _square in range(64):
+    for _kind, _steps in (('R', ROOK_STEPS), ('B', BISHOP_STEPS)):
+        for _dr, _dc in _steps:
+            _r, _c = divmod(_square, 8)
+            _ray = []
+            _mask = 0
+            while 0 <= _r + _dr < 8 and 0 <= _c + _dc < 8:
+                _r, _c = _r + _dr, _c + _dc
+                _ray.append(_r * 8 + _c)
+                LINE[_square][_r * 8 + _c] = _kind
+                BETWEEN[_square][_r * 8 + _c] = _mask
+                _mask |= 1 << (_r * 8 + _c)
+            RAYS[_square][_dr, _dc] = _ray
+
+
+def _attacks(kind, color, square, target, occupied):
+    if kind == 'K':
+        return target in KING_TARGETS[square]
+    if kind == 'N':
+        return target in KNIGHT_TARGETS[square]
+    if kind == 'P':
+        return target in PAWN_ATTACKS[color][square]
+    line = LINE[square][target]
+    return line is not None and (kind == 'Q' or kind == line) and not BETWEEN[square][target] & occupied
+
+
+def _in_check(pieces, color):
+    # if the king of color is attacked, pieces is a list of (color, kind, square)
+    occupied = 0
+    for _, _, square in pieces:
+        occupied |= 1 << square
+    king = next(square for piece_color, kind, square in pieces if piece_color == color and kind == 'K')
+    return any(piece_color != color and _attacks(kind, piece_color, square, king, occupied)
+               for piece_color, kind, square in pieces)
+
+
+def _moves(pieces, color):
+    # the positions (pieces lists) after each legal move of color
+    occupant = {square: i for i, (_, _, square) in enumerate(pieces)}
+    for i, (piece_color, kind, square) in enumerate(pieces):
+        if piece_color != color:
+            continue
+        if kind == 'P':
+            forward = -8 if color == WHITE else 8
+            targets = []
+            if square + forward not in occupant:
+                targets.append(square + forward)
+                start_row = 6 if color == WHITE else 1
+                if square // 8 == start_row and square + 2 * forward not in occupant:
+                    targets.append(square + 2 * forward)
+            targets += [target for target in PAWN_ATTACKS[color][square]
+                        if target in occupant and pieces[occupant[target]][0] != color]
+        elif kind in SLIDER_STEPS:
+            targets = []
+            for step in SLIDER_STEPS[kind]:
+                for target in RAYS[square][step]:
+                    if target in occupant:
+                        if pieces[occupant[target]][0] != color:
+                            targets.append(target)
+                        break
+                    targets.append(target)
+        else:
+            targets = [target for target in (KING_TARGETS if kind == 'K' else KNIGHT_TARGETS)[square]
+                       if target not in occupant or pieces[occupant[target]][0] != color]
+
+        for target in targets:
+            captured = occupant.get(target)
+            promotions = 'QRBN' if kind == 'P' and target // 8 in (0, 7) else kind
+            for new_kind in promotions:
+                after = [(piece_color, new_kind, target) if j == i else piece
+                         for j, piece in enumerate(pieces) if j != captured]
+                if not _in_check(after, color):
+                    yield after
+
+
+# -----------------------------------------------------------------------------
+# material names and indexing
+# -----------------------------------------------------------------------------
+def _side_name(kinds):
+    return ''.join(sorted(kinds, key=PIECE_ORDER.index))
+
+
+def _split(name):
+    # 'KQKR' -> ('KQ', 'KR')
+    black = name.index('K', 1)
+    return name[:black], name[black:]
+
+
+def _strength(side):
+    return len(side), [-PIECE_ORDER.index(kind) for kind in side]
+
+
+def _is_drawn(white, black):
+    # material that can't mate in any position: KK, KBK and KNK. KNKN and KBKN
+    # have mates when the losing side helps, they are generated like the others
+    return min(len(white), len(black)) == 1 and max(len(white), len(black)) <= 2 and \
+        not set(white + black) & set('QRP')
+
+
+def _has_en_passant(white, black):
+    # pawns on both sides, a double push can be taken en passant
+    return 'P' in white and 'P' in black
+
+
+def _normalize(pieces, white_to_move):
+    # (table name, pieces, white_to_move) with the stronger side as white, the
+    # board is mirrored when the colours are swapped
+    white = _side_name(kind for color, kind, _ in pieces if color == WHITE)
+    black = _side_name(kind for color, kind, _ in pieces if color == BLACK)
+    if _strength(black) > _strength(white):
+        pieces = [(1 - color, kind, square ^ 56) for color, kind, square in pieces]
+        white, black, white_to_move = black, white, not white_to_move
+    return white + black, pieces, white_to_move
+
+
+def _symmetries(name):
+    return PAWN_SYMMETRIES if 'P' in name else SYMMETRIES
+
+
+def _squares_index(symmetries, squares, white_to_move):
+    # the squares of the pieces in the order of the name. The index is the
+    # smallest of the ones of the symmetric copies of the position
+    best = None
+    for symmetry in symmetries:
+        index = 0 if white_to_move else 1
+        for square in squares:
+            index = index * 64 + symmetry[square]
+        if best is None or index < best:
+            best = index
+    return best
+
+
+def _index(name, pieces, white_to_move):
+    # the pieces go in the order of the name, white and then black
+    white, black = _split(name)
+    remaining = list(pieces)
+    squares = []
+    for color, side in ((WHITE, white), (BLACK, black)):
+        for kind in side:
+            piece = next(piece for piece in remaining if piece[0] == color and piece[1] == kind)
+            remaining.remove(piece)
+            squares.append(piece[2])
+    return _squares_index(_symmetries(name), squares, white_to_move)
+
+
+def _lookup(table_values, pieces, white_to_move):
+    name, pieces, white_to_move = _normalize(pieces, white_to_move)
+    if _is_drawn(*_split(name)):
+        return 0
+    return int(table_values[name][_index(name, pieces, white_to_move)])
+
+
+# -----------------------------------------------------------------------------
+# generation
+# -----------------------------------------------------------------------------
+def _subtables(name):
+    # the materials a capture or a promotion leads to from name
+    white, black = _split(name)
+    result = set()
+    for side, other, is_white in ((white, black, True), (black, white, False)):
+        for i, kind in enumerate(side):
+            if kind == 'K':
+                continue
+            changes = [''] + (list('QRBN') if kind == 'P' else [])
+            for new_kind in changes:
+                new_side = _side_name(side[:i] + new_kind + side[i + 1:])
+                pieces = [(WHITE if is_white else BLACK, k, 0) for k in new_side] + \
+                         [(BLACK if is_white else WHITE, k, 0) for k in other]
+                sub_name = _normalize(pieces, True)[0]
+                if not _is_drawn(*_split(sub_name)):
+                    result.add(sub_name)
+    return result
+
+
+def generate(name, table_values):
+    # the values of every position of name, the tables it converts into have to
+    # be in table_values already. Builds the moves of every legal position once
+    # and then finds the results ply by ply from the checkmates on
+    white, black = _split(name)
+    kinds = [(WHITE, kind) for kind in white] + [(BLACK, kind) for kind in black]
+    count = 64 ** len(kinds)
+    # the white king goes first in the index, the smallest copy has it on one of these squares
+    symmetries = _symmetries(name)
+    king_squares = sorted({min(symmetry[square] for symmetry in symmetries) for square in range(64)})
+
+    values = np.zeros(2 * count, dtype=np.int16)
+    movers = array('i')  # positions with legal moves
+    starts = array('i')  # where the successors of each mover start
+    successors = array('i')  # position indices, count * 2 and up for the constants
+    constants = array('h')  # values of positions in other tables
+
+    for white_to_move in (True, False):
+        color = WHITE if white_to_move else BLACK
+        offset = 0 if white_to_move else count
+        for squares in itertools.product(king_squares, *[range(64)] * (len(kinds) - 1)):
+            if len(set(squares)) < len(squares):
+                continue
+            pieces = [(piece_color, kind, square) for (piece_color, kind), square in zip(kinds, squares)]
+            if any(kind == 'P' and square // 8 in (0, 7) for _, kind, square in pieces):
+                continue
+            index = functools.reduce(lambda index, square: index * 64 + square, squares, 0)
+            if _squares_index(symmetries, squares, white_to_move) != offset + index:
+                continue  # a symmetric copy of the position has the smaller index
+            if _in_check(pieces, 1 - color):  # the side that just moved can't be in check
+                continue
+            start = len(successors)
+            for after in _moves(pieces, color):
+                if len(after) == len(pieces) and all(kind == after_kind
+                                                     for (_, kind, _), (_, after_kind, _) in zip(pieces, after)):
+                    # _moves keeps the order of the pieces, the one of the name
+                    successors.append(_squares_index(symmetries, [square for _, _, square in after],
+                                                     not white_to_move))
+                else:
+                    successors.append(2 * count + len(constants))
+                    constants.append(_lookup(table_values, after, not white_to_move))
+            if len(successors) > start:
+                movers.append(offset + index)
+                starts.append(start)
+            elif _in_check(pieces, color):
+                values[offset + index] = -MATE  # checkmate, stalemates stay 0
+
+    movers = np.frombuffer(movers, dtype=np.int32)
+    starts = np.frombuffer(starts, dtype=np.int32)
+    successors = np.frombuffer(successors, dtype=np.int32)
+    extended = np.concatenate([values, np.frombuffer(constants, dtype=np.int16)])
+    while True:
+        extended[:2 * count] = values
+        scores = -extended[successors]
+        scores -= np.sign(scores)  # one ply further from the mate
+        best = np.maximum.reduceat(scores, starts)
+        if np.array_equal(values[movers], best):
+            break
+        values[movers] = best
+    return values.astype(np.int8)
+
+
+def generate_all(names, directory=TABLEBASE_DIR):
+    # generates the tables of names and the ones they convert into, the tables
+    # already in directory are read instead of generated again
+    os.makedirs(directory, exist_ok=True)
+    table_values = {}
+
+    def ensure(name):
+        if name in table_values:
+            return
+        for sub_name in sorted(_subtables(name)):
+            ensure(sub_name)
+        path = os.path.join(directory, name + '.bin')
+        if os.path.exists(path):
+            table_values[name] = np.fromfile(path, dtype=np.int8)
+            return
+        start = time.perf_counter()
+        table_values[name] = generate(name, table_values)
+        table_values[name].tofile(path)
+        wins = int((table_values[name] > 0).sum())
+        longest = MATE - int(table_values[name][table_values[name] > 0].min()) if wins else 0
+        print(f'{name}: {wins} wins up to symmetry, longest mate {longest} plies, {time.perf_counter() - start:.1f}s')
+
+    for name in names:
+        white, black = _split(name)
+        if _has_en_passant(white, black):
+            raise ValueError(f'{name}: no tables with pawns on both sides, en passant is left out')
+        ensure(_normalize([(WHITE, kind, 0) for kind in white] + [(BLACK, kind, 0) for kind in black], True)[0])
+    return table_values
+
+
+# -----------------------------------------------------------------------------
+# probing
+# -----------------------------------------------------------------------------
+def load(directory=TABLEBASE_DIR):
+    global tables
+    tables = {}
+    if os.path.isdir(directory):
+        for file_name in os.listdir(directory):
+            if file_name.endswith('.bin'):
+                tables[file_name[:-4]] = np.memmap(os.path.join(directory, file_name), dtype=np.int8, mode='r')
+    return tables
+
+
+def max_pieces():
+    # the most pieces (kings included) of the tables on disk, 0 without tables
+    if tables is None:
+        load()
+    return max((len(name) for name in tables), default=0)
+
+
+def _pieces(gs):
+    pieces = []
+    for color, locations in (('w', gs.piece_locations['w']), ('b', gs.piece_locations['b'])):
+        for location in locations:
+            r, c = location if isinstance(location, tuple) else engine.SQUARE_TO_RC[location]
+            pieces.append((WHITE if color == 'w' else BLACK, gs.board[r][c][1].upper(), r * 8 + c))
+    return pieces
+
+
+def _can_capture_en_passant(gs):
+    if not gs.en_passant_possible:
+        return False
+    r, c = gs.en_passant_possible
+    row, pawn = (r + 1, 'wp') if gs.white_to_move else (r - 1, 'bp')
+    return any(0 <= col < 8 and gs.board[row][col] == pawn for col in (c - 1, c + 1))
+
+
+def probe(gs):
+    # the value of the position for the side to move, None if it isn't in a table
+    if tables is None:
+        load()
+    rights = gs.current_castling_rights
+    if rights.wks or rights.wqs or rights.bks or rights.bqs or _can_capture_en_passant(gs):
+        return None
+    name, pieces, white_to_move = _normalize(_pieces(gs), gs.white_to_move)
+    if _is_drawn(*_split(name)):
+        return 0
+    if name not in tables or _has_en_passant(*_split(name)):
+        return None
+    return int(tables[name][_index(name, pieces, white_to_move)])
+
+
+def best_move(gs, moves):
+    # the move of the tables for the position: the fastest mate when winning, the
+    # slowest when losing, or None if the position isn't in a table
+    if not moves or probe(gs) is None:
+        return None
+    best, best_value = None, None
+    for move in moves:
+        gs.make_move(move)
+        value = probe(gs)
+        gs.undo_move()
+        if value is None:
+            return None
+        value = -value
+        value -= (value > 0) - (value < 0)
+        if best_value is None or value > best_value:
+            best, best_value = move, value
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate endgame tablebases.')
+    parser.add_argument('names', nargs='*', default=['KQK', 'KRK', 'KPK'],
+                        help='materials to generate, white pieces and then black ones (KQK, KRK, KPK...)')
+    parser.add_argument('--directory', default=TABLEBASE_DIR)
+    args = parser.parse_args()
+    generate_all(args.names, args.directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# -----------------------------------------------------------------------------
+# (C) 2023 Higor Grigorio (higorgrigorio@gmail.com)  (MIT License)
+# -----------------------------------------------------------------------------
+import pytest
+
+import book
+import engine
+
+PGN = '''[Event "one"]
+[Result "1-0"]
+
+1. e4 e5 2. Nf3 Nc6 {the main line} 3. Bc4 (3. Bb5 a6) Bc5 4. O-O Nf6 5. d3 O-O 1-0
+
+[Event "two"]
+[Result "0-1"]
+
+1. e4 c5 2. Nf3 d6 0-1
+'''
+
+START_KEY = 0x463b96181691fc9c  # Polyglot keys of the start position and of 1. e4
+E4_KEY = 0x823c9b50fd114196
+
+# Polyglot moves: to file | to row << 3 | from file << 6 | from row << 9, castling as the king taking its rook
+E2E4 = 4 | 3 << 3 | 4 << 6 | 1 << 9
+E7E5 = 4 | 4 << 3 | 4 << 6 | 6 << 9
+C7C5 = 2 | 4 << 3 | 2 << 6 | 6 << 9
+E1H1 = 7 | 0 << 3 | 4 << 6 | 0 << 9
+E8H8 = 7 | 7 << 3 | 4 << 6 | 7 << 9
+
+
+def play(gs, sans):
+    for san in sans:
+        gs.make_move(book.parse_san(gs, san, gs.get_valid_moves()))
+
+
+@pytest.fixture
+def opening_book(tmp_path):
+    pgn_path = tmp_path / 'games.pgn'
+    pgn_path.write_text(PGN)
+    book_path = tmp_path / 'book.bin'
+    book.write_book(book_path, book.build_book([pgn_path]))
+    opening_book = book.OpeningBook(book_path)
+    yield opening_book
+    opening_book.close()
+
+
+def test_round_trip(opening_book):
+    # a win scores 2 for the side that played the move, a loss 0
+    assert opening_book.probe(START_KEY) == [(E2E4, 2)]
+    assert opening_book.probe(E4_KEY) == [(C7C5, 2), (E7E5, 0)]
+    assert opening_book.probe(0) == []
+
+    gs = engine.GameState()
+    assert gs.zobrist_key == START_KEY
+    play(gs, ['e4'])
+    assert gs.zobrist_key == E4_KEY
+    assert opening_book.choose_move(gs, gs.get_valid_moves()).get_chess_notation() == 'c7c5'
+
+
+def test_castling_is_written_as_the_king_taking_its_rook(opening_book):
+    gs = engine.GameState()
+    play(gs, ['e4', 'e5', 'Nf3', 'Nc6', 'Bc4', 'Bc5'])
+    castle = book.parse_san(gs, 'O-O', gs.get_valid_moves())
+    assert castle.get_chess_notation() == 'e1g1'
+    assert book.polyglot_move(castle) == E1H1
+    assert opening_book.probe(gs.zobrist_key) == [(E1H1, 2)]
+    assert opening_book.choose_move(gs, gs.get_valid_moves()) == castle
+
+    play(gs, ['O-O', 'Nf6', 'd3'])
+    assert book.polyglot_move(book.parse_san(gs, 'O-O', gs.get_valid_moves())) == E8H8
+    assert opening_book.probe(gs.zobrist_key) == [(E8H8, 0)]
+
+
+def test_min_games(tmp_path):
+    pgn_path = tmp_path / 'games.pgn'
+    pgn_path.write_text(PGN)
+    assert book.build_book([pgn_path], min_games=2) == [(START_KEY, E2E4, 2)]
+    assert len(book.build_book([pgn_path], max_ply=1)) == 1
+
+
+def test_empty_book(tmp_path):
+    book.write_book(tmp_path / 'book.bin', [])
+    opening_book = book.OpeningBook(tmp_path / 'book.bin')
+    assert opening_book.probe(START_KEY) == []
+    assert opening_book.choose_move(engine.GameState(), engine.GameState().get_valid_moves()) is None
+    opening_book.close()
@@ -0,0 +1,41 @@
+# -----------------------------------------------------------------------------
+# (C) 2023 Higor Grigorio (higorgrigorio@gmail.com)  (MIT License)
+# -----------------------------------------------------------------------------
+import random
+
+import numpy as np
+import pytest
+
+import ai
+import engine
+import evaluation
+import perft
+
+
+def positions(backend, count=200):
+    # the perft positions and the ones of a few random games from the start
+    states = [perft.load_position(name, backend) for name in perft.POSITIONS]
+    rng = random.Random(0)
+    gs = engine.GameState(backend=backend)
+    while len(states) < count:
+        moves = gs.get_valid_moves()
+        if not moves or len(gs.move_log) > 80:
+            gs = engine.GameState(backend=backend)
+            continue
+        gs.make_move(rng.choice(moves))
+        states.append(gs.from_bytes(gs.to_bytes()))
+    return states
+
+
+@pytest.mark.parametrize('backend', engine.BACKENDS)
+def test_batch_matches_scalar_evaluation(backend):
+    states = positions(backend)
+    boards = np.stack([evaluation.board_to_codes(gs.board) for gs in states])
+    assert boards.shape == (len(states), 8, 8)
+    scores = evaluation.evaluate_batch(boards)
+    assert scores.tolist() == [float(ai._eval_material(gs.board)) for gs in states]
+    assert scores.tolist() == [gs.score for gs in states]
+
+
+def test_empty_batch():
+    assert evaluation.evaluate_batch(np.zeros((0, 8, 8), dtype=np.int8)).shape == (0,)
@@ -0,0 +1,143 @@
+# -----------------------------------------------------------------------------
+# (C) 2023 Higor Grigorio (higorgrigorio@gmail.com)  (MIT License)
+# -----------------------------------------------------------------------------
+import pytest
+
+import engine
+import perft
+
+# leaves per perft run checked by the correctness tests, the array backend is
+# much slower so it only goes through the shallow depths
+MAX_NODES = {'array': 3000, 'mailbox': 50000, 'bitboard': 50000}
+
+CASES = [(backend, name, depth, expected)
+         for backend in engine.BACKENDS
+         for name, (fen, counts) in perft.POSITIONS.items()
+         for depth, expected in enumerate(counts, 1)
+         if expected <= MAX_NODES[backend]]
+
+
+@pytest.mark.parametrize('backend, name, depth, expected', CASES)
+def test_perft(backend, name, depth, expected):
+    assert perft.perft(perft.load_position(name, backend), depth) == expected
+
+
+@pytest.mark.parametrize('backend', engine.BACKENDS)
+def test_divide_adds_up_to_perft(backend):
+    result = perft.divide(perft.load_position('kiwipete', backend), 2)
+    assert len(result) == 48
+    assert sum(result.values()) == 2039
+
+
+@pytest.mark.parametrize('backend', engine.BACKENDS)
+def test_make_undo_restores_position(backend):
+    gs = perft.load_position('kiwipete', backend)
+    board = [list(row) for row in gs.board]
+    key, score = gs.zobrist_key, gs.score
+    perft.perft(gs, 2)
+    assert [list(row) for row in gs.board] == board
+    assert (gs.zobrist_key, gs.score) == (key, score)
+
+
+@pytest.mark.parametrize('backend', engine.BACKENDS)
+@pytest.mark.parametrize('name', perft.POSITIONS)
+def test_fen_and_bytes_round_trip(backend, name):
+    fen = perft.POSITIONS[name][0]
+    gs = engine.BACKENDS[backend]()
+    gs.load_fen(fen)
+    assert gs.to_fen() == fen
+    data = gs.to_bytes()
+    assert len(data) == engine.POSITION_BYTES
+    decoded = engine.BACKENDS[backend]()
+    decoded.load_bytes(data)
+    assert decoded.to_fen() == fen
+    assert (decoded.zobrist_key, decoded.score) == (gs.zobrist_key, gs.score)
+
+
+@pytest.mark.parametrize('backend', ['mailbox', 'bitboard'])
+@pytest.mark.parametrize('name', perft.POSITIONS)
+@pytest.mark.parametrize('captures_only', [False, True])
+def test_packed_moves_match_array_moves(backend, name, captures_only):
+    # the packed moves are generated without Move objects, the array backend
+    # still builds them, so its moves packed are the reference
+    reference = perft.load_position(name, 'array').get_valid_moves(captures_only=captures_only)
+    gs = perft.load_position(name, backend)
+    packed = gs.get_valid_moves(captures_only=captures_only, packed=True)
+    assert sorted(packed) == sorted(move.packed for move in reference)
+    assert [engine.Move.from_packed(move).packed for move in packed] == packed
+
+
+def packed_perft(gs, depth):
+    # perft on packed moves, the position after every move checked against a full recompute
+    if depth == 0:
+        return 1
+    nodes = 0
+    for move in gs.get_valid_moves(packed=True):
+        gs.make_move(move)
+        assert gs.zobrist_key == gs.compute_zobrist_key()
+        assert gs.score == gs.compute_score()
+        assert gs.piece_locations == gs.compute_piece_locations()
+        if hasattr(gs, 'pieces'):
+            pieces, occupancy = gs.pieces, gs.occupancy
+            gs.compute_bitboards()
+            assert (gs.pieces, gs.occupancy) == (pieces, occupancy)
+        nodes += packed_perft(gs, depth - 1)
+        gs.undo_move()
+    return nodes
+
+
+@pytest.mark.parametrize('backend', engine.BACKENDS)
+@pytest.mark.parametrize('name', perft.POSITIONS)
+def test_packed_make_undo(backend, name):
+    # the search makes and undoes the packed ints, the game Move objects, both the same way
+    gs = perft.load_position(name, backend)
+    fen = gs.to_fen()
+    assert packed_perft(gs, 2) == perft.POSITIONS[name][1][1]
+    assert gs.to_fen() == fen and gs.move_log == []
+    for move in gs.get_valid_moves():
+        gs.make_move(move.packed)
+        after_packed = (gs.to_fen(), gs.zobrist_key, gs.score)
+        gs.undo_move()
+        gs.make_move(move)
+        assert (gs.to_fen(), gs.zobrist_key, gs.score) == after_packed
+        assert gs.move_log[-1] is move
+        gs.undo_move()
+    assert gs.to_fen() == fen
+
+
+def test_fen_move_counters():
+    gs = engine.GameState()
+    for notation in ('e2e4', 'c7c5', 'g1f3'):
+        gs.make_move(next(move for move in gs.get_valid_moves() if move.get_chess_notation() == notation))
+    assert gs.to_fen() == 'rnbqkbnr/pp1ppppp/8/2p5/4P3/5N2/PPPP1PPP/RNBQKB1R b KQkq - 1 2'
+
+
+@pytest.mark.parametrize('backend', engine.BACKENDS)
+def test_game_state_backend(backend):
+    gs = engine.GameState(backend=backend)
+    assert type(gs) is engine.BACKENDS[backend]
+    assert len(gs.get_valid_moves()) == 20
+
+
+# speed, run with pytest-benchmark: pytest test_perft.py --benchmark-only
+@pytest.mark.parametrize('backend, name, depth', [('array', 'start', 2),
+                                                  ('mailbox', 'start', 3),
+                                                  ('mailbox', 'kiwipete', 2),
+                                                  ('bitboard', 'start', 3),
+                                                  ('bitboard', 'kiwipete', 2)])
+def test_perft_speed(benchmark, backend, name, depth):
+    gs = perft.load_position(name, backend)
+    nodes = benchmark(perft.perft, gs, depth)
+    assert nodes == perft.POSITIONS[name][1][depth - 1]
+
+
+@pytest.mark.parametrize('backend', engine.BACKENDS)
+def test_bytes_round_trip_speed(benchmark, backend):
+    gs = perft.load_position('kiwipete', backend)
+    data = gs.to_bytes()
+
+    def round_trip():
+        gs.load_bytes(data)
+        return gs.to_bytes()
+
+    assert benchmark(round_trip) == data
@@ -0,0 +1,163 @@
+# -----------------------------------------------------------------------------
+# (C) 2023 Higor Grigorio (higorgrigorio@gmail.com)  (MIT License)
+# -----------------------------------------------------------------------------
+import time
+
+import pytest
+
+import ai
+import engine
+import perft
+import stats
+
+
+@pytest.fixture(autouse=True)
+def search_settings(monkeypatch):
+    # searches from a cleared table, without the book and the tablebases
+    monkeypatch.setattr(ai, 'USE_OPENING_BOOK', False)
+    monkeypatch.setattr(ai, 'USE_TABLEBASES', False)
+    ai.transposition_table.clear()
+
+
+def search(gs, depth, max_nodes=None):
+    return ai.find_best_move(gs, gs.get_valid_moves(), float('inf'), max_nodes, depth, workers=1)
+
+
+@pytest.mark.parametrize('backend', engine.BACKENDS)
+@pytest.mark.parametrize('name', ['castling', 'promotion', 'position4'])
+def test_incremental_score_during_search(monkeypatch, backend, name):
+    # every evaluated position is scored again from scratch and compared
+    monkeypatch.setattr(ai, 'DEBUG_INCREMENTAL_EVAL', True)
+    move, depth, _ = search(perft.load_position(name, backend), 3, max_nodes=1500)
+    assert move is not None and depth >= 1
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_principal_variation_is_returned(workers):
+    # a line of legal moves from the root, starting with the best move
+    gs = perft.load_position('position4')
+    try:
+        move, depth, line = ai.find_best_move(gs, gs.get_valid_moves(), float('inf'), None, 3, workers=workers)
+    finally:
+        ai.close_pool()
+    assert depth == 3 and line[0] == move and len(line) <= depth
+    for line_move in line:
+        assert line_move in gs.get_valid_moves()
+        gs.make_move(line_move)
+
+
+def test_incremental_score_drift_is_caught(monkeypatch):
+    monkeypatch.setattr(ai, 'DEBUG_INCREMENTAL_EVAL', True)
+    gs = perft.load_position('kiwipete')
+    gs.score += 1
+    with pytest.raises(AssertionError):
+        search(gs, 1)
+
+
+def play(gs, notations):
+    for notation in notations:
+        gs.make_move(next(move for move in gs.get_valid_moves() if move.get_chess_notation() == notation))
+
+
+def search_score(gs, depth):
+    search_stats = stats.SearchStats()
+    ai.find_best_move(gs, gs.get_valid_moves(), float('inf'), None, depth, workers=1, search_stats=search_stats)
+    return search_stats.iterations[-1][3]
+
+
+# the white king can only go from h1 to g1 and back, black is a rook up
+SHUFFLE = 'k4r2/8/8/8/8/7p/7P/7K w - - 0 1'
+SHUFFLE_MOVES = ['h1g1', 'a8b8', 'g1h1', 'b8a8']
+
+
+@pytest.mark.parametrize('backend', engine.BACKENDS)
+def test_threefold_repetition(backend):
+    gs = engine.GameState(backend=backend)
+    gs.load_fen(SHUFFLE)
+    assert search_score(gs, 2) < -1
+    play(gs, SHUFFLE_MOVES)
+    assert gs.get_draw_reason() is None
+    # the only move repeats a position, the search scores it a draw
+    assert search_score(gs, 2) == 0
+    play(gs, SHUFFLE_MOVES)
+    assert gs.get_draw_reason() == 'threefold repetition'
+    gs.undo_move()
+    assert gs.get_draw_reason() is None
+
+
+@pytest.mark.parametrize('backend', engine.BACKENDS)
+def test_fifty_move_rule(backend):
+    # a queen up, but any move without a capture or a pawn move ends the game in a draw
+    gs = engine.GameState(backend=backend)
+    gs.load_fen('k7/8/8/8/8/8/8/KQ6 w - - 99 80')
+    assert gs.get_draw_reason() is None
+    assert search_score(gs, 3) == 0
+    play(gs, ['b1b2'])
+    assert gs.get_draw_reason() == 'fifty-move rule'
+    gs.undo_move()
+    gs.load_fen('k7/8/8/8/8/8/8/KQ6 w - - 90 80')
+    assert search_score(gs, 3) > 5
+
+
+def test_ply_counts_the_null_move(monkeypatch):
+    # the zobrist log has an entry for every move and pass since the root, the
+    # move log misses the passes of null move pruning
+    gs = engine.GameState()
+    root_keys = len(gs.zobrist_log)
+    negamax = ai._ab_negamax
+    null_moves = []
+
+    def checked(gs, valid_moves, depth, ply, *args, **kwargs):
+        assert ply == len(gs.zobrist_log) - root_keys
+        if kwargs.get('allow_null') is False:
+            null_moves.append(ply)
+        return negamax(gs, valid_moves, depth, ply, *args, **kwargs)
+
+    monkeypatch.setattr(ai, '_ab_negamax', checked)
+    search(gs, 5, max_nodes=5000)
+    assert null_moves
+
+
+def test_parallel_search_keeps_its_pool():
+    try:
+        gs = engine.GameState()
+        move, depth, _ = ai.find_best_move(gs, gs.get_valid_moves(), float('inf'), None, 2, workers=2)
+        pool = ai._pool
+        assert move in gs.get_valid_moves() and depth == 2
+        gs.make_move(move)
+        move, depth, _ = ai.find_best_move(gs, gs.get_valid_moves(), float('inf'), None, 2, workers=2)
+        assert move in gs.get_valid_moves() and depth == 2
+        assert ai._pool is pool
+    finally:
+        ai.close_pool()
+    assert ai._pool is None
+
+
+def test_parallel_search_without_moves():
+    gs = engine.GameState()
+    play(gs, ['f2f3', 'e7e5', 'g2g4', 'd8h4'])
+    assert gs.get_valid_moves() == [] and gs.checkmate
+    assert ai.find_best_move(gs, [], 1.0, workers=2) == (None, 0, [])
+
+
+def test_parallel_search_stops_its_pool(monkeypatch):
+    # the stop comes while the pool processes search (node_limit is only set while
+    # this process searches a root move of its own), they have to drop their
+    # iteration instead of finishing it
+    stopped = []
+
+    def stop_requested():
+        if ai.node_limit is None and time.perf_counter() > start + 2:
+            stopped.append(time.perf_counter())
+        return bool(stopped)
+
+    monkeypatch.setattr(ai, 'stop_requested', stop_requested)
+    gs = perft.load_position('kiwipete')
+    start = time.perf_counter()
+    try:
+        move, depth, _ = ai.find_best_move(gs, gs.get_valid_moves(), float('inf'), 10 ** 9, None, workers=2)
+        assert ai._pool_stop.is_set()
+    finally:
+        ai.close_pool()
+    assert time.perf_counter() - stopped[0] < 5
+    assert depth == 0 or move in gs.get_valid_moves()
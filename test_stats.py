@@ -0,0 +1,60 @@
+# -----------------------------------------------------------------------------
+# (C) 2023 Higor Grigorio (higorgrigorio@gmail.com)  (MIT License)
+# -----------------------------------------------------------------------------
+import json
+
+import pytest
+
+import ai
+import engine
+import stats
+
+
+@pytest.fixture(autouse=True)
+def search_settings(monkeypatch):
+    monkeypatch.setattr(ai, 'USE_OPENING_BOOK', False)
+    monkeypatch.setattr(ai, 'USE_TABLEBASES', False)
+    ai.transposition_table.clear()
+
+
+def search(fen, depth):
+    gs = engine.GameState()
+    gs.load_fen(fen)
+    search_stats = stats.SearchStats()
+    ai.find_best_move(gs, gs.get_valid_moves(), float('inf'), None, depth, workers=1, search_stats=search_stats)
+    return search_stats
+
+
+START = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+MATE_IN_ONE = '7k/8/6K1/8/8/8/8/R7 w - - 0 1'
+
+
+def test_json_lines(tmp_path):
+    path = tmp_path / 'stats.jsonl'
+    search(START, 3).write(path, position='start')
+    search(MATE_IN_ONE, 3).write(path, position='mate')
+    start, mate = [json.loads(line) for line in path.read_text().splitlines()]
+
+    assert start['position'] == 'start'
+    assert start['depth'] == 3
+    assert [iteration['depth'] for iteration in start['iterations']] == [1, 2, 3]
+    iteration_nodes = [iteration['nodes'] for iteration in start['iterations']]
+    assert iteration_nodes == sorted(iteration_nodes) and iteration_nodes[-1] == start['nodes']
+    assert 0 < start['leaf_nodes'] and 0 < start['quiescence_nodes'] <= start['nodes']
+    assert start['beta_cutoffs'] > 0 and 0 < start['first_move_cutoff_rate'] <= 1
+    assert start['evaluations'] == start['calls']['evaluation'] > 0
+    assert set(start['times']) == set(stats.PHASES) | {'search'}
+    assert start['table']['stores'] > 0
+
+    # the mate ends the search at its first iteration, JSON has no infinity
+    assert mate['position'] == 'mate'
+    assert mate['depth'] == 1
+    assert mate['iterations'][-1]['score'] == 'inf'
+
+
+def test_branching_factor():
+    search_stats = stats.SearchStats()
+    assert search_stats.branching_factor() is None
+    for depth, nodes in enumerate([10, 40, 160], 1):
+        search_stats.iteration(depth, nodes, 0.0, 0.0)
+    assert search_stats.branching_factor() == 120 / 30
@@ -0,0 +1,107 @@
+# -----------------------------------------------------------------------------
+# (C) 2023 Higor Grigorio (higorgrigorio@gmail.com)  (MIT License)
+# -----------------------------------------------------------------------------
+import pytest
+
+import ai
+import engine
+import tablebase
+
+
+@pytest.fixture(scope='module')
+def table_values(tmp_path_factory):
+    # generated once for the module, a few seconds per table
+    directory = tmp_path_factory.mktemp('tablebases')
+    table_values = tablebase.generate_all(['KQK', 'KRK'], directory)
+    tablebase.load(directory)
+    yield table_values
+    tablebase.tables = None
+
+
+def position(fen):
+    gs = engine.GameState()
+    gs.load_fen(fen)
+    return gs
+
+
+@pytest.mark.parametrize('name, longest', [('KQK', 19), ('KRK', 31)])
+def test_longest_mates(table_values, name, longest):
+    values = table_values[name]
+    assert tablebase.MATE - values[values > 0].min() == longest
+    assert -tablebase.MATE in values
+    assert 0 in values
+
+
+@pytest.mark.parametrize('fen, value', [
+    ('7k/8/6K1/8/8/8/8/R7 w - - 0 1', tablebase.MATE - 1),  # Ra8#
+    ('R6k/8/6K1/8/8/8/8/8 b - - 0 1', -tablebase.MATE),  # checkmated
+    ('7k/5Q2/6K1/8/8/8/8/8 b - - 0 1', 0),  # stalemate
+    ('k7/8/1K6/8/8/8/7Q/8 w - - 0 1', tablebase.MATE - 1),  # Qh8#
+    ('r6K/8/6k1/8/8/8/8/8 w - - 0 1', -tablebase.MATE),  # black has the rook
+])
+def test_known_values(table_values, fen, value):
+    assert tablebase.probe(position(fen)) == value
+
+
+def test_symmetric_positions_have_the_same_value(table_values):
+    # the first position mirrored left to right, top to bottom and turned
+    fens = ['8/8/8/8/4k3/8/2K5/6R1 w - - 0 1', '8/8/8/8/3k4/8/5K2/1R6 w - - 0 1',
+            '6R1/2K5/8/4k3/8/8/8/8 w - - 0 1', '8/8/6K1/8/4k3/8/7R/8 w - - 0 1']
+    gs = position(fens[0])
+    value = tablebase.probe(gs)
+    assert value > 0
+    assert [tablebase.probe(position(fen)) for fen in fens[1:]] == [value] * 3
+
+
+def test_probe_sign(table_values):
+    # positive for the side that mates, negative for the one that gets mated
+    assert tablebase.probe(position('8/8/8/8/4k3/8/2K5/6R1 w - - 0 1')) > 0
+    assert tablebase.probe(position('8/8/8/8/4k3/8/2K5/6R1 b - - 0 1')) < 0
+    assert tablebase.probe(position('8/8/8/8/4K3/8/2k5/6r1 w - - 0 1')) < 0
+    assert tablebase.probe(position('8/8/8/8/4K3/8/2k5/6r1 b - - 0 1')) > 0
+
+
+def test_best_move_mates(table_values):
+    gs = position('7k/8/6K1/8/8/8/8/R7 w - - 0 1')
+    assert tablebase.best_move(gs, gs.get_valid_moves()).get_chess_notation() == 'a1a8'
+
+
+def test_tablebase_score():
+    # a mate in fewer plies from the root scores higher, a loss is its negation
+    assert ai._tablebase_score(tablebase.MATE - 1, 0) == ai.TABLEBASE_WIN - 1
+    assert ai._tablebase_score(tablebase.MATE - 1, 2) == ai.TABLEBASE_WIN - 3
+    assert ai._tablebase_score(tablebase.MATE - 3, 2) < ai._tablebase_score(tablebase.MATE - 1, 2)
+    assert ai._tablebase_score(-(tablebase.MATE - 1), 2) == -(ai.TABLEBASE_WIN - 3)
+    assert ai._tablebase_score(0, 5) == ai.STALEMATE
+    # every tablebase score is past TABLEBASE_BOUND, the evaluation never gets there
+    assert ai._tablebase_score(1, ai.MAX_DEPTH) > ai.TABLEBASE_BOUND
+
+
+@pytest.mark.parametrize('value', [tablebase.MATE - 7, -(tablebase.MATE - 7)])
+def test_table_scores_are_counted_from_the_position(value):
+    # the same position reached 3 or 5 plies from the root is stored the same,
+    # and read back as the score of the ply it is probed at
+    stored = ai._score_to_table(ai._tablebase_score(value, 3), 3)
+    assert ai._score_to_table(ai._tablebase_score(value, 5), 5) == stored
+    assert ai._score_from_table(stored, 5) == ai._tablebase_score(value, 5)
+    for score in (0.5, -3.25, ai.CHECKMATE, -ai.CHECKMATE):
+        assert ai._score_from_table(ai._score_to_table(score, 4), 4) == score
+        assert ai._score_to_table(score, 4) == score
+
+
+@pytest.mark.parametrize('white, black, drawn', [
+    ('K', 'K', True), ('KB', 'K', True), ('KN', 'K', True), ('K', 'KN', True),
+    ('KN', 'KN', False), ('KB', 'KN', False), ('KB', 'KB', False), ('KNN', 'K', False), ('KP', 'K', False),
+])
+def test_dead_material(white, black, drawn):
+    assert tablebase._is_drawn(white, black) == drawn
+
+
+def test_pawns_on_both_sides_have_no_tables(table_values):
+    # en passant is left out of the generation, so these materials aren't generated or probed
+    with pytest.raises(ValueError):
+        tablebase.generate_all(['KPKP'])
+    gs = position('8/8/4k3/4p3/8/4K3/4P3/8 w - - 0 1')
+    assert tablebase.probe(gs) is None
+    # KNKN has mates, without its table the position isn't called a draw
+    assert tablebase.probe(position('8/8/4k3/4n3/8/4K3/4N3/8 w - - 0 1')) is None
@@ -0,0 +1,169 @@
+# -----------------------------------------------------------------------------
+# (C) 2023 Higor Grigorio (higorgrigorio@gmail.com)  (MIT License)
+# -----------------------------------------------------------------------------
+import threading
+from multiprocessing import Pipe, Process
+
+import pytest
+
+import ai
+import engine
+import worker
+
+# the worker runs in a thread here instead of its own process, it only talks
+# through the Pipe either way. Its searches have no time limit: they end on a
+# 'stop' (or any other command), or on the node budget the ponder tests give them
+SEARCH_NODES = 3000
+
+
+@pytest.fixture
+def searches(monkeypatch):
+    # the find_best_move calls of the worker
+    calls = []
+    find_best_move = ai.find_best_move
+
+    def counted(*args, **kwargs):
+        calls.append(args[2:])
+        return find_best_move(*args, **kwargs)
+
+    monkeypatch.setattr(ai, 'find_best_move', counted)
+    return calls
+
+
+@pytest.fixture
+def connection(request, monkeypatch):
+    monkeypatch.setattr(ai, 'USE_OPENING_BOOK', False)
+    monkeypatch.setattr(ai, 'USE_TABLEBASES', False)
+    ai.transposition_table.clear()
+    max_nodes = getattr(request, 'param', None)
+    connection, worker_connection = Pipe()
+    thread = threading.Thread(target=worker.run, args=(worker_connection, float('inf'), max_nodes), daemon=True)
+    thread.start()
+    yield connection
+    connection.send(('quit',))
+    thread.join(10)
+    ai.stop_requested = None
+    assert not thread.is_alive()
+
+
+def play_id(gs, connection, move_id):
+    # makes the move on gs and sends it to the worker
+    gs.make_move(next(move for move in gs.get_valid_moves() if move.move_id == move_id))
+    connection.send(('move', move_id))
+
+
+def play(gs, connection, notation):
+    move = next(move for move in gs.get_valid_moves() if move.get_chess_notation() == notation)
+    play_id(gs, connection, move.move_id)
+
+
+def best_move(connection, timeout=10):
+    assert connection.poll(timeout)
+    kind, search_id, move_id, depth, line = connection.recv()
+    assert kind == 'best_move'
+    return search_id, move_id, depth, line
+
+
+def test_go_and_stop(connection):
+    # a stopped search still answers its 'go', with a legal move of the position the
+    # worker follows. Without a time limit or a node budget only the stop ends it
+    gs = engine.GameState()
+    play(gs, connection, 'e2e4')
+    connection.send(('go', 1))
+    connection.send(('stop',))
+    search_id, move_id, depth, line = best_move(connection)
+    assert search_id == 1
+    assert move_id in {move.move_id for move in gs.get_valid_moves()}
+    assert depth >= 1
+    assert line[0] & engine.Move.ID_MASK == move_id
+
+
+def test_undo_and_reset_follow_the_game(connection):
+    gs = engine.GameState()
+    play(gs, connection, 'e2e4')
+    play(gs, connection, 'e7e5')
+    gs.undo_move()
+    connection.send(('undo',))
+    connection.send(('go', 1))
+    connection.send(('stop',))
+    assert best_move(connection)[1] in {move.move_id for move in gs.get_valid_moves()}
+
+    connection.send(('reset',))
+    connection.send(('go', 2))
+    connection.send(('stop',))
+    search_id, move_id, _, _ = best_move(connection)
+    assert search_id == 2
+    assert move_id in {move.move_id for move in engine.GameState().get_valid_moves()}
+
+
+def start_pondering(gs, connection):
+    # the engine plays its move, then ponders on the reply its table predicts. The
+    # ponder search runs out of its node budget before the next command is sent
+    connection.send(('go', 1))
+    _, move_id, _, _ = best_move(connection)
+    play_id(gs, connection, move_id)
+    connection.send(('ponder',))
+    assert connection.poll(10)
+    kind, predicted, depth = connection.recv()
+    assert kind == 'pondered'
+    assert predicted in {move.move_id for move in gs.get_valid_moves()}
+    assert depth >= 1
+    return predicted, depth
+
+
+@pytest.mark.parametrize('connection', [SEARCH_NODES], indirect=True)
+def test_ponder_hit_answers_at_once(connection, searches):
+    gs = engine.GameState()
+    play(gs, connection, 'e2e4')
+    predicted, ponder_depth = start_pondering(gs, connection)
+    play_id(gs, connection, predicted)
+    searched = len(searches)
+    connection.send(('go', 2))
+    search_id, move_id, depth, line = best_move(connection)
+    # the ponder result is sent as it is, without another search
+    assert len(searches) == searched
+    assert search_id == 2
+    assert move_id in {move.move_id for move in gs.get_valid_moves()}
+    assert depth == ponder_depth
+    assert line[0] & engine.Move.ID_MASK == move_id
+
+
+@pytest.mark.parametrize('connection', [SEARCH_NODES], indirect=True)
+def test_ponder_miss_searches_the_real_move(connection, searches):
+    gs = engine.GameState()
+    play(gs, connection, 'e2e4')
+    predicted, _ = start_pondering(gs, connection)
+    play_id(gs, connection, next(move.move_id for move in gs.get_valid_moves() if move.move_id != predicted))
+    searched = len(searches)
+    connection.send(('go', 2))
+    search_id, move_id, depth, _ = best_move(connection)
+    # the real position is searched with the whole budget
+    assert searches[searched:] == [(float('inf'), SEARCH_NODES)]
+    assert search_id == 2
+    assert move_id in {move.move_id for move in gs.get_valid_moves()}
+    assert depth >= 1
+
+
+def test_worker_process_searches_in_parallel(monkeypatch):
+    # like main.py: the worker is a process of its own, not a daemon, so it can
+    # start the pool of the parallel search
+    monkeypatch.setattr(ai, 'USE_OPENING_BOOK', False)
+    monkeypatch.setattr(ai, 'USE_TABLEBASES', False)
+    monkeypatch.setattr(ai, 'SEARCH_WORKERS', 2)
+    connection, worker_connection = Pipe()
+    process = Process(target=worker.run, args=(worker_connection, float('inf'), SEARCH_NODES))
+    process.start()
+    try:
+        gs = engine.GameState()
+        play(gs, connection, 'e2e4')
+        for search_id in (1, 2):
+            connection.send(('go', search_id))
+            _, move_id, depth, _ = best_move(connection)
+            assert move_id in {move.move_id for move in gs.get_valid_moves()}
+            assert depth >= 1
+            play_id(gs, connection, move_id)
+            play(gs, connection, 'g1f3' if search_id == 1 else 'b1c3')
+    finally:
+        connection.send(('quit',))
+        process.join(10)
+    assert process.exitcode == 0
@@ -0,0 +1,55 @@
+# -----------------------------------------------------------------------------
+# (C) 2023 Higor Grigorio (higorgrigorio@gmail.com)  (MIT License)
+# -----------------------------------------------------------------------------
+import pytest
+
+import engine
+import perft
+
+# keys from the Polyglot book format specification, for the start position and
+# the positions after each line of moves
+POLYGLOT_KEYS = [
+    ('', 0x463b96181691fc9c),
+    ('e2e4', 0x823c9b50fd114196),
+    ('e2e4 d7d5', 0x0756b94461c50fb0),
+    ('e2e4 d7d5 e4e5', 0x662fafb965db29d4),
+    ('e2e4 d7d5 e4e5 f7f5', 0x22a48b5a8e47ff78),
+    ('e2e4 d7d5 e4e5 f7f5 e1e2', 0x652a607ca3f242c1),
+    ('e2e4 d7d5 e4e5 f7f5 e1e2 e8f7', 0x00fdd303c946bdd9),
+    ('a2a4 b7b5 h2h4 b5b4 c2c4', 0x3c8123ea7b067637),
+    ('a2a4 b7b5 h2h4 b5b4 c2c4 b4c3 a1a3', 0x5c3f9b829b279560),
+]
+
+# positions where the moves castle, capture en passant and promote
+POSITIONS = ['kiwipete', 'castling', 'en_passant_exposes_king', 'en_passant_pin', 'promotion', 'position4']
+
+
+def play(gs, moves):
+    for notation in moves.split():
+        gs.make_move(next(move for move in gs.get_valid_moves() if move.get_chess_notation() == notation))
+    return gs
+
+
+@pytest.mark.parametrize('backend', engine.BACKENDS)
+@pytest.mark.parametrize('moves, key', POLYGLOT_KEYS)
+def test_polyglot_keys(backend, moves, key):
+    assert play(engine.BACKENDS[backend](), moves).zobrist_key == key
+
+
+def _check_keys(gs, depth):
+    # the incremental key against a full recompute after every make and undo
+    assert gs.zobrist_key == gs.compute_zobrist_key()
+    if depth == 0:
+        return
+    for move in gs.get_valid_moves():
+        key = gs.zobrist_key
+        gs.make_move(move)
+        _check_keys(gs, depth - 1)
+        gs.undo_move()
+        assert gs.zobrist_key == key == gs.compute_zobrist_key()
+
+
+@pytest.mark.parametrize('backend', engine.BACKENDS)
+@pytest.mark.parametrize('name', POSITIONS)
+def test_incremental_key_matches_full_key(backend, name):
+    _check_keys(perft.load_position(name, backend), 1 if backend == 'array' else 2)
@@ -0,0 +1,76 @@
+# -----------------------------------------------------------------------------
+# (C) 2023 Higor Grigorio (higorgrigorio@gmail.com)  (MIT License)
+# -----------------------------------------------------------------------------
+from array import array
+
+# bound types of a stored score
+EXACT = 0  # the score is the exact value of the position
+LOWER = 1  # the search failed high, the value is at least the score
+UPPER = 2  # the search failed low, the value is at most the score
+
+NO_MOVE = -1
+
+# bytes per entry: key (8) + score (8) + best move id (4) + depth (1) + bound (1)
+ENTRY_SIZE = 22
+
+
+class TranspositionTable:
+    # Fixed size hash table of searched positions, keyed by the Zobrist key of
+    # the GameState. The entries live in preallocated parallel arrays (one per
+    # field) so the memory used never grows past the size it was created with.
+    #
+    # Each bucket has two entries: the first is depth-preferred, it keeps the
+    # deepest search of the positions that map to the bucket, the second is
+    # always replaced, so recent shallow results still find a place.
+
+    def __init__(self, size_mb=16):
+        self.buckets = max(1, int(size_mb * 1024 * 1024) // (2 * ENTRY_SIZE))
+        size = 2 * self.buckets
+        self.keys = array('Q', bytes(8 * size))
+        self.scores = array('d', bytes(8 * size))
+        self.moves = array('i', [NO_MOVE]) * size
+        self.depths = array('b', [-1]) * size  # -1 marks an empty entry
+        self.bounds = array('B', bytes(size))
+        self.hits = self.misses = self.collisions = self.stores = 0
+
+    def probe(self, key):
+        # returns (depth, score, bound, move_id) stored for the position, or None
+        i = key % self.buckets * 2
+        if self.keys[i] != key or self.depths[i] < 0:
+            i += 1
+            if self.keys[i] != key or self.depths[i] < 0:
+                self.misses += 1
+                if self.depths[i - 1] >= 0 or self.depths[i] >= 0:
+                    # the bucket holds other positions with the same index
+                    self.collisions += 1
+                return None
+        self.hits += 1
+        return self.depths[i], self.scores[i], self.bounds[i], self.moves[i]
+
+    def store(self, key, depth, score, bound, move_id=NO_MOVE):
+        i = key % self.buckets * 2
+        if self.keys[i] != key and self.depths[i] > depth:
+            i += 1  # keep the deeper entry, use the always-replace one
+        self.keys[i] = key
+        self.depths[i] = depth
+        self.scores[i] = score
+        self.bounds[i] = bound
+        self.moves[i] = move_id
+        self.stores += 1
+
+    def clear(self):
+        size = 2 * self.buckets
+        self.keys = array('Q', bytes(8 * size))
+        self.depths = array('b', [-1]) * size
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = self.misses = self.collisions = self.stores = 0
+
+    def stats(self):
+        probes = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'collisions': self.collisions,
+                'stores': self.stores,
+                'hit_rate': self.hits / probes if probes else 0.0}
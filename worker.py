@@ -0,0 +1,121 @@
+# -----------------------------------------------------------------------------
+# (C) 2023 Higor Grigorio (higorgrigorio@gmail.com)  (MIT License)
+# -----------------------------------------------------------------------------
+import time
+
+import ai
+import bitboard
+
+# The engine runs in one long-lived process for the whole game. It keeps its own
+# GameState in step with the game from the moves it is sent (as move ids), so the
+# position never has to be pickled, and the transposition table stays warm from
+# one move to the next. Commands are tuples sent over a multiprocessing Pipe:
+#
+#   ('move', move_id)  a move was made on the board
+#   ('undo',)          the last move was taken back
+#   ('reset',)         a new game
+#   ('position', data) a new game from a position encoded by GameState.to_bytes
+#   ('go', search_id)  search the position, answered with ('best_move', search_id,
+#                      move_id or None, depth, principal variation as packed moves)
+#   ('stop',)          stop the running search early, it still answers its 'go'
+#   ('ponder',)        think on the opponent's time until the next command, answered
+#                      with ('pondered', move_id of the predicted reply or None, depth)
+#                      when the ponder search ends
+#   ('quit',)          end the process
+#
+# Any command that arrives while a search runs stops it (so 'undo' or 'reset'
+# never wait for the search), and the search_id lets the other side drop the
+# answers of searches it no longer cares about. Besides the time limit, a node
+# budget can bound every search, so the same commands always search the same trees.
+#
+# Pondering plays the reply the transposition table predicts for the opponent
+# and searches the position after it. If the opponent then plays that move, the
+# next 'go' is answered with the ponder result right away (or only searches the
+# time the ponder did not get to use). Any other move discards the result, the
+# table entries it stored still help the real search. Without a predicted reply
+# the position itself is searched, which fills the table for all the replies.
+
+
+def _predicted_reply(gs, moves):
+    entry = ai.transposition_table.probe(gs.zobrist_key)
+    if entry is None:
+        return None
+    for move in moves:
+        if move.move_id == entry[3]:
+            return move
+    return None
+
+
+def _ponder(gs, connection, time_limit, max_nodes):
+    # returns (reply, pondered): the predicted reply (None without one) and (zobrist
+    # key, move, depth, time left, principal variation) of the position after it,
+    # None when there is nothing to reuse
+    replies = gs.get_valid_moves()
+    if not replies:
+        return None, None
+    reply = _predicted_reply(gs, replies)
+    if reply is None:
+        ai.find_best_move(gs, replies, float('inf'), max_nodes)
+        return None, None
+
+    gs.make_move(reply)
+    key = gs.zobrist_key
+    moves = gs.get_valid_moves()
+    start = time.perf_counter()
+    move, depth, line = ai.find_best_move(gs, moves, time_limit, max_nodes) if moves else (None, 0, [])
+    elapsed = time.perf_counter() - start
+    gs.undo_move()
+    if move is None:
+        return reply, None
+    # a search that was not interrupted used all the time it wanted
+    time_left = max(0.0, time_limit - elapsed) if connection.poll() else 0.0
+    return reply, (key, move, depth, time_left, line)
+
+
+def run(connection, time_limit=None, max_nodes=None):
+    gs = bitboard.BitboardGameState()
+    ai.stop_requested = connection.poll
+    time_limit = ai.TIME_LIMIT if time_limit is None else time_limit
+    pondered = None  # (key, move, depth, time left, line) of the last ponder
+
+    while True:
+        command = connection.recv()
+        kind = command[0]
+        if kind == 'move':
+            moves_by_id = {move.move_id: move for move in gs.get_valid_moves()}
+            gs.make_move(moves_by_id[command[1]])
+        elif kind == 'undo':
+            gs.undo_move()
+        elif kind == 'reset':
+            gs = bitboard.BitboardGameState()
+            ai.transposition_table.clear()
+            pondered = None
+        elif kind == 'position':
+            gs = bitboard.BitboardGameState.from_bytes(command[1])
+            ai.transposition_table.clear()
+            pondered = None
+        elif kind == 'go':
+            moves = gs.get_valid_moves()
+            move = ai.known_move(gs, moves) if moves else None
+            depth = 0
+            line = [move] if move is not None else []
+            if move is None and moves:
+                if pondered is not None and pondered[0] == gs.zobrist_key and pondered[3] == 0:
+                    move, depth = pondered[1:3]
+                    line = pondered[4]
+                elif pondered is not None and pondered[0] == gs.zobrist_key:
+                    # the table still holds the ponder search, deepening up to where it got is quick
+                    move, depth, line = ai.find_best_move(gs, moves, pondered[3], max_nodes)
+                else:
+                    move, depth, line = ai.find_best_move(gs, moves, time_limit, max_nodes)
+            pondered = None
+            connection.send(('best_move', command[1], move.move_id if move is not None else None, depth,
+                             [line_move.packed for line_move in line]))
+        elif kind == 'ponder':
+            reply, pondered = _ponder(gs, connection, time_limit, max_nodes)
+            connection.send(('pondered', reply.move_id if reply is not None else None,
+                             pondered[2] if pondered is not None else 0))
+        elif kind == 'quit':
+            ai.close_pool()
+            break
+        # 'stop' only has to interrupt the search, there is nothing left to do